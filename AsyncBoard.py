@@ -0,0 +1,59 @@
+"""Module to use a Pymata4 board from asyncio tasks without blocking the event loop.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pymata4 import pymata4
+
+import BoardProxy
+
+
+class AsyncBoard:
+	"""Runs all board I/O on a single worker thread, so serial writes and barriers never block the event loop.
+	Calls are handled one at a time in the order they are made, so tasks can't interleave writes part way through a frame.
+	Board methods can be awaited directly, and subsystem functions that take the board can be passed to run.
+	"""
+
+	def __init__(self, board: pymata4.Pymata4):
+		"""Creates an adapter for the given board.
+
+		:param board: Pymata4 board or board proxy
+		"""
+		self.board = board
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BoardIO")
+
+	def __getattr__(self, name: str):
+		"""Returns awaitable versions of the board's methods."""
+		attribute = getattr(self.board, name)
+		if not callable(attribute):
+			return attribute
+
+		async def async_call(*args, **kwargs):
+			return await self.run(attribute, *args, **kwargs)
+
+		return async_call
+
+	async def run(self, func, *args, **kwargs):
+		"""Runs a function that uses the board on the board I/O thread.
+
+		:param func: Function to run
+
+		:returns: What the function returns.
+		"""
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+	async def barrier(self) -> bool:
+		"""Waits until the board has processed every command sent so far, see BoardProxy.barrier.
+
+		:returns: Whether the board replied in time.
+		"""
+		return await self.run(BoardProxy.barrier, self.board)
+
+	def close(self) -> None:
+		"""Waits for queued calls to finish, then stops the board I/O thread."""
+		self.executor.shutdown(wait=True)
@@ -0,0 +1,245 @@
+"""Module to reduce the serial traffic sent to a Pymata4 board.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import threading
+from pymata4 import pymata4
+from pymata4.private_constants import PrivateConstants
+
+import Metrics
+
+# Methods which only read cached data, and so don't need held writes to be sent first
+readMethods = {"analog_read", "digital_read", "sonar_read", "dht_read"}
+
+serialBytesMetricName = "serial.bytes"
+serialMessagesMetricName = "serial.messages"
+serialWritesMetricName = "serial.writes"
+
+# Plain Pymata4 boards have nowhere to keep a lock of their own, so they share this one
+plainBoardLock = threading.RLock()
+
+
+class BoardProxy:
+	"""Wraps a Pymata4 board, dropping digital writes that don't change a pin and combining writes to pins on the same port.
+	Held writes are sent on flush, before any other command, or when a pin with a held write is written to again.
+	Everything other than digital_write is passed through to the wrapped board.
+	"""
+
+	def __init__(self, board: pymata4.Pymata4):
+		"""Creates a proxy for the given board.
+		
+		:param board: Pymata4 board to wrap
+		"""
+		self.board = board
+		self.lock = threading.RLock()
+
+		# Each proxy keeps its own shadow, since pymata4's is shared by every board in the process.
+		# Every digital write has to go through the proxy for the shadow to stay correct.
+		self.portStates = [0] * len(PrivateConstants.DIGITAL_OUTPUT_PORT_PINS)
+		# Port values waiting to be sent, in the order they were first written
+		self.pendingPorts = {}
+		# Bitmask of the pins with a held write on each pending port
+		self.pendingPins = {}
+
+		self.numWrites = 0
+		self.numSuppressedWrites = 0
+		self.numCombinedWrites = 0
+		self.numSentWrites = 0
+		self.numBytesSent = 0
+
+		self.metricScope = ""
+		self.set_metric_scope("")
+
+	def set_metric_scope(self, scope: str) -> None:
+		"""Sets the scope of the board's metrics, so that several boards in one process can be told apart. See Metrics.scoped_name.
+		
+		:param scope: Name of whatever the board is used by, such as an intersection. Empty for the unscoped metrics.
+		"""
+		self.metricScope = scope
+		self.serialBytesMetric = Metrics.counter(Metrics.scoped_name(scope, serialBytesMetricName))
+		self.serialMessagesMetric = Metrics.counter(Metrics.scoped_name(scope, serialMessagesMetricName))
+		self.serialWritesMetric = Metrics.counter(Metrics.scoped_name(scope, serialWritesMetricName))
+
+	def __getattr__(self, name: str):
+		"""Passes everything that isn't handled by the proxy through to the board, sending held writes first if needed."""
+		attribute = getattr(self.board, name)
+		if not callable(attribute) or name in readMethods:
+			return attribute
+
+		def flushed_call(*args, **kwargs):
+			with self.lock:
+				self.flush()
+				return attribute(*args, **kwargs)
+
+		return flushed_call
+
+	def digital_write(self, pin: int, value: int) -> None:
+		"""Sets a digital pin. The write is held until the next flush, and dropped entirely if it doesn't change anything.
+		
+		:param pin: Arduino pin number
+		:param value: Pin value (1 or 0)
+		"""
+		port = pin // 8
+		mask = 1 << (pin % 8)
+
+		with self.lock:
+			self.numWrites += 1
+
+			portValue = self.pendingPorts.get(port, self.portStates[port])
+			newPortValue = portValue | mask if value == 1 else portValue & ~mask
+			if newPortValue == portValue:
+				self.numSuppressedWrites += 1
+				return
+
+			# A pin changing twice before a flush is a pulse, so the first edge has to be sent on its own
+			if self.pendingPins.get(port, 0) & mask:
+				self.flush()
+				newPortValue = self.portStates[port] | mask if value == 1 else self.portStates[port] & ~mask
+			elif port in self.pendingPorts:
+				self.numCombinedWrites += 1
+
+			self.pendingPorts[port] = newPortValue
+			self.pendingPins[port] = self.pendingPins.get(port, 0) | mask
+
+	def flush(self) -> int:
+		"""Sends all held writes, one message per port.
+		
+		:returns: Number of serial bytes sent.
+		"""
+		with self.lock:
+			if not self.pendingPorts:
+				return 0
+
+			message = bytearray()
+			for port, portValue in self.pendingPorts.items():
+				if portValue == self.portStates[port]:
+					continue
+
+				self.portStates[port] = portValue
+				message += bytes((PrivateConstants.DIGITAL_MESSAGE + port, portValue & 0x7f, (portValue >> 7) & 0x7f))
+
+			self.pendingPorts.clear()
+			self.pendingPins.clear()
+
+			return self._send_command(message) if message else 0
+
+	def _send_command(self, command) -> int:
+		"""Sends raw Firmata messages to the board, after any held writes.
+		
+		:param command: Encoded Firmata messages
+		
+		:returns: Number of serial bytes sent.
+		"""
+		with self.lock:
+			if self.pendingPorts:
+				self.flush()
+
+			self.board._send_command(command)
+			self.numBytesSent += len(command)
+			self.numSentWrites += 1
+
+		# Only digital port messages are sent through the proxy, everything else goes straight to the board
+		self.serialBytesMetric.inc(len(command))
+		self.serialMessagesMetric.inc(len(command) // 3)
+		self.serialWritesMetric.inc()
+
+		return len(command)
+
+	def get_write_stats(self) -> dict[str, int]:
+		"""Returns how much serial traffic the proxy has saved.
+		
+		:returns: Dictionary with the number of digital writes requested, dropped and combined, and the number of serial writes and bytes sent.
+		"""
+		return {
+			"writes": self.numWrites,
+			"suppressed": self.numSuppressedWrites,
+			"combined": self.numCombinedWrites,
+			"sentWrites": self.numSentWrites,
+			"bytesSent": self.numBytesSent
+		}
+
+	def reset_write_stats(self) -> None:
+		"""Resets the write counters."""
+		with self.lock:
+			self.numWrites = 0
+			self.numSuppressedWrites = 0
+			self.numCombinedWrites = 0
+			self.numSentWrites = 0
+			self.numBytesSent = 0
+
+
+def flush(board: pymata4.Pymata4) -> int:
+	"""Sends any writes held by a board proxy. Does nothing for a plain Pymata4 board.
+	
+	:param board: Pymata4 board or board proxy
+	
+	:returns: Number of serial bytes sent.
+	"""
+	if isinstance(board, BoardProxy):
+		return board.flush()
+
+	return 0
+
+
+def get_metric_scope(board: pymata4.Pymata4) -> str:
+	"""Returns the scope of the metrics of whatever uses a board, see BoardProxy.set_metric_scope.
+	
+	:param board: Pymata4 board or board proxy
+	
+	:returns: The proxy's scope. Plain Pymata4 boards have no scope, so their metrics are unscoped.
+	"""
+	if isinstance(board, BoardProxy):
+		return board.metricScope
+
+	return ""
+
+
+def get_owner_metric_scope(owner) -> str:
+	"""Returns the metric scope of the board a subsystem or display is connected to, for use with Metrics.timed.
+	
+	:param owner: Object with the board it uses as its board attribute
+	"""
+	return get_metric_scope(owner.board)
+
+
+def get_port_states(board: pymata4.Pymata4) -> list[int]:
+	"""Returns the shadow of the digital output ports of a board, which batched writes are encoded against.
+	
+	:param board: Pymata4 board or board proxy
+	
+	:returns: Value of each port. Board proxies have their own, plain Pymata4 boards share pymata4's.
+	"""
+	if isinstance(board, BoardProxy):
+		return board.portStates
+
+	return PrivateConstants.DIGITAL_OUTPUT_PORT_PINS
+
+
+def get_lock(board: pymata4.Pymata4) -> threading.RLock:
+	"""Returns the lock to hold while sending a burst of writes to a board, so bursts from different threads don't interleave.
+	
+	:param board: Pymata4 board or board proxy
+	
+	:returns: The proxy's own lock, so other boards aren't held up. Plain Pymata4 boards share one lock.
+	"""
+	if isinstance(board, BoardProxy):
+		return board.lock
+
+	return plainBoardLock
+
+
+def barrier(board: pymata4.Pymata4) -> bool:
+	"""Blocks until the board has processed every command sent before the call.
+	Firmata handles messages in order, so the reply to a firmware query proves that everything before it has been handled.
+	
+	:param board: Pymata4 board or board proxy
+	
+	:returns: Whether the board replied before pymata4's 4 second timeout.
+	"""
+	flush(board)
+
+	# pymata4 returns the stored reply straight away if one has already arrived, so clear it to wait for a fresh one
+	board.query_reply_data[PrivateConstants.REPORT_FIRMWARE] = ''
+	return board.get_firmware_version() is not None
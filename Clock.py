@@ -0,0 +1,112 @@
+"""Module to tell the time, through a clock that tests and simulations can swap for a virtual one.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+
+Every subsystem reads the time and sleeps through this module instead of the time module.
+Times are in seconds since the epoch, so they can be written to the event log and compared across runs.
+"""
+
+import time
+
+
+class RealClock:
+	"""Monotonic clock, anchored to the system time once when it is created.
+	Unlike time.time, it never jumps when NTP adjusts the system time, so stage timers and debounce times stay correct.
+	"""
+
+	def __init__(self):
+		self.epochOffset_ns = time.time_ns() - time.monotonic_ns()
+
+	def now(self) -> float:
+		"""Returns the time, in seconds since the epoch."""
+		return (time.monotonic_ns() + self.epochOffset_ns) / 10**9
+
+	def now_ns(self) -> int:
+		"""Returns the time, in nanoseconds since the epoch."""
+		return time.monotonic_ns() + self.epochOffset_ns
+
+	def sleep(self, seconds: float) -> None:
+		"""Blocks the calling thread for the given time."""
+		if seconds > 0:
+			time.sleep(seconds)
+
+	def spin_until_ns(self, target_ns: int) -> None:
+		"""Busy-waits until the given time. Far more accurate than sleep, but keeps a CPU core busy.
+
+		:param target_ns: Time to wait until, in nanoseconds since the epoch
+		"""
+		target_ns -= self.epochOffset_ns
+		while time.monotonic_ns() < target_ns:
+			pass
+
+
+class VirtualClock:
+	"""Clock that only moves when it is told to. Sleeping and waiting advance it straight away, so simulations run as fast as the CPU allows."""
+
+	def __init__(self, startTime: float = 0):
+		"""Creates a virtual clock.
+
+		:param startTime: [optional] Initial time, in seconds since the epoch
+		"""
+		self.currentTime_ns = round(startTime * 10**9)
+
+	def now(self) -> float:
+		"""Returns the time, in seconds since the epoch."""
+		return self.currentTime_ns / 10**9
+
+	def now_ns(self) -> int:
+		"""Returns the time, in nanoseconds since the epoch."""
+		return self.currentTime_ns
+
+	def advance(self, seconds: float) -> None:
+		"""Moves the clock forward by the given time. The clock never moves backwards."""
+		self.currentTime_ns += max(round(seconds * 10**9), 0)
+
+	def sleep(self, seconds: float) -> None:
+		"""Moves the clock forward by the given time, without blocking."""
+		self.advance(seconds)
+
+	def spin_until_ns(self, target_ns: int) -> None:
+		"""Moves the clock forward to the given time, without blocking.
+
+		:param target_ns: Time to wait until, in nanoseconds since the epoch
+		"""
+		self.currentTime_ns = max(self.currentTime_ns, target_ns)
+
+
+activeClock = RealClock()
+
+
+def set_clock(clock) -> RealClock | VirtualClock:
+	"""Makes every subsystem use the given clock. Should be done before the subsystems are initialised.
+
+	:param clock: Clock to use, such as a RealClock or a VirtualClock
+
+	:returns: The clock that was in use before, so it can be put back.
+	"""
+	global activeClock
+
+	previousClock = activeClock
+	activeClock = clock
+	return previousClock
+
+
+def now() -> float:
+	"""Returns the time from the active clock, in seconds since the epoch."""
+	return activeClock.now()
+
+
+def now_ns() -> int:
+	"""Returns the time from the active clock, in nanoseconds since the epoch."""
+	return activeClock.now_ns()
+
+
+def sleep(seconds: float) -> None:
+	"""Sleeps on the active clock for the given time, in seconds."""
+	activeClock.sleep(seconds)
+
+
+def spin_until_ns(target_ns: int) -> None:
+	"""Busy-waits on the active clock until the given time, in nanoseconds since the epoch."""
+	activeClock.spin_until_ns(target_ns)
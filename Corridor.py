@@ -0,0 +1,572 @@
+"""Module to run a corridor of intersections from a supervisor process, with one worker process per board.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+
+Each worker runs Main's normal operation loop on its own board. Per-bit serial writes and busy-waits on one board
+can't hold up the others, and the corridor spreads across every CPU core. Workers send their status to the supervisor over a pipe.
+A worker that crashes or stops responding is restarted on its own, while the rest of the corridor keeps running.
+
+Usage:
+	python Corridor.py PORT [PORT ...]			one worker per Arduino, such as COM3 COM4
+	python Corridor.py --simulate N				N workers with fake boards
+	python Corridor.py --benchmark N [--time S]	compares N fake boards in one process against one process each
+"""
+
+import argparse
+import contextlib
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+import BoardProxy
+import Clock
+import FakeBoard
+import Intersection
+import Logger
+import Main
+import Metrics
+import Scheduler
+
+# ===== User modifiable variables =====
+statusInterval = 1 # seconds between status reports from each worker
+startupTimeout = 30 # seconds a worker gets to connect to its board and send its first status
+heartbeatTimeout = 10 # seconds without a status before a running worker is treated as hung and restarted
+restartDelay = 1 # seconds before a crashed worker is restarted, doubled for every crash in a row
+maxRestartDelay = 60
+stableRunTime = 30 # seconds a worker has to run for before its crashes no longer count as in a row
+stopTimeout = 5 # seconds a worker gets to reset its outputs and shut down its board before it is killed
+statusPrintInterval = 10 # seconds between corridor status printouts
+benchmarkTime = 20 # seconds each benchmark run lasts
+
+# ===== Program constants =====
+stopCommand = "stop"
+
+# Worker states, as sent in status messages
+runningState = "running"
+serviceState = "service" # the mode switch is on, so the outputs are reset until it is turned off
+stoppedState = "stopped"
+crashedState = "crashed"
+
+# Jobs compared by the benchmark
+benchmarkJobs = ("stage", "poll", "display")
+
+# Workers are spawned rather than forked, the same as on Windows, so they never inherit the supervisor's threads or board connections
+processContext = multiprocessing.get_context("spawn")
+
+
+# ===== Worker process =====
+
+def run_worker(name: str, connection: multiprocessing.connection.Connection, overrides: list[tuple[str, str, object]],
+	reportInterval: float, quiet: bool) -> None:
+	"""Runs one intersection in normal operation until the supervisor tells it to stop. Entry point of each worker process.
+	An exception is reported to the supervisor before it ends the process, so the supervisor can restart the worker.
+
+	:param name: Name of the intersection, shown in front of its messages
+	:param connection: Worker end of the pipe to the supervisor
+	:param overrides: Settings to change before starting, as (module name, variable name, value), such as ("Main", "boardPort", "COM3")
+	:param reportInterval: Seconds between status reports
+	:param quiet: Whether to hide what normal operation prints
+	"""
+	# Ctrl+C reaches every process in the console, but only the supervisor acts on it
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	for moduleName, variableName, value in overrides:
+		setattr(importlib.import_module(moduleName), variableName, value)
+
+	# There is no console in a worker, so the scheduler runs the jobs from a single loop
+	Main.asyncRuntime = False
+
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+		try:
+			Main.init()
+			Main.scheduler.remove("liveView")
+			Main.intersection.name = name
+			start_normal_operation()
+
+			lastReportTime = 0
+			while not (connection.poll() and connection.recv() == stopCommand):
+				if Main.operationMode == Main.normalModeConstant:
+					Main.normal_operation()
+				else:
+					wait_for_mode_switch()
+
+				if Clock.now() - lastReportTime >= reportInterval:
+					lastReportTime = Clock.now()
+					connection.send(get_worker_status(name))
+
+			Main.shutdown()
+			connection.send(get_worker_status(name, stoppedState))
+		except Exception as error:
+			connection.send({"name": name, "pid": os.getpid(), "state": crashedState, "time": Clock.now(), "error": repr(error)})
+			raise
+
+
+def start_normal_operation() -> None:
+	"""Starts Main's normal operation, without going through the service menu."""
+	Main.init_normal_operation()
+	Main.operationMode = Main.normalModeConstant
+
+
+def wait_for_mode_switch() -> None:
+	"""Keeps the outputs reset while the mode switch is on, then goes back to normal operation.
+	The stage job drops Main into service mode when the switch is turned on, but a worker has no menu to show.
+	"""
+	if Main.intersection.inputs.get_mode_switch_state():
+		Main.reset_outputs()
+		Clock.sleep(Main.idleCheckInterval)
+		return
+
+	start_normal_operation()
+
+
+def get_worker_status(name: str, state: str | None = None) -> dict:
+	"""Returns the status a worker sends to the supervisor.
+
+	:param name: Name of the intersection
+	:param state: [optional] State to report. Defaults to the state of Main's operation mode.
+
+	:returns: Dictionary with the worker name, process ID, state, time, traffic stage, last vehicle distance,
+	CPU time used in seconds, scheduler job stats and every metric.
+	"""
+	if state is None:
+		state = runningState if Main.operationMode == Main.normalModeConstant else serviceState
+
+	return {
+		"name": name,
+		"pid": os.getpid(),
+		"state": state,
+		"time": Clock.now(),
+		"stage": Main.intersection.outputs.trafficStage,
+		"vehicleDistance": Main.intersection.vehicleDistance,
+		"CPUTime": time.process_time(),
+		"jobs": Main.scheduler.get_stats(),
+		"metrics": Metrics.get_snapshot()
+	}
+
+
+# ===== Supervisor =====
+
+class Worker:
+	"""A worker process as the supervisor sees it, with its latest status and restart history."""
+
+	__slots__ = (
+		"name", "overrides", "process", "connection", "status", "startTime", "lastMessageTime", "restartTime",
+		"numRestarts", "numCrashesInRow", "lastError"
+	)
+
+	def __init__(self, name: str, overrides: list[tuple[str, str, object]]):
+		"""Creates a worker. Its process isn't started until the supervisor starts it.
+
+		:param name: Name of the intersection
+		:param overrides: Settings the worker changes before starting, see run_worker
+		"""
+		self.name = name
+		self.overrides = overrides
+		self.process = None
+		self.connection = None
+		self.status = None
+		self.startTime = 0
+		self.lastMessageTime = 0
+		# Time the worker is due to be restarted, or None if it isn't waiting to be
+		self.restartTime = None
+		self.numRestarts = 0
+		self.numCrashesInRow = 0
+		self.lastError = None
+
+	def is_alive(self) -> bool:
+		"""Returns whether the worker's process is running."""
+		return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+	"""Starts a worker process per board, collects their status, and restarts any that crash without disturbing the others."""
+
+	def __init__(self, quiet: bool = False):
+		"""Creates a supervisor with no workers.
+
+		:param quiet: [optional] Whether to hide what the workers print
+		"""
+		self.quiet = quiet
+		self.workers = {}
+		self.isStopping = False
+
+	def report(self, message: str) -> None:
+		"""Prints a message from the supervisor."""
+		print(f"supervisor: {message}")
+
+	def add_worker(self, name: str, overrides: list[tuple[str, str, object]]) -> Worker:
+		"""Adds a worker, to be started with the others.
+
+		:param name: Name of the intersection. Must be unique.
+		:param overrides: Settings the worker changes before starting, see run_worker
+
+		:returns: The new worker.
+		"""
+		if name in self.workers:
+			raise ValueError(f"There is already a worker called {name}.")
+
+		worker = Worker(name, overrides)
+		self.workers[name] = worker
+		return worker
+
+	def start(self) -> None:
+		"""Starts every worker."""
+		self.isStopping = False
+		for worker in self.workers.values():
+			self.start_worker(worker)
+
+	def start_worker(self, worker: Worker) -> None:
+		"""Starts a worker's process, connected to the supervisor by a new pipe."""
+		supervisorEnd, workerEnd = processContext.Pipe()
+		worker.process = processContext.Process(
+			target=run_worker,
+			args=(worker.name, workerEnd, worker.overrides, statusInterval, self.quiet),
+			name=worker.name
+		)
+		worker.process.start()
+		# Only the worker holds its end, so the pipe closes if the worker dies
+		workerEnd.close()
+
+		worker.connection = supervisorEnd
+		worker.status = None
+		worker.startTime = worker.lastMessageTime = Clock.now()
+		worker.restartTime = None
+
+	def poll(self, timeout: float) -> None:
+		"""Collects status messages, and handles crashed, hung and due-to-restart workers.
+
+		:param timeout: Longest time to wait for a message or a worker to exit, in seconds
+		"""
+		waitables = {}
+		for worker in self.workers.values():
+			if worker.process is not None:
+				waitables[worker.connection] = worker
+				waitables[worker.process.sentinel] = worker
+
+		if waitables:
+			ready = multiprocessing.connection.wait(list(waitables), timeout)
+		else:
+			Clock.sleep(timeout)
+			ready = []
+
+		# Messages are read first, so the last status of a worker that exits is kept
+		for item in ready:
+			worker = waitables[item]
+			if item is worker.connection:
+				self.receive(worker)
+
+		for item in ready:
+			worker = waitables[item]
+			if worker.process is not None and item == worker.process.sentinel:
+				self.handle_exit(worker)
+
+		currentTime = Clock.now()
+		for worker in self.workers.values():
+			if worker.process is not None:
+				timeout = heartbeatTimeout if worker.status is not None else startupTimeout
+				if currentTime - worker.lastMessageTime > timeout:
+					self.report(f"{worker.name} hasn't responded for {currentTime - worker.lastMessageTime:.1f} seconds, restarting it.")
+					# The exit is handled once its sentinel is ready, like any other crash
+					worker.process.kill()
+					worker.lastMessageTime = currentTime
+			elif worker.restartTime is not None and currentTime >= worker.restartTime and not self.isStopping:
+				worker.numRestarts += 1
+				self.report(f"Restarting {worker.name} (restart {worker.numRestarts}).")
+				self.start_worker(worker)
+
+	def receive(self, worker: Worker) -> None:
+		"""Reads every message waiting from a worker."""
+		try:
+			while worker.connection.poll():
+				status = worker.connection.recv()
+				worker.lastMessageTime = Clock.now()
+
+				if status["state"] == crashedState:
+					worker.lastError = status["error"]
+					self.report(f"{worker.name} crashed: {worker.lastError}")
+				else:
+					worker.status = status
+		except (EOFError, OSError):
+			# The worker has gone, its exit is handled from its sentinel
+			pass
+
+	def handle_exit(self, worker: Worker) -> None:
+		"""Cleans up after a worker's process exits, and schedules a restart unless the supervisor stopped it."""
+		worker.process.join()
+		exitCode = worker.process.exitcode
+		runTime = Clock.now() - worker.startTime
+
+		worker.connection.close()
+		worker.process = None
+		worker.connection = None
+
+		if self.isStopping:
+			return
+
+		# A worker only exits when told to, so any other exit is a crash
+		if runTime >= stableRunTime:
+			worker.numCrashesInRow = 0
+
+		delay = min(restartDelay * 2**worker.numCrashesInRow, maxRestartDelay)
+		worker.numCrashesInRow += 1
+		worker.restartTime = Clock.now() + delay
+		self.report(f"{worker.name} exited with code {exitCode} after {runTime:.1f} seconds, restarting in {delay:.0f} seconds.")
+
+	def stop(self) -> None:
+		"""Tells every worker to reset its outputs and shut down its board, and kills any that don't in time."""
+		self.isStopping = True
+
+		for worker in self.workers.values():
+			if worker.is_alive():
+				try:
+					worker.connection.send(stopCommand)
+				except OSError:
+					pass
+
+		deadline = Clock.now() + stopTimeout
+		for worker in self.workers.values():
+			if worker.process is None:
+				continue
+
+			worker.process.join(max(deadline - Clock.now(), 0))
+			if worker.process.is_alive():
+				self.report(f"{worker.name} didn't stop in time, killing it.")
+				worker.process.kill()
+
+			self.receive(worker)
+			self.handle_exit(worker)
+
+	def run(self, runTime: float | None = None, printInterval: float | None = statusPrintInterval) -> None:
+		"""Starts the workers and supervises them until Ctrl+C or the run time is up, then stops them.
+
+		:param runTime: [optional] Seconds to run for. Runs until Ctrl+C if None.
+		:param printInterval: [optional] Seconds between status printouts. None to not print the status.
+		"""
+		self.start()
+
+		startTime = Clock.now()
+		nextPrintTime = startTime + printInterval if printInterval is not None else float("inf")
+		try:
+			while runTime is None or Clock.now() - startTime < runTime:
+				self.poll(statusInterval / 2)
+
+				if Clock.now() >= nextPrintTime:
+					nextPrintTime += printInterval
+					print(self.format_status())
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.report("Stopping workers...")
+			self.stop()
+
+	def get_statuses(self) -> dict[str, dict | None]:
+		"""Returns the latest status of every worker, see get_worker_status. A worker that hasn't reported yet has None."""
+		return {name: worker.status for name, worker in self.workers.items()}
+
+	def format_status(self) -> str:
+		"""Returns a summary of every worker, one line per worker."""
+		lines = []
+		for worker in self.workers.values():
+			status = worker.status
+			if worker.process is None:
+				state = stoppedState if worker.restartTime is None else "waiting to restart"
+			elif status is None:
+				state = "starting"
+			else:
+				state = status["state"]
+
+			line = f"{worker.name}: {state}, {worker.numRestarts} restarts"
+			if status is not None:
+				stageStats = status["jobs"]["stage"]
+				latency = status["metrics"]["histograms"]["main.loopLatency"]
+				line += (f", stage {status['stage'] + 1}, {stageStats['missed']} missed stage deadlines, "
+					f"loop latency p99 {latency['p99'] / 10**6:.2f} ms, {status['CPUTime']:.1f} s CPU")
+
+			lines.append(line)
+
+		return "\n".join(lines)
+
+
+# ===== Benchmark =====
+
+def benchmark_single_process(numBoards: int, runTime: float) -> dict:
+	"""Runs simulated boards from one scheduler in this process, in real time, as a baseline for the supervisor.
+
+	:param numBoards: Number of simulated boards
+	:param runTime: Seconds to run for
+
+	:returns: Dictionary of combined job stats, see combine_job_stats, with the wall and CPU time in seconds.
+	"""
+	scheduler = Scheduler.Scheduler()
+	corridor = []
+
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		for i in range(numBoards):
+			intersection = Intersection.Intersection(BoardProxy.BoardProxy(FakeBoard.FakeBoard()), f"junction{i + 1}", number=i + 1)
+			intersection.outputs.sevenSegBackgroundRefresh = False
+			intersection.outputs.sevenSegExternalRefresh = True
+			intersection.init()
+			intersection.start()
+			intersection.add_jobs(scheduler)
+			corridor.append(intersection)
+
+		startCPUTime = time.process_time()
+		startTime = Clock.now()
+		scheduler.start()
+		while Clock.now() - startTime < runTime:
+			scheduler.run_pending()
+			scheduler.wait()
+
+		wallTime = Clock.now() - startTime
+		CPUTime = time.process_time() - startCPUTime
+
+		for intersection in corridor:
+			intersection.shutdown()
+
+		Logger.flush()
+
+	# Job names are prefixed by their intersection
+	allStats = scheduler.get_stats()
+	jobStats = [{job: allStats[f"{intersection.name}.{job}"] for job in benchmarkJobs} for intersection in corridor]
+	return {**combine_job_stats(jobStats), "wallTime": wallTime, "CPUTime": CPUTime}
+
+
+def benchmark_supervisor(numBoards: int, runTime: float) -> dict:
+	"""Runs simulated boards with one worker process each, in real time.
+
+	:param numBoards: Number of simulated boards
+	:param runTime: Seconds to run for, once every worker has started
+
+	:returns: Dictionary of combined job stats, see combine_job_stats, with the wall time and the CPU time of every worker in seconds.
+	"""
+	supervisor = Supervisor(quiet=True)
+	for i in range(numBoards):
+		supervisor.add_worker(f"junction{i + 1}", [
+			("Main", "simulateBoard", True),
+			("Main", "eventLogDirectory", None),
+			# The same display refresh as the single process run, from the scheduler rather than a thread per board
+			("outputsSubsystem", "sevenSegBackgroundRefresh", False)
+		])
+
+	supervisor.start()
+	try:
+		# Workers take a while to spawn, so the timed run starts once they have all reported
+		while any(worker.status is None for worker in supervisor.workers.values()):
+			supervisor.poll(statusInterval / 2)
+
+		startStatuses = supervisor.get_statuses()
+		startTime = Clock.now()
+		while Clock.now() - startTime < runTime:
+			supervisor.poll(statusInterval / 2)
+	finally:
+		supervisor.stop()
+
+	wallTime = Clock.now() - startTime
+	endStatuses = supervisor.get_statuses()
+
+	jobStats = []
+	CPUTime = 0
+	for name, status in endStatuses.items():
+		startJobs = startStatuses[name]["jobs"]
+		jobStats.append({job: subtract_job_stats(stats, startJobs[job]) for job, stats in status["jobs"].items()})
+		CPUTime += status["CPUTime"] - startStatuses[name]["CPUTime"]
+
+	return {**combine_job_stats(jobStats), "wallTime": wallTime, "CPUTime": CPUTime}
+
+
+def subtract_job_stats(stats: dict[str, float], startStats: dict[str, float]) -> dict[str, float]:
+	"""Returns the runs and missed deadlines of a job since an earlier snapshot. The maximum lateness can't be split, so it is kept."""
+	return {
+		"runs": stats["runs"] - startStats["runs"],
+		"missed": stats["missed"] - startStats["missed"],
+		"maxLateness": stats["maxLateness"]
+	}
+
+
+def combine_job_stats(jobStats: list[dict[str, dict[str, float]]]) -> dict[str, dict[str, float]]:
+	"""Adds up the stats of the benchmarked jobs across intersections.
+
+	:param jobStats: Scheduler job stats of each intersection, keyed by job name without the intersection's name
+
+	:returns: Dictionary with the total runs and missed deadlines, and the largest maximum lateness, of each benchmarked job.
+	"""
+	combined = {}
+	for job in benchmarkJobs:
+		jobs = [stats[job] for stats in jobStats if job in stats]
+		combined[job] = {
+			"runs": sum(stats["runs"] for stats in jobs),
+			"missed": sum(stats["missed"] for stats in jobs),
+			"maxLateness": max((stats["maxLateness"] for stats in jobs), default=0)
+		}
+
+	return combined
+
+
+def benchmark(numBoards: int, runTime: float = benchmarkTime) -> dict[str, dict]:
+	"""Runs the same simulated corridor from one process, then from one worker process per board, so the two can be compared.
+
+	:param numBoards: Number of simulated boards
+	:param runTime: [optional] Seconds each run lasts
+
+	:returns: Dictionary with the results of the "single process" and "worker per board" runs.
+	"""
+	return {
+		"single process": benchmark_single_process(numBoards, runTime),
+		"worker per board": benchmark_supervisor(numBoards, runTime)
+	}
+
+
+def format_benchmark(results: dict[str, dict], numBoards: int) -> str:
+	"""Returns a human readable comparison of benchmark results."""
+	lines = [f"{numBoards} simulated boards on {os.cpu_count()} CPU cores:"]
+	for runName, result in results.items():
+		lines.append(f"{runName}: {result['wallTime']:.1f} s, {result['CPUTime']:.1f} s CPU")
+		for job in benchmarkJobs:
+			stats = result[job]
+			lines.append(f"  {job}: {stats['runs']} runs, {stats['missed']} missed deadlines, "
+				f"{stats['maxLateness'] * 1000:.2f} ms max lateness")
+
+	return "\n".join(lines)
+
+
+def main() -> None:
+	"""Runs the supervisor or the benchmark from the command line."""
+	parser = argparse.ArgumentParser(description="Runs a corridor of intersections, with one worker process per board.")
+	parser.add_argument("ports", nargs="*", help="serial port of each Arduino")
+	parser.add_argument("--simulate", type=int, metavar="N", help="run N fake boards instead")
+	parser.add_argument("--benchmark", type=int, metavar="N", help="compare N fake boards in one process against one process each")
+	parser.add_argument("--time", type=float, help="seconds to run for")
+	parser.add_argument("--quiet", action="store_true", help="hide what the workers print")
+	args = parser.parse_args()
+
+	if args.benchmark is not None:
+		print(format_benchmark(benchmark(args.benchmark, args.time or benchmarkTime), args.benchmark))
+		return
+
+	supervisor = Supervisor(quiet=args.quiet)
+	if args.simulate is not None:
+		for i in range(args.simulate):
+			name = f"junction{i + 1}"
+			supervisor.add_worker(name, [("Main", "simulateBoard", True), ("Main", "eventLogDirectory", None)])
+	elif args.ports:
+		for i, port in enumerate(args.ports):
+			name = f"junction{i + 1}"
+			overrides = [("Main", "boardPort", port)]
+			# Each board logs to its own directory, so the logs can be replayed separately
+			if Main.eventLogDirectory is not None:
+				overrides.append(("Main", "eventLogDirectory", os.path.join(Main.eventLogDirectory, name)))
+
+			supervisor.add_worker(name, overrides)
+	else:
+		parser.error("give the serial port of each board, or --simulate or --benchmark")
+
+	supervisor.run(args.time)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,214 @@
+"""Module to record sensor readings, stage changes, alerts and timings to an append-only binary log.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+
+Every record is 24 bytes, little endian: time (float64 seconds since the epoch), event type (uint8), source (uint8),
+intersection (uint8), 5 padding bytes, then value (float64). Logs are split into numbered segment files of at most segmentRecords records each.
+The intersection tells apart the events of several intersections run from one process. A lone intersection is number 0,
+which is also what logs from before the field was added read as.
+"""
+
+import glob
+import os
+import struct
+import threading
+
+import numpy as np
+
+import Clock
+
+# Event types
+sonarEvent = 1 # source is the ultrasonic sensor index, value is the distance in cm
+digitalInputEvent = 2 # source is the pin, value is the new level
+ldrEvent = 3 # value is the raw LDR reading
+dayNightEvent = 4 # value is 1 for night and 0 for day
+stageEvent = 5 # source is the new traffic stage (0 for stage 1), value is the time left in it in seconds
+alertEvent = 6 # source is one of the alert constants below, value is the speed, position or height that caused it
+loopTimingEvent = 7 # source is one of the timing constants below, value is in seconds
+
+# Alert sources
+redLightAlert = 0
+stallAlert = 1
+overHeightAlert = 2
+
+# Loop timing sources
+loopLatencyTiming = 0
+pollIntervalTiming = 1
+
+recordStruct = struct.Struct("<dBBB5xd")
+recordType = np.dtype({
+	"names": ["time", "event", "source", "intersection", "value"],
+	"formats": ["<f8", "u1", "u1", "u1", "<f8"],
+	"offsets": [0, 8, 9, 10, 16],
+	"itemsize": recordStruct.size
+})
+
+segmentRecords = 1 << 16 # about 1.5 MB per segment
+flushInterval = 1 # seconds between writes to disk
+maxBufferedRecords = 1 << 16 # records held in memory before new ones are dropped
+segmentFilePattern = "events-{:06d}.bin"
+
+
+class EventLog:
+	"""Writes records to segment files from a background thread.
+	Logging only appends to an in-memory buffer, so it never waits on the disk. If the disk can't keep up, records are dropped and counted.
+	"""
+
+	def __init__(self, directory: str):
+		"""Opens a new segment in the given directory and starts the writer thread.
+		Numbering carries on from any segments already there, so earlier logs are never overwritten.
+
+		:param directory: Directory to write segments to. Created if it doesn't exist.
+		"""
+		self.directory = directory
+		os.makedirs(directory, exist_ok=True)
+
+		existingPaths = get_segment_paths(directory)
+		self.segmentNumber = get_segment_number(existingPaths[-1]) + 1 if existingPaths else 0
+		self.segmentFile = None
+		self.segmentLength = 0
+		self.open_segment()
+
+		self.buffer = bytearray()
+		self.bufferLock = threading.Lock()
+		self.numDropped = 0
+		self.numWritten = 0
+
+		self.stopEvent = threading.Event()
+		self.writerThread = threading.Thread(target=self.writer_loop, name="EventLogWriter", daemon=True)
+		self.writerThread.start()
+
+	def open_segment(self) -> None:
+		"""Closes the current segment, if any, and starts the next one."""
+		if self.segmentFile is not None:
+			self.segmentFile.close()
+
+		path = os.path.join(self.directory, segmentFilePattern.format(self.segmentNumber))
+		self.segmentFile = open(path, "ab")
+		self.segmentLength = 0
+		self.segmentNumber += 1
+
+	def log(self, event: int, source: int, value: float, timestamp: float | None = None, intersection: int = 0) -> None:
+		"""Adds a record to the log.
+
+		:param event: Event type, one of the event constants
+		:param source: Which sensor, pin, stage or alert the event is about
+		:param value: Value of the event
+		:param timestamp: [optional] Time of the event in seconds since the epoch. Defaults to the clock time.
+		:param intersection: [optional] Number of the intersection the event is from, see Intersection.Intersection
+		"""
+		record = recordStruct.pack(Clock.now() if timestamp is None else timestamp, event, source, intersection, value)
+
+		with self.bufferLock:
+			if len(self.buffer) >= maxBufferedRecords * recordStruct.size:
+				self.numDropped += 1
+				return
+
+			self.buffer += record
+
+	def writer_loop(self) -> None:
+		"""Writes buffered records to disk every flushInterval until the log is closed. Runs on the writer thread."""
+		while not self.stopEvent.wait(flushInterval):
+			self.write_buffer()
+
+		self.write_buffer()
+
+	def write_buffer(self) -> None:
+		"""Writes every buffered record to disk, starting new segments as they fill up."""
+		with self.bufferLock:
+			data = self.buffer
+			self.buffer = bytearray()
+
+		numRecords = len(data) // recordStruct.size
+		written = 0
+		while written < numRecords:
+			if self.segmentLength == segmentRecords:
+				self.open_segment()
+
+			chunkLength = min(numRecords - written, segmentRecords - self.segmentLength)
+			self.segmentFile.write(data[written * recordStruct.size:(written + chunkLength) * recordStruct.size])
+			self.segmentLength += chunkLength
+			written += chunkLength
+
+		if numRecords:
+			self.segmentFile.flush()
+			self.numWritten += numRecords
+
+	def close(self) -> None:
+		"""Writes any buffered records, then stops the writer thread and closes the segment."""
+		self.stopEvent.set()
+		self.writerThread.join()
+		self.segmentFile.close()
+
+	def get_stats(self) -> dict[str, int]:
+		"""Returns how many records have been written, are waiting to be written, and have been dropped."""
+		with self.bufferLock:
+			numBuffered = len(self.buffer) // recordStruct.size
+
+		return {"written": self.numWritten, "buffered": numBuffered, "dropped": self.numDropped}
+
+
+activeLog = None
+
+
+def start(directory: str) -> None:
+	"""Starts logging events from every subsystem to the given directory."""
+	global activeLog
+
+	stop()
+	activeLog = EventLog(directory)
+
+
+def stop() -> None:
+	"""Stops logging, and writes any buffered records."""
+	global activeLog
+
+	if activeLog is not None:
+		activeLog.close()
+		activeLog = None
+
+
+def log_event(event: int, source: int, value: float, timestamp: float | None = None, intersection: int = 0) -> None:
+	"""Adds a record to the active log. Does nothing if logging hasn't been started. See EventLog.log."""
+	if activeLog is not None:
+		activeLog.log(event, source, value, timestamp, intersection)
+
+
+def get_segment_number(path: str) -> int:
+	"""Returns the number of a segment from its file name."""
+	return int(os.path.basename(path).split("-")[1].split(".")[0])
+
+
+def get_segment_paths(directory: str) -> list[str]:
+	"""Returns the paths of every segment in a directory, oldest first."""
+	return sorted(glob.glob(os.path.join(directory, segmentFilePattern.replace("{:06d}", "[0-9]" * 6))))
+
+
+def read_segment(path: str) -> np.ndarray:
+	"""Memory-maps a segment as a read-only structured array, with fields time, event, source and value.
+	A record left half written by a crash is ignored.
+
+	:param path: Path of the segment file
+
+	:returns: Array of records, oldest first.
+	"""
+	numRecords = os.path.getsize(path) // recordStruct.size
+	if numRecords == 0:
+		return np.zeros(0, dtype=recordType)
+
+	return np.memmap(path, dtype=recordType, mode="r", shape=(numRecords,))
+
+
+def read_log(directory: str) -> np.ndarray:
+	"""Reads every segment in a directory into one structured array. Unlike read_segment, the records are copied into memory.
+
+	:param directory: Directory containing the segments
+
+	:returns: Array of records, oldest first.
+	"""
+	segments = [read_segment(path) for path in get_segment_paths(directory)]
+	if not segments:
+		return np.zeros(0, dtype=recordType)
+
+	return np.concatenate(segments)
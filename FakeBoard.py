@@ -0,0 +1,418 @@
+"""Module with a stand-in for a Pymata4 board, so the system can run without an Arduino connected.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+from pymata4.private_constants import PrivateConstants
+
+import Clock
+
+# Serial link model
+defaultBaudRate = 115200
+bitsPerByte = 10 # 8 data bits, plus a start and stop bit
+
+# Arduino Uno pin counts
+numDigitPins = 20
+numAnalogPins = 6
+firstAnalogPin = 14
+
+# Firmware reported by the fake board
+firmwareVersion = "1.2 FirmataExpress.ino"
+
+# Input script event types
+digitalInputEvent = "digital"
+analogInputEvent = "analog"
+sonarEvent = "sonar"
+
+
+class FakeBoard:
+	"""Loopback stand-in for pymata4.Pymata4, implementing the methods this project uses.
+	Every call is encoded into the Firmata bytes a real board would be sent, and the transmit time of those bytes is added up.
+	Input values are set directly, or scripted ahead of time, and fire callbacks the same way pymata4 does.
+	Writes are looped back, so tests can read the level of each output pin and the outputs of attached shift registers.
+	"""
+
+	def __init__(self, baudRate: int = defaultBaudRate, realTime: bool = False):
+		"""Creates a fake board.
+		
+		:param baudRate: Baud rate of the modelled serial link
+		:param realTime: Whether to block for the transmit time of every message, like a real serial port with a full buffer.
+		"""
+		self.baudRate = baudRate
+		self.realTime = realTime
+		self.startTime = Clock.now()
+		self.isShutDown = False
+
+		self.pinModes = {}
+		self.outputPorts = [0] * ((numDigitPins + 7) // 8)
+
+		# Input values, and the time each was last changed
+		self.digitalInputs = [[0, 0] for _ in range(numDigitPins)]
+		self.analogInputs = [[0, 0] for _ in range(numAnalogPins)]
+		self.sonarInputs = {}
+
+		self.digitalCallbacks = {}
+		self.analogCallbacks = {}
+		self.analogDifferentials = {}
+		self.sonarCallbacks = {}
+
+		# Scripted input events as (time since start, event type, pin, value), sorted by time
+		self.inputScript = []
+		self.nextScriptEvent = 0
+
+		# Shift registers attached to the outputs, keyed by RCLK pin
+		self.shiftRegisters = {}
+
+		# Replies to queries, in the same form pymata4 stores them
+		self.query_reply_data = {PrivateConstants.REPORT_FIRMWARE: ''}
+
+		self.reset_serial_stats()
+
+	# ===== Serial model =====
+
+	def reset_serial_stats(self) -> None:
+		"""Resets the serial traffic counters."""
+		self.numBytesSent = 0
+		self.numMessagesSent = 0
+		self.numSerialWrites = 0
+		self.wireTime = 0
+
+	def get_serial_stats(self) -> dict[str, float]:
+		"""Returns the serial traffic sent to the board since the last reset.
+		
+		:returns: Dictionary with the number of bytes, Firmata messages and serial writes sent, and the time they take on the wire in seconds.
+		"""
+		return {
+			"bytes": self.numBytesSent,
+			"messages": self.numMessagesSent,
+			"writes": self.numSerialWrites,
+			"wireTime": self.wireTime
+		}
+
+	def _send_command(self, command) -> int:
+		"""Sends raw Firmata messages to the board. Digital port messages are looped back to the outputs.
+		
+		:param command: Encoded Firmata messages
+		
+		:returns: Number of bytes sent.
+		"""
+		data = bytes(command)
+
+		transmitTime = len(data) * bitsPerByte / self.baudRate
+		self.numBytesSent += len(data)
+		self.numSerialWrites += 1
+		self.wireTime += transmitTime
+
+		i = 0
+		while i < len(data):
+			messageLength = get_message_length(data, i)
+			if PrivateConstants.DIGITAL_MESSAGE <= data[i] < PrivateConstants.DIGITAL_MESSAGE + 16:
+				self.set_output_port(data[i] - PrivateConstants.DIGITAL_MESSAGE, data[i + 1] | (data[i + 2] << 7))
+			self.numMessagesSent += 1
+			i += messageLength
+
+		if self.realTime:
+			Clock.sleep(transmitTime)
+
+		return len(data)
+
+	# ===== Pin modes =====
+
+	def set_pin_mode_digital_output(self, pin_number: int) -> None:
+		"""Sets a pin as a digital output."""
+		self.pinModes[pin_number] = PrivateConstants.OUTPUT
+		self._send_command((PrivateConstants.SET_PIN_MODE, pin_number, PrivateConstants.OUTPUT))
+
+	def set_pin_mode_digital_input(self, pin_number: int, callback=None) -> None:
+		"""Sets a pin as a digital input, and enables reporting for its port."""
+		self.pinModes[pin_number] = PrivateConstants.INPUT
+		if callback:
+			self.digitalCallbacks[pin_number] = callback
+
+		self._send_command((PrivateConstants.SET_PIN_MODE, pin_number, PrivateConstants.INPUT))
+		self._send_command((PrivateConstants.REPORT_DIGITAL + pin_number // 8, PrivateConstants.REPORTING_ENABLE))
+
+	def set_pin_mode_analog_input(self, pin_number: int, callback=None, differential: int = 1) -> None:
+		"""Sets an analog pin (0 for A0) as an analog input."""
+		self.pinModes[pin_number + firstAnalogPin] = PrivateConstants.ANALOG
+		if callback:
+			self.analogCallbacks[pin_number] = callback
+			self.analogDifferentials[pin_number] = differential
+
+		self._send_command((PrivateConstants.SET_PIN_MODE, pin_number + firstAnalogPin, PrivateConstants.ANALOG))
+
+	def set_pin_mode_sonar(self, trigger_pin: int, echo_pin: int, callback=None, timeout: int = 80000) -> None:
+		"""Configures an HC-SR04 ultrasonic sensor."""
+		if trigger_pin in self.sonarInputs:
+			return
+
+		self.sonarInputs[trigger_pin] = [0, 0]
+		if callback:
+			self.sonarCallbacks[trigger_pin] = callback
+
+		for pin in (trigger_pin, echo_pin):
+			self.pinModes[pin] = PrivateConstants.SONAR
+			self._send_command((PrivateConstants.SET_PIN_MODE, pin, PrivateConstants.SONAR))
+			self._send_command((PrivateConstants.REPORT_DIGITAL + pin // 8, PrivateConstants.REPORTING_ENABLE))
+
+		self._send_command((PrivateConstants.START_SYSEX, PrivateConstants.SONAR_CONFIG, trigger_pin, echo_pin,
+			timeout & 0x7f, (timeout >> 7) & 0x7f, PrivateConstants.END_SYSEX))
+
+	# ===== Outputs =====
+
+	def digital_write(self, pin: int, value: int) -> None:
+		"""Sets a digital output pin, sending the pin's whole port like pymata4 does."""
+		port = pin // 8
+		if value == 1:
+			PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] |= 1 << (pin % 8)
+		else:
+			PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] &= ~(1 << (pin % 8))
+
+		portValue = PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port]
+		self._send_command((PrivateConstants.DIGITAL_MESSAGE + port, portValue & 0x7f, (portValue >> 7) & 0x7f))
+
+	def set_output_port(self, port: int, portValue: int) -> None:
+		"""Applies a digital port message to the looped back outputs, clocking any attached shift registers.
+		
+		:param port: Port number
+		:param portValue: New level of each pin in the port
+		"""
+		prevPortValue = self.outputPorts[port]
+		self.outputPorts[port] = portValue
+
+		for shiftRegister in self.shiftRegisters.values():
+			if self.edge_rose(shiftRegister["srClkPin"], port, prevPortValue):
+				serLevel = self.get_digital_output(shiftRegister["serPin"])
+				shiftRegister["stored"] = ((shiftRegister["stored"] << 1) | serLevel) & ((1 << shiftRegister["length"]) - 1)
+			if self.edge_rose(shiftRegister["rClkPin"], port, prevPortValue):
+				shiftRegister["output"] = shiftRegister["stored"]
+				shiftRegister["latches"] += 1
+
+	def edge_rose(self, pin: int, port: int, prevPortValue: int) -> bool:
+		"""Checks whether the last write to a port gave a pin a rising edge.
+		
+		:param pin: Pin to check
+		:param port: Port that was written to
+		:param prevPortValue: Value of the port before the write
+		
+		:returns: Whether the pin went from low to high.
+		"""
+		if pin // 8 != port:
+			return False
+
+		mask = 1 << (pin % 8)
+		return not prevPortValue & mask and bool(self.outputPorts[port] & mask)
+
+	def get_digital_output(self, pin: int) -> int:
+		"""Returns the level the board is driving an output pin at.
+		
+		:param pin: Arduino pin number
+		
+		:returns: 1 if the pin is high, otherwise 0.
+		"""
+		return (self.outputPorts[pin // 8] >> (pin % 8)) & 1
+
+	def attach_shift_register(self, serPin: int, srClkPin: int, rClkPin: int, length: int = 16) -> None:
+		"""Connects a simulated shift register chain to the outputs.
+		
+		:param serPin: Arduino pin connected to SER
+		:param srClkPin: Arduino pin connected to SRCLK
+		:param rClkPin: Arduino pin connected to RCLK
+		:param length: Number of outputs in the chain
+		"""
+		self.shiftRegisters[rClkPin] = {
+			"serPin": serPin,
+			"srClkPin": srClkPin,
+			"rClkPin": rClkPin,
+			"length": length,
+			"stored": 0,
+			"output": 0,
+			"latches": 0
+		}
+
+	def get_shift_register_output(self, rClkPin: int) -> int:
+		"""Returns the latched outputs of an attached shift register chain.
+		
+		:param rClkPin: RCLK pin of the chain
+		
+		:returns: Outputs as a bitfield, where bit 0 is QA.
+		"""
+		return self.shiftRegisters[rClkPin]["output"]
+
+	# ===== Inputs =====
+
+	def digital_read(self, pin: int) -> list:
+		"""Returns the last value of a digital input pin, and the time it changed."""
+		self.run_input_script()
+		return list(self.digitalInputs[pin])
+
+	def analog_read(self, pin: int) -> tuple:
+		"""Returns the last value of an analog input pin (0 for A0), and the time it changed."""
+		self.run_input_script()
+		return tuple(self.analogInputs[pin])
+
+	def sonar_read(self, trigger_pin: int) -> list | None:
+		"""Returns the last distance measured by an ultrasonic sensor, and the time it changed."""
+		self.run_input_script()
+		if trigger_pin in self.sonarInputs:
+			return list(self.sonarInputs[trigger_pin])
+
+	def set_digital_input(self, pin: int, value: int) -> None:
+		"""Sets the level of a digital input pin, calling its callback if the level changed.
+		
+		:param pin: Arduino pin number
+		:param value: New level
+		"""
+		if self.digitalInputs[pin][0] == value:
+			return
+
+		self.digitalInputs[pin] = [value, Clock.now()]
+		if pin in self.digitalCallbacks:
+			self.digitalCallbacks[pin]([PrivateConstants.INPUT, pin, value, self.digitalInputs[pin][1]])
+
+	def set_analog_input(self, pin: int, value: int) -> None:
+		"""Sets the value of an analog input pin (0 for A0). Like pymata4, the change is only reported if it is larger than the differential.
+		
+		:param pin: Analog pin number
+		:param value: New reading, between 0 and 1023
+		"""
+		if abs(value - self.analogInputs[pin][0]) < self.analogDifferentials.get(pin, 1):
+			return
+
+		self.analogInputs[pin] = [value, Clock.now()]
+		if pin in self.analogCallbacks:
+			self.analogCallbacks[pin]([PrivateConstants.ANALOG, pin, value, self.analogInputs[pin][1]])
+
+	def set_sonar_distance(self, trigger_pin: int, distance: int) -> None:
+		"""Sets the distance measured by an ultrasonic sensor, calling its callback if the distance changed.
+		Like pymata4, a distance of 0 (no echo) is stored without calling the callback.
+		
+		:param trigger_pin: Trigger pin of the sensor
+		:param distance: New distance, in cm
+		"""
+		if self.sonarInputs[trigger_pin][0] == distance:
+			return
+
+		self.sonarInputs[trigger_pin] = [distance, Clock.now()]
+		if distance != 0 and trigger_pin in self.sonarCallbacks:
+			self.sonarCallbacks[trigger_pin]([PrivateConstants.SONAR, trigger_pin, distance, self.sonarInputs[trigger_pin][1]])
+
+	def load_input_script(self, events: list[tuple[float, str, int, int]]) -> None:
+		"""Scripts input changes ahead of time. Events are applied once their time has passed, checked whenever an input is read.
+		
+		:param events: List of (seconds since now, event type, pin, value), where event type is digitalInputEvent, analogInputEvent or sonarEvent.
+		"""
+		self.startTime = Clock.now()
+		self.inputScript = sorted(events, key=lambda event: event[0])
+		self.nextScriptEvent = 0
+
+	def run_input_script(self) -> None:
+		"""Applies every scripted input event that is due."""
+		elapsedTime = Clock.now() - self.startTime
+
+		while self.nextScriptEvent < len(self.inputScript) and self.inputScript[self.nextScriptEvent][0] <= elapsedTime:
+			_, eventType, pin, value = self.inputScript[self.nextScriptEvent]
+			self.nextScriptEvent += 1
+
+			if eventType == digitalInputEvent:
+				self.set_digital_input(pin, value)
+			elif eventType == analogInputEvent:
+				self.set_analog_input(pin, value)
+			elif eventType == sonarEvent:
+				self.set_sonar_distance(pin, value)
+
+	# ===== Queries =====
+
+	def get_firmware_version(self) -> str:
+		"""Sends a firmware query. The reply arrives once every earlier message is on the wire, since the link is modelled in order."""
+		self._send_command((PrivateConstants.START_SYSEX, PrivateConstants.REPORT_FIRMWARE, PrivateConstants.END_SYSEX))
+		self.query_reply_data[PrivateConstants.REPORT_FIRMWARE] = firmwareVersion
+
+		return firmwareVersion
+
+	# ===== Shutdown =====
+
+	def shutdown(self) -> None:
+		"""Disables reporting on every pin and resets the board, like pymata4 does."""
+		if self.isShutDown:
+			return
+
+		for pin in range(numAnalogPins):
+			self._send_command((PrivateConstants.REPORT_ANALOG + pin, PrivateConstants.REPORTING_DISABLE))
+		for pin in range(numDigitPins):
+			self._send_command((PrivateConstants.REPORT_DIGITAL + pin // 8, PrivateConstants.REPORTING_DISABLE))
+		self._send_command((PrivateConstants.SYSTEM_RESET,))
+
+		self.isShutDown = True
+
+
+def get_message_length(data: bytes, start: int) -> int:
+	"""Works out the length of the Firmata message starting at the given index.
+	
+	:param data: Encoded Firmata messages
+	:param start: Index of the first byte of the message
+	
+	:returns: Number of bytes in the message.
+	"""
+	command = data[start]
+
+	if command == PrivateConstants.START_SYSEX:
+		return data.index(PrivateConstants.END_SYSEX, start) - start + 1
+	if command in (PrivateConstants.SYSTEM_RESET, PrivateConstants.REPORT_VERSION):
+		return 1
+	if PrivateConstants.REPORT_ANALOG <= command < PrivateConstants.REPORT_DIGITAL + 16:
+		return 2
+
+	return 3
+
+
+if __name__ == "__main__":
+	# Measures the serial cost of each pass of normal operation, then checks the display stays within its byte budget
+	import Main
+	import SevenSeg
+	import inputsSubsystem as inputs
+	import outputsSubsystem as outputs
+
+	numPasses = 200
+	displayCheckTime = 10 # seconds of display refreshes, on a virtual clock
+
+	Main.simulateBoard = True
+	# Refresh the display from the control loop, so each pass includes its own display traffic
+	outputs.sevenSegBackgroundRefresh = False
+
+	Main.init()
+	Main.operationMode = Main.normalModeConstant
+	Main.init_normal_operation()
+
+	fakeBoard = Main.intersection.board.board
+	fakeBoard.set_sonar_distance(inputs.ultrasonicTriggers[0], 100)
+	fakeBoard.set_sonar_distance(inputs.ultrasonicTriggers[1], 20)
+	fakeBoard.reset_serial_stats()
+
+	for i in range(numPasses):
+		Main.normal_operation()
+
+	stats = fakeBoard.get_serial_stats()
+	print(f"Per pass: {stats['bytes'] / numPasses:.1f} bytes, {stats['messages'] / numPasses:.1f} messages, "
+		f"{stats['writes'] / numPasses:.1f} serial writes, {stats['wireTime'] / numPasses * 1000:.3f} ms on the wire.")
+
+	# Refreshes the display as fast as anything calls it, which is four times per refresh at the refresher rate
+	clock = Clock.VirtualClock(Clock.now())
+	Clock.set_clock(clock)
+	display = Main.intersection.outputs.display
+	display.set_message("SG 1 12s day")
+	fakeBoard.reset_serial_stats()
+
+	endTime = clock.now() + displayCheckTime
+	while clock.now() < endTime:
+		display.update()
+		clock.advance(1 / (SevenSeg.refresherRate * 4))
+
+	displayBytesPerSecond = fakeBoard.get_serial_stats()["bytes"] / displayCheckTime
+	print(f"Display at {SevenSeg.refresherRate} Hz: {displayBytesPerSecond:.0f} bytes/s, budget {SevenSeg.maxBytesPerSecond} bytes/s.")
+
+	Main.shutdown()
+
+	if displayBytesPerSecond > SevenSeg.maxBytesPerSecond:
+		raise SystemExit("The display uses more than its share of the serial link.")
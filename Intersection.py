@@ -0,0 +1,244 @@
+"""Module holding everything needed to run one intersection, so several boards can be driven from one process.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+from pymata4 import pymata4
+
+import BoardProxy
+import Clock
+import EventLog
+import Kinematics
+import Logger
+import Metrics
+import Scheduler
+import SevenSeg
+import StagePlan
+import TimeSeries
+import inputsSubsystem as inputs
+import outputsSubsystem as outputs
+
+ultrasonicReadingWindow = 20 # seconds of readings to keep
+maxVehicleDeceleration = 20 # used for system alerts. In cm/s^2
+kinematicsWindow = 6 # seconds of readings used to estimate vehicle motion
+alertConfidence = 2 # number of standard errors the estimated speed must clear before alerting
+stageUpdateInterval = 0.05 # seconds between traffic stage and output updates
+
+# Scoped by the intersection's name, see Metrics.scoped_name
+pollIntervalMetricName = "main.pollInterval"
+
+
+class Intersection:
+	"""One board, its input and output subsystems, and the state of the control loop running it.
+	The control loop itself is a set of jobs, which any scheduler can run alongside the jobs of other intersections.
+	"""
+
+	__slots__ = (
+		"name", "number", "board", "inputs", "outputs", "pollLoopInterval", "ultrasonicReadings", "vehicleDistance", "vehicleHeight",
+		"lastTrafficStage", "pedestrianCount", "lastPollTime", "stallTime"
+	)
+
+	def __init__(self, board: pymata4.Pymata4, name: str = "", stagePlan: StagePlan.StagePlan | None = None, pollLoopInterval: float = 1.5,
+		number: int = 0):
+		"""Creates an intersection. Nothing is sent to the board until init is called.
+
+		:param board: Board the intersection is wired to. Wrap it in a BoardProxy, so its port shadow isn't shared with other boards.
+		:param name: [optional] Name shown in front of its messages, and used for its scheduler jobs. Also the scope of its metrics,
+		if the board is a BoardProxy, so several intersections in one process record their metrics separately.
+		:param stagePlan: [optional] Stage plan to run. Defaults to the default plan.
+		:param pollLoopInterval: [optional] Seconds between sensor polls
+		:param number: [optional] Number recorded with its events, from 0 to 255, so several intersections can share one event log
+		"""
+		self.name = name
+		self.number = number
+		self.board = board
+		if isinstance(board, BoardProxy.BoardProxy):
+			board.set_metric_scope(name)
+
+		self.inputs = inputs.Inputs(board)
+		self.outputs = outputs.Outputs(board, self.inputs, stagePlan)
+		self.inputs.intersectionNumber = number
+		self.outputs.intersectionNumber = number
+		self.pollLoopInterval = pollLoopInterval
+
+		# The buffer removes excess data itself, while making sure there are still more than 20 seconds of data left
+		self.ultrasonicReadings = TimeSeries.TimeSeries(4096, ultrasonicReadingWindow)
+		self.vehicleDistance = 0
+		self.vehicleHeight = 0
+		self.lastTrafficStage = None
+		self.pedestrianCount = 0
+		self.lastPollTime = 0
+		self.stallTime = 0
+
+	def report(self, messageLevel: int, message: str, **fields) -> None:
+		"""Logs a message, prefixed by the intersection's name if it has one. See Logger.log."""
+		Logger.log(messageLevel, message, self.name, **fields)
+
+	def init(self) -> None:
+		"""Sets up the board pins and the subsystems."""
+		self.inputs.init()
+		self.outputs.init()
+
+	def start(self) -> None:
+		"""Resets the outputs and control loop state, ready for the jobs to start running."""
+		self.lastPollTime = Clock.now() - self.pollLoopInterval
+		self.pedestrianCount = 0
+		self.stallTime = 0
+
+		self.reset_outputs()
+
+	def add_jobs(self, scheduler: Scheduler.Scheduler) -> None:
+		"""Adds the intersection's stage, poll and display jobs to a scheduler, named after the intersection.
+		The stage job doesn't check the mode switch, since there is no operator console to drop back to.
+
+		:param scheduler: Scheduler to run the jobs
+		"""
+		scheduler.add(f"{self.name}.stage", self.update_stage, stageUpdateInterval)
+		scheduler.add(f"{self.name}.poll", self.poll_and_check, self.pollLoopInterval)
+		if self.outputs.sevenSegExternalRefresh:
+			scheduler.add(f"{self.name}.display", self.refresh_display, 1 / (SevenSeg.refresherRate * 4), Scheduler.skipPolicy)
+
+	def update_stage(self) -> None:
+		"""Updates the buttons, the traffic stage timer and the outputs."""
+		self.update_inputs()
+		self.outputs.update(self.vehicleDistance, self.vehicleHeight)
+
+	def update_inputs(self) -> None:
+		"""Updates the buttons and counts pedestrians over each traffic cycle."""
+		self.inputs.update()
+
+		if self.inputs.pedestrian_button_pressed(0):
+			self.pedestrianCount += 1
+
+		if self.inputs.pedestrian_button_pressed(1):
+			self.pedestrianCount += 1
+
+		trafficStage = self.outputs.trafficStage
+		if trafficStage != self.lastTrafficStage:
+			self.lastTrafficStage = trafficStage
+
+			self.report(Logger.infoLevel, "Changing to traffic stage {stage}.", stage=trafficStage + 1)
+			EventLog.log_event(EventLog.stageEvent, trafficStage, self.outputs.trafficStageTimer, intersection=self.number)
+
+			if trafficStage == 1:
+				self.pedestrianCount = 0
+			elif trafficStage == 3:
+				self.report(Logger.infoLevel, "There were {count} pedestrians in this traffic cycle.", count=self.pedestrianCount)
+
+	def poll_sensors(self) -> None:
+		"""Polls the ultrasonic sensor and stores relevant data."""
+		ultrasonicDistance = self.inputs.get_vehicle_distance()
+		# only add reading to list if we got a valid distance
+		if ultrasonicDistance is not None:
+			self.vehicleDistance = ultrasonicDistance
+			self.ultrasonicReadings.append(Clock.now(), ultrasonicDistance)
+
+		heightReading = self.inputs.get_vehicle_height()
+		if heightReading is not None:
+			self.vehicleHeight = heightReading
+
+	def poll_and_check(self) -> None:
+		"""Polls the sensors, then issues alerts based on the estimated vehicle motion."""
+		pollLoopInterval = self.pollLoopInterval
+
+		self.poll_sensors()
+
+		pollLoopTime = Clock.now() - self.lastPollTime
+		self.report(Logger.infoLevel, "Polling loop took {time:.2f} seconds (intended {interval:.2f}).", time=pollLoopTime, interval=pollLoopInterval)
+		Metrics.histogram(Metrics.scoped_name(BoardProxy.get_metric_scope(self.board), pollIntervalMetricName)).record(pollLoopTime * 10**9)
+		EventLog.log_event(EventLog.loopTimingEvent, EventLog.pollIntervalTiming, pollLoopTime, intersection=self.number)
+
+		self.lastPollTime = Clock.now()
+
+		if len(self.ultrasonicReadings) >= Kinematics.minLinearReadings:
+			position, velocity, _, velocityError = Kinematics.fit(*self.ultrasonicReadings.get_last(kinematicsWindow))
+			speed = -velocity
+			lightState = self.outputs.get_main_light_state()
+
+			# During a red light, check if vehicle is confidently approaching and predicted to not stop in time
+			if speed - alertConfidence * velocityError > 0 and lightState == 0 and Kinematics.stopping_margin(position, speed, maxVehicleDeceleration) > 0:
+				self.report(Logger.warningLevel, "ALERT: Vehicle likely run a red light.", speed=speed)
+				EventLog.log_event(EventLog.alertEvent, EventLog.redLightAlert, speed, intersection=self.number)
+
+			# During a green light, issue an alert if vehicle seems to not be moving after 3 seconds
+			# Moving less than 1 cm per polling loop counts as not moving
+			if lightState == 2 and abs(speed) + alertConfidence * velocityError <= 1 / pollLoopInterval:
+				self.stallTime += pollLoopInterval
+
+				if self.stallTime > 3 and self.stallTime - pollLoopInterval <= 3:
+					self.report(Logger.warningLevel, "ALERT: Vehicle stalling at green light.", position=position)
+					EventLog.log_event(EventLog.alertEvent, EventLog.stallAlert, position, intersection=self.number)
+			else:
+				self.stallTime = 0
+
+	def print_distance(self) -> None:
+		"""Prints the last distance reading, if there is one."""
+		if len(self.ultrasonicReadings) == 0:
+			return
+
+		self.report(Logger.infoLevel, "Last distance reading: {distance:.2f} cm", distance=self.ultrasonicReadings.get_values()[-1])
+
+	def refresh_display(self) -> None:
+		"""Shows the next digit of the seven segment display."""
+		self.outputs.refresh_display()
+
+	def reset_outputs(self) -> None:
+		"""Resets the outputs, and waits for the board to finish applying them."""
+		self.outputs.reset()
+		BoardProxy.barrier(self.board)
+
+	def shutdown(self) -> None:
+		"""Turns off the outputs and shuts down the board."""
+		self.outputs.reset()
+
+		# noticed in testing that the board could shut down before some commands were excecuted, so wait for them to be handled
+		BoardProxy.barrier(self.board)
+		self.board.shutdown()
+
+
+if __name__ == "__main__":
+	# Runs a corridor of simulated intersections from one scheduler, on a virtual clock
+	import contextlib
+	import os
+	import FakeBoard
+
+	numIntersections = 4
+	runTime = 120
+
+	clock = Clock.VirtualClock(Clock.now())
+	Clock.set_clock(clock)
+	scheduler = Scheduler.Scheduler()
+
+	corridor = []
+	for i in range(numIntersections):
+		intersection = Intersection(BoardProxy.BoardProxy(FakeBoard.FakeBoard()), f"junction{i + 1}", number=i + 1)
+		# Refresh each display from its own stage job, rather than from a thread per board
+		intersection.outputs.sevenSegBackgroundRefresh = False
+		corridor.append(intersection)
+
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		for intersection in corridor:
+			intersection.init()
+			intersection.start()
+			intersection.add_jobs(scheduler)
+
+		# Only the first junction gets a pedestrian, so its stages run ahead of the others
+		corridor[0].board.board.set_digital_input(inputs.pedestianButtonPins[0], 1)
+
+		scheduler.start()
+		endTime = clock.now() + runTime
+		while clock.now() < endTime:
+			scheduler.run_pending()
+			scheduler.wait()
+
+		Logger.flush()
+
+	for intersection in corridor:
+		stats = intersection.board.board.get_serial_stats()
+		print(f"{intersection.name}: stage {intersection.outputs.trafficStage + 1}, {stats['bytes']} bytes in {stats['writes']} serial writes.")
+
+	print(scheduler.format_report())
+
+	for intersection in corridor:
+		intersection.shutdown()
@@ -0,0 +1,116 @@
+"""Module to estimate vehicle motion from timestamped ultrasonic distance readings.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import numpy as np
+
+# Minimum number of readings for each kind of fit. A curve needs one more reading than it has coefficients,
+# so the scatter of the readings around it gives an estimate of its error.
+minLinearReadings = 2
+minQuadraticReadings = 4
+
+
+def solve_windows(offsets: np.ndarray, distances: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""Fits distance = position + velocity * t + acceleration * t^2 / 2 to many windows of readings at once, using least squares.
+	Windows with too few readings for a curve get a straight line fit, and windows with fewer than 2 readings give NaN.
+	A line through exactly 2 readings is the two point speed, and is given a velocity error of zero.
+
+	:param offsets: Time of each reading relative to the time being estimated, one row per window
+	:param distances: Distance of each reading, one row per window
+	:param mask: Which entries of each row are readings in the window
+
+	:returns: Position, velocity and acceleration at the estimated time, and the standard error of the velocity, for each window.
+	"""
+	weights = mask.astype(float)
+	offsets = np.where(mask, offsets, 0)
+	distances = np.where(mask, distances, 0)
+	numReadings = weights.sum(axis=1)
+
+	# Normal equations for the basis (1, t, t^2 / 2)
+	basis = np.stack((weights, offsets * weights, offsets**2 / 2 * weights), axis=2)
+	normalMatrix = np.einsum("wni,wnj->wij", basis, basis)
+	normalVector = np.einsum("wni,wn->wi", basis, distances)
+
+	# Without enough readings for a curve, fix the acceleration at zero
+	isLinear = numReadings < minQuadraticReadings
+	normalMatrix[isLinear, 2, :] = 0
+	normalMatrix[isLinear, :, 2] = 0
+	normalMatrix[isLinear, 2, 2] = 1
+	normalVector[isLinear, 2] = 0
+
+	isValid = numReadings >= minLinearReadings
+	normalMatrix[~isValid] = np.eye(3)
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		inverse = np.linalg.inv(normalMatrix)
+		coefficients = np.einsum("wij,wj->wi", inverse, normalVector)
+
+		residuals = (distances - np.einsum("wni,wi->wn", basis, coefficients)) * weights
+		degreesOfFreedom = numReadings - np.where(isLinear, 2, 3)
+		variance = np.where(degreesOfFreedom > 0, (residuals**2).sum(axis=1) / np.maximum(degreesOfFreedom, 1), 0)
+		velocityError = np.sqrt(variance * inverse[:, 1, 1])
+
+	coefficients[~isValid] = np.nan
+	velocityError[~isValid] = np.nan
+
+	return coefficients[:, 0], coefficients[:, 1], coefficients[:, 2], velocityError
+
+
+def fit(timestamps: np.ndarray, distances: np.ndarray) -> tuple[float, float, float, float]:
+	"""Estimates the current motion of a vehicle from a window of readings.
+
+	:param timestamps: Time of each reading, in seconds, oldest first
+	:param distances: Distance of each reading, in cm
+
+	:returns: Position (cm), velocity (cm/s), acceleration (cm/s^2) at the newest reading, and the standard error of the velocity.
+	Velocity is negative when the vehicle is approaching. All are NaN with fewer than 2 readings.
+	"""
+	if len(timestamps) == 0:
+		return np.nan, np.nan, np.nan, np.nan
+
+	offsets = (timestamps - timestamps[-1])[np.newaxis, :]
+	mask = np.ones(offsets.shape, dtype=bool)
+	position, velocity, acceleration, velocityError = solve_windows(offsets, distances[np.newaxis, :], mask)
+
+	return float(position[0]), float(velocity[0]), float(acceleration[0]), float(velocityError[0])
+
+
+def fit_history(timestamps: np.ndarray, distances: np.ndarray, window: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""Estimates the motion at every reading of a recorded history in one call, using the readings from the preceding window.
+
+	:param timestamps: Time of each reading, in seconds, oldest first
+	:param distances: Distance of each reading, in cm
+	:param window: Length of the sliding window, in seconds
+
+	:returns: Arrays of position, velocity, acceleration and velocity standard error at each reading, as returned by fit.
+	"""
+	numReadings = len(timestamps)
+	if numReadings == 0:
+		empty = np.zeros(0)
+		return empty, empty, empty, empty
+
+	# Index of the first reading in each window, so each row can hold its window without needing ragged arrays
+	firstIndices = np.searchsorted(timestamps, timestamps - window, side="right")
+	windowLength = int((np.arange(numReadings) - firstIndices).max()) + 1
+
+	indices = np.arange(numReadings)[:, np.newaxis] - np.arange(windowLength)[np.newaxis, :]
+	mask = indices >= firstIndices[:, np.newaxis]
+	indices = np.maximum(indices, 0)
+
+	offsets = timestamps[indices] - timestamps[:, np.newaxis]
+	return solve_windows(offsets, distances[indices], mask)
+
+
+def stopping_margin(position: float | np.ndarray, speed: float | np.ndarray, maxDeceleration: float) -> float | np.ndarray:
+	"""Works out how far past its current position a vehicle would travel when braking as hard as possible.
+
+	:param position: Distance to the vehicle, in cm
+	:param speed: Approach speed of the vehicle, in cm/s
+	:param maxDeceleration: Maximum deceleration of the vehicle, in cm/s^2
+
+	:returns: Stopping distance minus the distance to the vehicle. Positive if the vehicle can't stop in time.
+	"""
+	# Using the constant acceleration formula v^2 = u^2 + 2as
+	return speed**2 / 2 / maxDeceleration - position
@@ -0,0 +1,219 @@
+"""Module to print log messages from a background thread, so a slow console can never hold up the control loop.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+
+A message is a format string and its fields, such as info("Changing to traffic stage {stage}.", stage=2).
+Logging only checks the level and rate limit, then queues the record. The writer thread formats and prints it.
+If the queue is full, the record is dropped and counted. Messages are rate limited by their format string,
+so fields have to be passed separately rather than formatted into the message.
+"""
+
+import atexit
+import datetime
+import json
+import queue
+import sys
+import threading
+
+import Clock
+import Metrics
+
+# Levels
+debugLevel = 10
+infoLevel = 20
+warningLevel = 30
+errorLevel = 40
+levelNames = {debugLevel: "DEBUG", infoLevel: "INFO", warningLevel: "WARNING", errorLevel: "ERROR"}
+
+# Output formats
+textFormat = "text" # time, level, source and message on one line
+jsonFormat = "json" # one JSON object per line, with the fields kept separate
+
+level = infoLevel # messages below this level are ignored
+outputFormat = textFormat
+maxQueuedRecords = 1024 # records waiting to be printed before new ones are dropped
+rateLimitInterval = 1 # seconds
+rateLimitBurst = 10 # messages with the same format string printed per interval, the rest are counted and suppressed
+flushTimeout = 2 # seconds flush waits for the writer thread
+
+droppedMetric = Metrics.counter("log.dropped")
+suppressedMetric = Metrics.counter("log.suppressed")
+
+
+class Logger:
+	"""Queues log records and prints them from a background thread."""
+
+	def __init__(self):
+		"""Creates a logger and starts its writer thread."""
+		self.queue = queue.Queue(maxQueuedRecords)
+		self.numDropped = 0
+		self.numReportedDropped = 0
+
+		# Message format string and source, mapped to [start of the current interval, messages printed in it, messages suppressed in it]
+		self.rateWindows = {}
+		self.rateLock = threading.Lock()
+
+		self.writerThread = threading.Thread(target=self.writer_loop, name="Logger", daemon=True)
+		self.writerThread.start()
+
+	def log(self, messageLevel: int, message: str, source: str = "", **fields) -> None:
+		"""Queues a message to be printed. Never blocks.
+
+		:param messageLevel: Level of the message, one of the level constants
+		:param message: Format string of the message, filled in with the fields when it is printed
+		:param source: [optional] Name of the intersection or subsystem the message is from
+		:param fields: Values for the format string
+		"""
+		if messageLevel < level:
+			return
+
+		currentTime = Clock.now()
+		key = (message, source)
+		numSuppressed = 0
+
+		with self.rateLock:
+			window = self.rateWindows.get(key)
+			if window is None or currentTime - window[0] >= rateLimitInterval:
+				if window is not None:
+					numSuppressed = window[2]
+
+				window = [currentTime, 0, 0]
+				self.rateWindows[key] = window
+
+			if window[1] >= rateLimitBurst:
+				window[2] += 1
+				suppressedMetric.inc()
+				return
+
+			window[1] += 1
+
+		try:
+			self.queue.put_nowait((currentTime, messageLevel, source, message, fields, numSuppressed))
+		except queue.Full:
+			self.numDropped += 1
+			droppedMetric.inc()
+
+	def writer_loop(self) -> None:
+		"""Prints queued records, in batches, for as long as the program runs. Runs on the writer thread."""
+		while True:
+			records = [self.queue.get()]
+			try:
+				while True:
+					records.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+
+			lines = []
+			flushEvents = []
+			for record in records:
+				if isinstance(record, threading.Event):
+					flushEvents.append(record)
+				else:
+					try:
+						lines.append(format_record(*record))
+					except Exception:
+						# A field that can't even be printed mustn't stop the writer thread, or every later message would be lost
+						lines.append(f"{record[3]} (fields could not be printed)")
+
+			numDropped = self.numDropped
+			if numDropped != self.numReportedDropped:
+				lines.append(format_record(Clock.now(), warningLevel, "logger", "{count} log messages dropped, the console couldn't keep up.",
+					{"count": numDropped - self.numReportedDropped}, 0))
+				self.numReportedDropped = numDropped
+
+			# The stream is looked up each time, so redirecting stdout also redirects the log
+			stream = sys.stdout
+			try:
+				if lines:
+					stream.write("\n".join(lines) + "\n")
+					stream.flush()
+			except (OSError, ValueError):
+				# The console has gone away, or a redirect has been closed
+				pass
+
+			for flushEvent in flushEvents:
+				flushEvent.set()
+
+	def flush(self, timeout: float = flushTimeout) -> bool:
+		"""Waits until every message queued so far has been printed.
+
+		:param timeout: [optional] Longest time to wait, in seconds
+
+		:returns: Whether every message was printed in time.
+		"""
+		flushEvent = threading.Event()
+		try:
+			self.queue.put(flushEvent, timeout=timeout)
+		except queue.Full:
+			return False
+
+		return flushEvent.wait(timeout)
+
+	def get_stats(self) -> dict[str, int]:
+		"""Returns how many records are waiting to be printed, and how many have been dropped."""
+		return {"queued": self.queue.qsize(), "dropped": self.numDropped}
+
+
+def format_record(timestamp: float, messageLevel: int, source: str, message: str, fields: dict, numSuppressed: int) -> str:
+	"""Returns a log record as a line of text, in the output format."""
+	levelName = levelNames.get(messageLevel, str(messageLevel))
+
+	if outputFormat == jsonFormat:
+		record = {"time": timestamp, "level": levelName, "source": source, "message": message, "fields": fields}
+		if numSuppressed:
+			record["suppressed"] = numSuppressed
+
+		return json.dumps(record, default=str)
+
+	try:
+		text = message.format(**fields)
+	except Exception:
+		# Missing fields or ones that don't suit their format spec, such as None for {speed:.2f}
+		text = f"{message} {fields}"
+
+	if source:
+		text = f"{source}: {text}"
+
+	if numSuppressed:
+		text += f" ({numSuppressed} similar messages suppressed)"
+
+	timeText = datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]
+	return f"{timeText} {levelName:<7} {text}"
+
+
+activeLogger = Logger()
+
+
+def log(messageLevel: int, message: str, source: str = "", **fields) -> None:
+	"""Queues a message on the active logger, see Logger.log."""
+	activeLogger.log(messageLevel, message, source, **fields)
+
+
+def debug(message: str, source: str = "", **fields) -> None:
+	"""Queues a debug message on the active logger, see Logger.log."""
+	activeLogger.log(debugLevel, message, source, **fields)
+
+
+def info(message: str, source: str = "", **fields) -> None:
+	"""Queues an info message on the active logger, see Logger.log."""
+	activeLogger.log(infoLevel, message, source, **fields)
+
+
+def warning(message: str, source: str = "", **fields) -> None:
+	"""Queues a warning on the active logger, see Logger.log."""
+	activeLogger.log(warningLevel, message, source, **fields)
+
+
+def error(message: str, source: str = "", **fields) -> None:
+	"""Queues an error on the active logger, see Logger.log."""
+	activeLogger.log(errorLevel, message, source, **fields)
+
+
+def flush(timeout: float = flushTimeout) -> bool:
+	"""Waits until every message queued on the active logger so far has been printed, see Logger.flush."""
+	return activeLogger.flush(timeout)
+
+
+# Prints whatever is still queued when the program exits, since the writer thread is a daemon
+atexit.register(flush)
@@ -5,12 +5,28 @@ Created Date: 03/04/2024
 Version: 1.4
 """
 
+import asyncio
+import queue
+import signal
+import sys
+import threading
 import time
+import traceback
+import numpy as np
 from pymata4 import pymata4
-import matplotlib.pyplot as ppl
 
-import InputsSubsystem as inputs
-import OutputsSubsystem as outputs
+import AsyncBoard
+import BoardProxy
+import Clock
+import EventLog
+import FakeBoard
+import Intersection
+import Logger
+import Metrics
+import ObservationView
+import Scheduler
+import outputsSubsystem as outputs
+import SevenSeg
 
 # ===== User modifiable variables ===== 
 maintenancePIN = "1234"
@@ -18,6 +34,14 @@ maxPINAttempts = 3
 incorrectPINTimeout = 120
 pollLoopInterval = 1.5
 distancePrintDelay = 2
+simulateBoard = False # Run against a fake board instead of a connected Arduino
+boardPort = None # serial port of the Arduino, such as "COM3". None to use the first one found
+observationRefreshInterval = 0.1 # seconds between live graph updates
+metricsDumpPath = "metrics.json" # default file the performance metrics are saved to
+eventLogDirectory = "logs" # where sensor readings, stage changes, alerts and timings are recorded. None to turn off logging
+asyncRuntime = True # Run polling, the stage timer, the display and the console as separate asyncio tasks
+stageUpdateInterval = 0.05 # seconds between traffic stage and output updates
+stagePlanPath = None # JSON stage plan to run instead of the default one, see StagePlan
 
 # ===== Program constants =====
 serviceModeConstant = "service"
@@ -25,26 +49,44 @@ normalModeConstant = "normal"
 dataObservationModeConstant = "dataObservation"
 maintenanceModeConstant = "maintenance"
 exitConstant = "exit"
+# modes where the intersection is running
+runningModes = (normalModeConstant, dataObservationModeConstant)
+idleCheckInterval = 0.1 # seconds between checks for a mode change or Ctrl+C while waiting
+# settings that can be changed while the intersection is running, with their allowed range and unit
+liveSettings = {
+	"pollLoopInterval": (1, 5, " seconds"),
+	"distancePrintDelay": (1, 3, " seconds"),
+	"heightLimit": (0, 28, " cm"),
+	"yellowLightExtensionDistance": (0, 50, " cm")
+}
+changeTimeout = 1 # seconds the console waits for a change to be applied before showing the new value anyway
 
 # ===== Program variables =====
 # general variables
-board = None
+intersection = None
 operationMode = None
+scheduler = Scheduler.Scheduler()
+loopLatencyMetric = Metrics.histogram("main.loopLatency")
 
 # normal mode variables
 normalModeEnterTime = 0
-lastTrafficStage = None
-pedestrianCount = 0
-ultrasonicReadings = []
-vehicleDistance = 0
-vehicleHeight = 0
-nextDistancePrintTime = 0
-nextUltrasonicReadTime = 0
-lastPollTime = 0
-maxVehicleDeceleration = 20 # used for system alerts. In cm/s^2
-stallTime = 0
+
+# data observation mode variables
+liveView = None
+
+# console variables
+consoleLines = None
+consoleInterrupted = threading.Event()
+
+# live console variables
+liveConsoleThread = None
+liveConsoleStop = threading.Event()
+# setting changes from the console, as (changes, event set once applied), waiting for the running controller to apply them
+pendingChanges = queue.Queue()
 
 # service mode variables
+# running mode chosen in the service menu, waiting for the console task to start it through the board adapter in the async runtime
+requestedRunningMode = None
 PINTimeoutTime = 0
 incorrectPINInputs = 0
 
@@ -54,14 +96,24 @@ def main() -> None:
 
 	global operationMode
 
+	if asyncRuntime:
+		asyncio.run(async_main())
+		return
+
 	init()
+	start_console_reader()
  
 	# weird double while true loop to avoid KeyboardInterrupts from going uncaught
 	while operationMode != exitConstant:
 		try:
 			while operationMode != exitConstant:
-				if inputs.get_mode_switch_state(board) and operationMode == normalModeConstant:
-					operationMode = serviceModeConstant
+				if operationMode != dataObservationModeConstant:
+					close_live_view()
+
+				if operationMode in runningModes:
+					start_live_console()
+				else:
+					stop_live_console()
 
 				if operationMode == serviceModeConstant:
 					service_mode()
@@ -70,41 +122,66 @@ def main() -> None:
 					normal_operation()
 					continue
 				if operationMode == maintenanceModeConstant:
-					outputs.set_maintenance_LEDs(board, True)
+					intersection.outputs.set_maintenance_LEDs(True)
 					maintenance_mode()
-					outputs.set_maintenance_LEDs(board, False)
+					intersection.outputs.set_maintenance_LEDs(False)
 					operationMode = serviceModeConstant
 					continue
 				if operationMode == dataObservationModeConstant:
 					data_observation_mode()
-					operationMode = serviceModeConstant
 					continue
 		except KeyboardInterrupt:
+			close_live_view()
 			if operationMode == serviceModeConstant:
 				operationMode = exitConstant
 			else:
 				operationMode = serviceModeConstant
-			outputs.reset(board)
+			stop_live_console()
+			reset_outputs()
+		except EOFError:
+			# Stdin has been closed, so the menus can never be used again
+			print("Console input closed, exiting.")
+			operationMode = exitConstant
 
 	shutdown()
 
 def init() -> None:
 	"""Initializes program variables"""
 
-	global board, operationMode, incorrectPINInputs, PINTimeoutTime
+	global intersection, operationMode, incorrectPINInputs, PINTimeoutTime
 
 	operationMode = serviceModeConstant
 	incorrectPINInputs = 0
-	PINTimeoutTime = time.time()
+	PINTimeoutTime = Clock.now()
+
+	if eventLogDirectory is not None:
+		EventLog.start(eventLogDirectory)
 
-	board = pymata4.Pymata4()
+	# All subsystems share the proxy, so redundant writes are dropped and writes to the same port are combined
+	board = BoardProxy.BoardProxy(FakeBoard.FakeBoard() if simulateBoard else pymata4.Pymata4(com_port=boardPort))
 
-	time.sleep(1)
+	if not BoardProxy.barrier(board):
+		Logger.warning("Board did not respond.")
 
 	# board.set_sampling_interval(100000)
 
-	inputs.init(board)
-	outputs.init(board)
+	stagePlan = outputs.load_stage_plan(stagePlanPath) if stagePlanPath is not None else None
+	intersection = Intersection.Intersection(board, stagePlan=stagePlan, pollLoopInterval=pollLoopInterval)
+	intersection.init()
+
+	# The scheduler refreshes the display itself, unless SevenSeg's refresher thread is being used
+	if asyncRuntime or not intersection.outputs.sevenSegBackgroundRefresh:
+		intersection.outputs.sevenSegExternalRefresh = True
+
+	# Periods are set again each time normal operation starts, in case they were changed in maintenance mode
+	scheduler.add("stage", Metrics.timed("main.job.stage")(update_stage), stageUpdateInterval)
+	scheduler.add("poll", Metrics.timed("main.job.poll")(intersection.poll_and_check), pollLoopInterval)
+	scheduler.add("distancePrint", intersection.print_distance, distancePrintDelay)
+	scheduler.add("settings", apply_pending_changes, idleCheckInterval)
+	scheduler.add("liveView", Metrics.timed("main.job.liveView")(refresh_live_view), observationRefreshInterval)
+	if intersection.outputs.sevenSegExternalRefresh:
+		# If the display falls behind, carry on from now instead of catching up, the same as SevenSeg's refresher
+		scheduler.add("display", intersection.refresh_display, 1 / (SevenSeg.refresherRate * 4), Scheduler.skipPolicy)
 
 
 def shutdown() -> None:
@@ -112,109 +189,77 @@ def shutdown() -> None:
 	
 	print("\nShutting down...")
 
-	outputs.reset(board)
+	intersection.shutdown()
 
-	# noticed in testing that not adding a delay caused the board to shut down before some commands were excecuted
-	time.sleep(1)
-	board.shutdown()
+	EventLog.stop()
+	Logger.flush()
 
 
 def init_normal_operation() -> None:
 	"""Initialises normal operation mode variables. Called every time system enters into normal operation mode."""
 
-	global normalModeEnterTime, pedestrianCount, nextUltrasonicReadTime, nextDistancePrintTime, lastPollTime
+	global normalModeEnterTime
 
-	normalModeEnterTime = time.time()
-	# set the distance print and poll to first trigger when entering normal operation
-	nextUltrasonicReadTime = normalModeEnterTime
-	nextDistancePrintTime = normalModeEnterTime
-	lastPollTime = normalModeEnterTime - pollLoopInterval
+	normalModeEnterTime = Clock.now()
 
-	pedestrianCount = 0
+	apply_pending_changes()
+	intersection.pollLoopInterval = pollLoopInterval
+	intersection.start()
 
-	outputs.reset(board)
+	# every job, including the distance print and poll, first triggers when entering normal operation
+	scheduler.set_period("poll", pollLoopInterval)
+	scheduler.set_period("distancePrint", distancePrintDelay)
+	scheduler.start()
 
 
-def poll_sensors() -> None:
-	"""Polls the ultrasonic sensor and stores relevant data."""
-
-	global ultrasonicReadings, vehicleHeight, vehicleDistance
+def normal_operation() -> None:
+	"""Standard operating mode.
+	Runs whichever of the polling, output, display and print jobs are due, then sleeps until the next one is.
+	"""
 
-	ultrasonicDistance = inputs.get_vehicle_distance(board)
-	# only add reading to list if we got a valid distance
-	if ultrasonicDistance is not None:
-		vehicleDistance = ultrasonicDistance
-		ultrasonicReadings.append((time.time(), ultrasonicDistance))
+	# Latency is the processing time of the jobs, so it is measured in real time even under a virtual clock
+	startTime_ns = time.perf_counter_ns()
+	if scheduler.run_pending():
+		record_loop_latency(time.perf_counter_ns() - startTime_ns)
 
-		# Remove excess data from the readings buffer
-		while (ultrasonicReadings[-1][0] - ultrasonicReadings[0][0] > 20 # Check if there is more than 20 seconds of data
-			and ultrasonicReadings[-1][0] - ultrasonicReadings[1][0] > 20):	# Ensure that there will still be more than 20 seconds of data left if a reading is removed
-			ultrasonicReadings.pop(0)
+	scheduler.wait()
 
-	heightReading = inputs.get_vehicle_height(board)
-	if heightReading is not None:
-		vehicleHeight = heightReading
 
+def record_loop_latency(loopLatency_ns: int) -> None:
+	"""Records how long one pass of the jobs took to process, in the loop latency metric and the event log.
 
-def normal_operation() -> None:
-	"""Standard operating mode.
-	Polls sensors and stores relevant data, as well as operating system outputs.
+	:param loopLatency_ns: Processing time of the pass, in nanoseconds
 	"""
 
-	global lastTrafficStage, pedestrianCount, nextDistancePrintTime, nextUltrasonicReadTime, lastPollTime
-	global stallTime
+	loopLatencyMetric.record(loopLatency_ns)
+	EventLog.log_event(EventLog.loopTimingEvent, EventLog.loopLatencyTiming, loopLatency_ns / 10**9, intersection=intersection.number)
 
-	inputs.update(board)
-	
-	if inputs.pedestrian_button_pressed(0):
-		pedestrianCount += 1
-	
-	if inputs.pedestrian_button_pressed(1):
-		pedestrianCount += 1
-	
-	if outputs.trafficStage != lastTrafficStage:
-		lastTrafficStage = outputs.trafficStage
 
-		print(f"Changing to traffic stage {outputs.trafficStage + 1}.")
+def update_stage() -> None:
+	"""Checks the mode switch, then updates the buttons, the traffic stage timer and the outputs."""
+
+	global operationMode
 
-		if outputs.trafficStage == 1:
-			pedestrianCount = 0
-		elif outputs.trafficStage == 3:
-			print(f"There were {pedestrianCount} pedestrians in this traffic cycle.")
+	if intersection.inputs.get_mode_switch_state():
+		operationMode = serviceModeConstant
+		return
 
-	if time.time() >= nextUltrasonicReadTime:
-		poll_sensors()
+	intersection.update_stage()
 
-		pollLoopTime = time.time() - lastPollTime
-		print(f"Polling loop took {pollLoopTime:.2f} seconds (intended {pollLoopInterval:.2f}).")
-		
-		lastPollTime = time.time()
-		nextUltrasonicReadTime += pollLoopInterval
 
-		if len(ultrasonicReadings) >= 2:
-			speed = (ultrasonicReadings[-2][1] - ultrasonicReadings[-1][1]) / pollLoopTime
-			lightState = outputs.get_main_light_state()
+def print_schedule_report() -> None:
+	"""Prints how well the periodic jobs kept to their deadlines since the last report, if any have run."""
 
-			# During a red light, check if vehicle is predicted to not stop in time
-			# Using the constant acceleration formula v^2 = u^2 + 2as
-			if speed > 0 and lightState == 0 and speed**2 / 2 / maxVehicleDeceleration > ultrasonicReadings[-1][1]:
-				print("ALERT: Vehicle likely run a red light.")
+	if any(stats["runs"] for stats in scheduler.get_stats().values()):
+		print("Periodic job timing:")
+		print(scheduler.format_report())
+		scheduler.reset_stats()
 
-			# During a green light, issue an alert if vehicle seems to not be moving after 3 seconds
-			if lightState == 2 and -1 / pollLoopTime <= speed <= 1 / pollLoopTime:
-				stallTime += pollLoopInterval
 
-				if stallTime > 3 and stallTime - pollLoopInterval <= 3:
-					print("ALERT: Vehicle stalling at green light.")
-			else:
-				stallTime = 0
-	
-	if time.time() >= nextDistancePrintTime and len(ultrasonicReadings):
-		print(f"Last distance reading: {ultrasonicReadings[-1][1]:.2f} cm")
-	
-		nextDistancePrintTime += distancePrintDelay
-	
-	outputs.update(board, vehicleDistance, vehicleHeight)
+def reset_outputs() -> None:
+	"""Resets the outputs, and waits for the board to finish applying them."""
+
+	intersection.reset_outputs()
 
 
 def service_mode() -> None:
@@ -224,21 +269,29 @@ def service_mode() -> None:
 
 	global operationMode
 
+	# Print anything still queued from normal operation before the menu, so it doesn't end up in the middle of it
+	Logger.flush()
+	# The async runtime applies pending changes through the board adapter before opening the menu
+	if not asyncRuntime:
+		apply_pending_changes()
+	print_schedule_report()
+
 	while operationMode == serviceModeConstant:
 		print("Available operating modes:")
 		print("1. Normal operation")
 		print("2. Data observation")
 		print("3. Maintenance")
 		print("4. Exit program")
+		print("5. View performance metrics")
+		print("6. Save performance metrics to a file")
 
-		opModeInput = input("Select operating mode to enter: ")
+		opModeInput = console_input("Select operating mode to enter: ")
 		match opModeInput:
 			case "1":
-				operationMode = normalModeConstant
-				init_normal_operation()
+				start_running_mode(normalModeConstant)
 				break
 			case "2":
-				operationMode = dataObservationModeConstant
+				start_running_mode(dataObservationModeConstant)
 				break
 			case "3":
 				if get_PIN_input():
@@ -246,6 +299,36 @@ def service_mode() -> None:
 				break
 			case "4":
 				operationMode = exitConstant
+			case "5":
+				print(Metrics.format_report())
+				console_input("Press [Enter] to continue.")
+			case "6":
+				path = console_input(f"Enter file to save to [{metricsDumpPath}]: ") or metricsDumpPath
+
+				try:
+					Metrics.dump(path)
+				except OSError as error:
+					print(f"Could not save metrics: {error}")
+					continue
+
+				print(f"Saved performance metrics to {path}.")
+
+
+def start_running_mode(mode: str) -> None:
+	"""Starts the intersection running in normal operation or data observation mode.
+	In the async runtime, this runs on the console thread, so the mode is only requested, and the console task starts it through the board adapter.
+
+	:param mode: Running mode to enter
+	"""
+
+	global operationMode, requestedRunningMode
+
+	if asyncRuntime:
+		requestedRunningMode = mode
+		return
+
+	init_normal_operation()
+	operationMode = mode
 
 
 def get_PIN_input() -> bool:
@@ -257,15 +340,15 @@ def get_PIN_input() -> bool:
 
 	global incorrectPINInputs, PINTimeoutTime
 
-	if time.time() < PINTimeoutTime:
-		print(f"Locked out for another {PINTimeoutTime - time.time():.0f} seconds.")
+	if Clock.now() < PINTimeoutTime:
+		print(f"Locked out for another {PINTimeoutTime - Clock.now():.0f} seconds.")
 		return False
 	
 	while incorrectPINInputs < maxPINAttempts:
 		if incorrectPINInputs != 0:
 			print(f"Incorrect PIN entered. {maxPINAttempts - incorrectPINInputs} attempt(s) remaining.")
 		
-		PINInput = input("Enter PIN: ")
+		PINInput = console_input("Enter PIN: ")
 		if PINInput == maintenancePIN:
 			incorrectPINInputs = 0
 			return True
@@ -278,14 +361,16 @@ def get_PIN_input() -> bool:
 	print(f"Incorrect PIN entered too many times. User will be locked out for {incorrectPINTimeout} seconds.")
 
 	incorrectPINInputs = 0
-	PINTimeoutTime = time.time() + incorrectPINTimeout
+	PINTimeoutTime = Clock.now() + incorrectPINTimeout
 	return False
 
 
 def maintenance_mode() -> None:
-	"""Allows the user to change variables that affect the operation of the system."""
+	"""Allows the user to change variables that affect the operation of the system.
+	Can be used while the intersection is running, since the settings it runs with are changed through request_changes.
+	"""
 
-	global maintenancePIN, maxPINAttempts, incorrectPINTimeout, pollLoopInterval, distancePrintDelay
+	global maintenancePIN, maxPINAttempts, incorrectPINTimeout
 
 	running = True
 	while running:
@@ -295,144 +380,542 @@ def maintenance_mode() -> None:
 		print(f"3. Incorrect PIN timeout time: {incorrectPINTimeout} seconds")
 		print(f"4. Polling loop interval: {pollLoopInterval} seconds")
 		print(f"5. Distance print interval: {distancePrintDelay} seconds")
-		print(f"6. Maximum vehicle height: {outputs.heightLimit} cm")
-		print(f"7. Max yellow light extension distance: {outputs.yellowLightExtensionDistance} cm")
+		print(f"6. Maximum vehicle height: {intersection.outputs.heightLimit} cm")
+		print(f"7. Max yellow light extension distance: {intersection.outputs.yellowLightExtensionDistance} cm")
 		print("8. Exit maintenance mode")
 
-		varToEdit = input()
+		varToEdit = console_input()
 		match varToEdit:
 			case "1":
-				newPIN = input("Enter new maintenance mode PIN: ")
+				newPIN = console_input("Enter new maintenance mode PIN: ")
 
 				if len(newPIN) < 4:
 					print("PIN must contain at least 4 characters.")
-					input("Press [Enter] to continue.")
+					console_input("Press [Enter] to continue.")
 					continue
 
 				maintenancePIN = newPIN
 			case "2":
-				newMaxAttempts = input("Enter new maximum PIN attempts: ")
+				newMaxAttempts = console_input("Enter new maximum PIN attempts: ")
 
 				try:
 					newMaxAttempts = int(str(newMaxAttempts))
 				except ValueError:
 					print("Value must be an integer.")
-					input("Press [Enter] to continue.")
+					console_input("Press [Enter] to continue.")
 					continue
 
 				if newMaxAttempts < 1:
 					print("Value must be at least 1.")
-					input("Press [Enter] to continue.")
+					console_input("Press [Enter] to continue.")
 					continue
 
 				maxPINAttempts = newMaxAttempts
 			case "3":
-				newTimeout = input("Enter new PIN timeout: ")
+				newTimeout = console_input("Enter new PIN timeout: ")
 
 				try:
 					newTimeout = float(newTimeout)
 				except ValueError:
 					print("Value must be a valid number.")
-					input("Press [Enter] to continue.")
+					console_input("Press [Enter] to continue.")
 					continue
 					
 				if newTimeout < 0:
 					print("Value must be positive.")
-					input("Press [Enter] to continue.")
+					console_input("Press [Enter] to continue.")
 					continue
 
 				incorrectPINTimeout = newTimeout
 			case "4":
-				newLoopTime = input("Enter new polling loop interval: ")
+				edit_setting("pollLoopInterval", "Enter new polling loop interval: ")
+			case "5":
+				edit_setting("distancePrintDelay", "Enter new distance print interval: ")
+			case "6":
+				edit_setting("heightLimit", "Enter new maximum vehicle height: ")
+			case "7":
+				edit_setting("yellowLightExtensionDistance", "Enter new max yellow light extension distance: ")
+			case "8":
+				running = False
 
-				try:
-					newLoopTime = float(newLoopTime)
-				except ValueError:
-					print("Value must be a valid number.")
-					input("Press [Enter] to continue.")
-					continue
-					
-				if not 1 <= newLoopTime <= 5:
-					print("Value must be between 1 and 5 seconds.")
-					input("Press [Enter] to continue.")
-					continue
 
-				pollLoopInterval = newLoopTime
-			case "5":
-				newPrintTime = input("Enter new distance print interval: ")
+def edit_setting(name: str, prompt: str) -> None:
+	"""Asks for a new value of one of the live settings, and changes it if it is valid.
 
-				try:
-					newPrintTime = float(newPrintTime)
-				except ValueError:
-					print("Value must be a valid number.")
-					input("Press [Enter] to continue.")
-					continue
-					
-				if not 1 <= newPrintTime <= 3:
-					print("Value must be between 1 and 3 seconds.")
-					input("Press [Enter] to continue.")
-					continue
+	:param name: Name of the setting, from liveSettings
+	:param prompt: Text to print before reading the value
+	"""
 
-				distancePrintDelay = newPrintTime
-			case "6":
-				newMaxHeight = input("Enter new maximum vehicle height: ")
+	try:
+		value = parse_setting(name, console_input(prompt))
+	except ValueError as error:
+		print(error)
+		console_input("Press [Enter] to continue.")
+		return
 
-				try:
-					newMaxHeight = float(newMaxHeight)
-				except ValueError:
-					print("Value must be a valid number.")
-					input("Press [Enter] to continue.")
-					continue
-					
-				if not 0 <= newMaxHeight <= 28:
-					print("Value must be between 0 and 28 cm.")
-					input("Press [Enter] to continue.")
-					continue
+	# Wait for the change, so the menu shows the new value
+	request_changes({name: value}).wait(changeTimeout)
+
+
+def parse_setting(name: str, text: str) -> float:
+	"""Reads a new value for one of the live settings.
+
+	:param name: Name of the setting, from liveSettings
+	:param text: Value entered
+
+	:raises ValueError: If the value isn't a number in the setting's allowed range. The message can be shown to the user.
+
+	:returns: The new value.
+	"""
+
+	low, high, unit = liveSettings[name]
+
+	try:
+		value = float(text)
+	except ValueError:
+		raise ValueError("Value must be a valid number.") from None
+
+	if not low <= value <= high:
+		raise ValueError(f"Value must be between {low} and {high}{unit}.")
+
+	return value
+
+
+def get_setting(name: str) -> float:
+	"""Returns the current value of one of the live settings."""
+
+	match name:
+		case "pollLoopInterval":
+			return pollLoopInterval
+		case "distancePrintDelay":
+			return distancePrintDelay
+		case "heightLimit":
+			return intersection.outputs.heightLimit
+		case "yellowLightExtensionDistance":
+			return intersection.outputs.yellowLightExtensionDistance
+
+
+def request_changes(changes: dict[str, object]) -> threading.Event:
+	"""Changes settings of the controller. While the intersection is running, the changes are queued for the settings job,
+	which makes them all at once between two other jobs, so no job ever sees only some of them. Otherwise they are made straight away.
+
+	:param changes: New values, keyed by setting name. Either a live setting, or "maintenanceLEDs".
+
+	:returns: Event that is set once the changes have been made.
+	"""
+
+	applied = threading.Event()
+	if operationMode in runningModes:
+		pendingChanges.put((changes, applied))
+	else:
+		apply_changes(changes)
+		applied.set()
+
+	return applied
+
+
+def apply_pending_changes() -> None:
+	"""Makes every queued setting change. Runs as a scheduler job, so it never runs at the same time as the other jobs."""
+
+	while True:
+		try:
+			changes, applied = pendingChanges.get_nowait()
+		except queue.Empty:
+			return
+
+		apply_changes(changes)
+		applied.set()
+
+
+def apply_changes(changes: dict[str, object]) -> None:
+	"""Makes a set of setting changes, see request_changes."""
+
+	global pollLoopInterval, distancePrintDelay
+
+	for name, value in changes.items():
+		match name:
+			case "pollLoopInterval":
+				pollLoopInterval = value
+				intersection.pollLoopInterval = value
+				scheduler.set_period("poll", value)
+			case "distancePrintDelay":
+				distancePrintDelay = value
+				scheduler.set_period("distancePrint", value)
+			case "heightLimit":
+				intersection.outputs.heightLimit = value
+			case "yellowLightExtensionDistance":
+				intersection.outputs.yellowLightExtensionDistance = value
+			case "maintenanceLEDs":
+				intersection.outputs.set_maintenance_LEDs(value)
+
+		Logger.info("Changed {name} to {value}.", name=name, value=value)
+
+
+def start_live_console() -> None:
+	"""Starts the live console thread, unless it is already running."""
+
+	global liveConsoleThread
+
+	if liveConsoleThread is not None and liveConsoleThread.is_alive():
+		return
+
+	liveConsoleStop.clear()
+	liveConsoleThread = threading.Thread(target=run_live_console, name="LiveConsole", daemon=True)
+	liveConsoleThread.start()
 
-				outputs.heightLimit = newMaxHeight
-			case "7":
-				newMaxDist = input("Enter new maximum vehicle height: ")
+
+def stop_live_console() -> None:
+	"""Stops the live console thread, and waits for it to finish, so the menus have the console to themselves."""
+
+	global liveConsoleThread
+
+	if liveConsoleThread is None:
+		return
+
+	liveConsoleStop.set()
+	liveConsoleThread.join()
+	liveConsoleThread = None
+	liveConsoleStop.clear()
+
+
+def run_live_console() -> None:
+	"""Takes console commands for as long as the intersection is running. Runs on the live console thread."""
+
+	print("Enter \"help\" for the commands available while the intersection is running, or press Ctrl+C to return to service mode.")
+
+	try:
+		while operationMode in runningModes and not liveConsoleStop.is_set():
+			try:
+				line = consoleLines.get(timeout=idleCheckInterval)
+			except queue.Empty:
+				continue
+
+			if line is None:
+				# Stdin has been closed, so the intersection carries on without the console until it is stopped
+				consoleLines.put(None)
+				liveConsoleStop.wait(idleCheckInterval)
+				continue
+
+			try:
+				run_console_command(line.split())
+			except EOFError:
+				# Stdin was closed during a menu opened from the live console
+				pass
+	except KeyboardInterrupt:
+		# Raised by console_input when the console is stopped
+		pass
+
+
+def run_console_command(words: list[str]) -> None:
+	"""Runs a live console command.
+
+	:param words: Command and its arguments
+	"""
+
+	if not words:
+		return
+
+	match words[0]:
+		case "help":
+			print("Commands:")
+			print("status - show the traffic stage and the live settings")
+			print("set NAME VALUE [NAME VALUE ...] - change live settings together, such as \"set heightLimit 20\"")
+			print("maintenance - open the maintenance menu, without stopping the intersection")
+			print(f"Live settings: {', '.join(liveSettings)}")
+		case "status":
+			print(f"Traffic stage {intersection.outputs.trafficStage + 1}, last distance reading {intersection.vehicleDistance:.2f} cm.")
+			for name in liveSettings:
+				print(f"{name}: {get_setting(name)}")
+		case "set":
+			arguments = words[1:]
+			if not arguments or len(arguments) % 2 != 0:
+				print("Give a value for each setting, such as \"set heightLimit 20\".")
+				return
+
+			changes = {}
+			for name, text in zip(arguments[::2], arguments[1::2]):
+				if name not in liveSettings:
+					print(f"{name} isn't a live setting. Live settings: {', '.join(liveSettings)}")
+					return
 
 				try:
-					newMaxDist = float(newMaxDist)
-				except ValueError:
-					print("Value must be a valid number.")
-					input("Press [Enter] to continue.")
-					continue
-					
-				if not 0 <= newMaxDist <= 50:
-					print("Value must be between 0 and 50 cm.")
-					input("Press [Enter] to continue.")
-					continue
+					changes[name] = parse_setting(name, text)
+				except ValueError as error:
+					print(f"{name}: {error}")
+					return
 
-				outputs.yellowLightExtensionDistance = newMaxDist
-			case "8":
-				running = False
+			request_changes(changes)
+		case "maintenance":
+			if not get_PIN_input():
+				return
+
+			request_changes({"maintenanceLEDs": True})
+			try:
+				maintenance_mode()
+			finally:
+				request_changes({"maintenanceLEDs": False})
+		case _:
+			print(f"Unknown command \"{words[0]}\". Enter \"help\" for the list of commands.")
 
 
 def data_observation_mode() -> None:
-	"""Creates a graph of the past 20 seconds of traffic data."""
+	"""Runs normal operation while showing a live graph of the past 20 seconds of traffic data.
+	Returns to service mode once the graph is closed.
+	"""
+
+	normal_operation()
 
-	if len(ultrasonicReadings) == 0:
-		print("No data to display!")
+
+def refresh_live_view(readings: tuple[np.ndarray, np.ndarray] | None = None) -> None:
+	"""Opens the live graph if needed and redraws it, while in data observation mode.
+	Returns to service mode once the graph is closed.
+
+	:param readings: [optional] Timestamps and distances to show, from get_live_view_readings. Defaults to the current readings,
+	which is only safe from the thread that adds them.
+	"""
+
+	global operationMode, liveView
+
+	if operationMode != dataObservationModeConstant:
 		return
 
-	if ultrasonicReadings[-1][0] - ultrasonicReadings[0][0] < 20:
-		print("Warning: less than 20 seconds of data will be shown.")
-	
-	x = [reading[0] - ultrasonicReadings[-1][0] for reading in ultrasonicReadings]
-	y = [reading[1] for reading in ultrasonicReadings]
+	if liveView is None:
+		liveView = ObservationView.LiveView(Intersection.ultrasonicReadingWindow)
+
+	if readings is None:
+		readings = intersection.ultrasonicReadings.get_last(Intersection.ultrasonicReadingWindow)
+
+	liveView.update(*readings, Clock.now())
+
+	if liveView.isClosed:
+		close_live_view()
+		operationMode = serviceModeConstant
+
+
+def get_live_view_readings() -> tuple[np.ndarray, np.ndarray]:
+	"""Returns copies of the readings shown on the live graph.
+	Unlike the views from the time series, they stay valid after the next reading is added, so they can be drawn from another thread.
+	"""
+
+	timestamps, distances = intersection.ultrasonicReadings.get_last(Intersection.ultrasonicReadingWindow)
+	return timestamps.copy(), distances.copy()
+
+
+def close_live_view() -> None:
+	"""Closes the live graph, if it is open."""
+
+	global liveView
+
+	if liveView is not None:
+		liveView.close()
+		liveView = None
+
+
+async def async_main() -> None:
+	"""Control loop for the async runtime.
+	Sensor polling, the traffic stage timer, the display and the console each run as their own task, and all board I/O goes through one adapter.
+	"""
+
+	init()
+	boardIO = AsyncBoard.AsyncBoard(intersection.board)
+
+	start_console_reader()
+
+	loop = asyncio.get_running_loop()
+	signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(handle_interrupt))
+
+	tasks = [asyncio.create_task(run_scheduled_job(boardIO, name), name=name) for name in scheduler.tasks]
+	for task in tasks:
+		task.add_done_callback(report_job_failure)
+	try:
+		await console_task(boardIO)
+	finally:
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+
+	await boardIO.run(shutdown)
+	boardIO.close()
+
 
-	_, ax = ppl.subplots()
+def report_job_failure(task: asyncio.Task) -> None:
+	"""Logs the error that stopped a job's task. Otherwise it would go unseen, since the tasks are only awaited once the program exits.
+
+	:param task: Finished task of a scheduled job
+	"""
+
+	if task.cancelled() or task.exception() is None:
+		return
+
+	Logger.error("Job {name} stopped after an error:\n{trace}", name=task.get_name(), trace="".join(traceback.format_exception(task.exception())).rstrip())
+
+
+def handle_interrupt() -> None:
+	"""Handles Ctrl+C in the async runtime the same way as main. Drops back to service mode, or exits if already in service mode."""
+
+	global operationMode
+
+	close_live_view()
+	if operationMode == serviceModeConstant:
+		operationMode = exitConstant
+	else:
+		operationMode = serviceModeConstant
+
+	# Ends any menu waiting on input, and tells the console task to reset the outputs
+	consoleInterrupted.set()
+
+
+async def run_scheduled_job(boardIO: AsyncBoard.AsyncBoard, name: str) -> None:
+	"""Runs one of the scheduler's jobs from its own asyncio task while the intersection is running."""
+
+	job = scheduler.tasks[name].func
+
+	def run_timed_job(*args) -> int:
+		# Latency is the processing time of the job, the same as in the synchronous loop, so waiting for the board I/O thread isn't counted
+		startTime_ns = time.perf_counter_ns()
+		job(*args)
+		return time.perf_counter_ns() - startTime_ns
+
+	async def run_job():
+		# The graph has to be drawn from the event loop thread, which is also the main thread. Every other job uses the board.
+		if name == "liveView":
+			# The poll job adds readings on the board I/O thread, so the graph is given copies taken on that thread
+			readings = await boardIO.run(get_live_view_readings)
+			loopLatency_ns = run_timed_job(readings)
+		else:
+			loopLatency_ns = await boardIO.run(run_timed_job)
+
+		# Recorded from the event loop thread, so the metric is never updated from two threads at once
+		record_loop_latency(loopLatency_ns)
+
+	await scheduler.run_async(name, run_job, lambda: operationMode in runningModes, idleCheckInterval)
+
+
+async def console_task(boardIO: AsyncBoard.AsyncBoard) -> None:
+	"""Runs the service and maintenance menus whenever the system is in one of those modes, and the live console while it is running,
+	until the program exits.
+	"""
+
+	global operationMode, requestedRunningMode
+
+	while operationMode != exitConstant:
+		if operationMode != dataObservationModeConstant:
+			close_live_view()
+
+		if operationMode in runningModes:
+			start_live_console()
+		else:
+			# Waits for the live console to finish any command, without holding up the event loop
+			await asyncio.to_thread(stop_live_console)
+
+		if consoleInterrupted.is_set():
+			consoleInterrupted.clear()
+			await boardIO.run(reset_outputs)
+			continue
+
+		if operationMode == serviceModeConstant:
+			await boardIO.run(apply_pending_changes)
+			await run_on_console_thread(service_mode)
+
+			if requestedRunningMode is not None:
+				mode = requestedRunningMode
+				requestedRunningMode = None
+
+				# The jobs only start once the mode changes, so they never run before the intersection has started
+				await boardIO.run(init_normal_operation)
+				if operationMode == serviceModeConstant:
+					operationMode = mode
+		elif operationMode == maintenanceModeConstant:
+			await boardIO.run(intersection.outputs.set_maintenance_LEDs, True)
+			await run_on_console_thread(maintenance_mode)
+			await boardIO.run(intersection.outputs.set_maintenance_LEDs, False)
+
+			if operationMode == maintenanceModeConstant:
+				operationMode = serviceModeConstant
+		else:
+			await asyncio.sleep(idleCheckInterval)
+
+
+async def run_on_console_thread(menu) -> None:
+	"""Runs a blocking menu on its own thread, so the other tasks keep running while it waits for input.
+	The thread is a daemon, so a menu that is still waiting for input can't stop the program from exiting.
+
+	:param menu: Menu function to run
+	"""
+
+	loop = asyncio.get_running_loop()
+	finished = loop.create_future()
+
+	def run_menu():
+		global operationMode
+
+		try:
+			menu()
+		except KeyboardInterrupt:
+			pass
+		except EOFError:
+			# Stdin has been closed, so the menus can never be used again
+			print("Console input closed, exiting.")
+			operationMode = exitConstant
+		finally:
+			loop.call_soon_threadsafe(finished.set_result, None)
+
+	threading.Thread(target=run_menu, name="Console", daemon=True).start()
+	await finished
+
+
+def start_console_reader() -> None:
+	"""Starts reading console lines on a background thread, so the console never blocks the control loop."""
+
+	global consoleLines
+
+	consoleLines = queue.Queue()
+	threading.Thread(target=console_reader, name="ConsoleReader", daemon=True).start()
+
+
+def console_reader() -> None:
+	"""Reads console lines into a queue for console_input and the live console. Runs on its own thread.
+	Once stdin is closed, None is queued to mark the end of the input.
+	"""
+
+	try:
+		for line in sys.stdin:
+			consoleLines.put(line.rstrip("\n"))
+	finally:
+		consoleLines.put(None)
+
+
+def console_input(prompt: str = "") -> str:
+	"""Reads a line from the console.
+	Lines come from the console reader. Ctrl+C, or stopping the live console, ends the wait with a KeyboardInterrupt like it does in the sync loop.
+	Raises EOFError once stdin has been closed, the same as input.
+
+	:param prompt: Text to print before reading
+
+	:returns: Line entered, without the newline.
+	"""
+
+	if consoleLines is None:
+		return input(prompt)
+
+	print(prompt, end="", flush=True)
+	while True:
+		if consoleInterrupted.is_set() or liveConsoleStop.is_set():
+			raise KeyboardInterrupt
+
+		try:
+			line = consoleLines.get(timeout=idleCheckInterval)
+		except queue.Empty:
+			continue
 
-	ax.plot(x, y)
-	ax.set(xlim=(-20, 0), ylim=(0, max(y)))
+		if line is None:
+			# Put the end of the input back, so every later read ends too
+			consoleLines.put(None)
+			raise EOFError
 
-	ax.set_xlabel("Time (sec)")
-	ax.set_ylabel("Distance (cm)")
-	ax.set_title("Vehicle distance over time")
+		return line
 
-	ppl.show()
 
 if __name__ == "__main__":
 	main()
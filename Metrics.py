@@ -0,0 +1,274 @@
+"""Module to collect low-overhead performance metrics from the hot paths.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import functools
+import json
+import time
+
+# Set to False to stop recording. Instrumented code still runs, but only checks this flag.
+enabled = True
+
+# Histogram resolution. Each power of 2 is split into 2^(subBucketBits - 1) buckets, so values are recorded within about 3%.
+subBucketBits = 5
+# Largest value a histogram can record exactly, as a number of bits. 2^48 ns is over 3 days.
+maxValueBits = 48
+
+percentilesReported = (50, 90, 99)
+
+
+class Counter:
+	"""A count that only goes up, such as serial bytes sent."""
+
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, amount: int = 1) -> None:
+		"""Adds to the count."""
+		if enabled:
+			self.value += amount
+
+	def reset(self) -> None:
+		"""Resets the count to zero."""
+		self.value = 0
+
+	def get_snapshot(self, elapsedTime: float) -> dict[str, float]:
+		"""Returns the count, and its average rate per second over the given time."""
+		return {"value": self.value, "ratePerSecond": self.value / elapsedTime if elapsedTime > 0 else 0}
+
+
+class Gauge:
+	"""A value that is set rather than added to, such as the display refresh rate."""
+
+	def __init__(self):
+		self.value = 0
+
+	def set(self, value: float) -> None:
+		"""Sets the value."""
+		if enabled:
+			self.value = value
+
+	def reset(self) -> None:
+		"""Resets the value to zero."""
+		self.value = 0
+
+	def get_snapshot(self, elapsedTime: float) -> dict[str, float]:
+		"""Returns the value."""
+		return {"value": self.value}
+
+
+class Histogram:
+	"""Distribution of integer values, such as latencies in nanoseconds, using HDR-style log-linear buckets.
+	Recording is O(1) with a fixed amount of memory, and percentiles are accurate to within one bucket.
+	"""
+
+	def __init__(self):
+		self.halfBucketCount = 1 << (subBucketBits - 1)
+		self.counts = [0] * ((maxValueBits - subBucketBits + 2) * self.halfBucketCount)
+		self.reset()
+
+	def reset(self) -> None:
+		"""Removes every recorded value."""
+		for i in range(len(self.counts)):
+			self.counts[i] = 0
+
+		self.count = 0
+		self.total = 0
+		self.min = 0
+		self.max = 0
+
+	def get_bucket_index(self, value: int) -> int:
+		"""Works out which bucket a value falls into.
+		Values below 2^subBucketBits get a bucket each. Above that, each power of 2 is split into halfBucketCount buckets.
+		"""
+		magnitude = value.bit_length() - subBucketBits
+		if magnitude <= 0:
+			return value
+
+		return magnitude * self.halfBucketCount + (value >> magnitude)
+
+	def get_bucket_value(self, index: int) -> int:
+		"""Returns the middle of the range of values covered by a bucket."""
+		if index < 2 * self.halfBucketCount:
+			return index
+
+		magnitude = index // self.halfBucketCount - 1
+		subBucket = index - magnitude * self.halfBucketCount
+		return (subBucket << magnitude) + (1 << (magnitude - 1))
+
+	def record(self, value: int) -> None:
+		"""Adds a value to the histogram. Values too large to bucket go in the last bucket."""
+		if not enabled:
+			return
+
+		value = max(int(value), 0)
+		index = min(self.get_bucket_index(value), len(self.counts) - 1)
+		self.counts[index] += 1
+
+		if self.count == 0 or value < self.min:
+			self.min = value
+		if value > self.max:
+			self.max = value
+
+		self.count += 1
+		self.total += value
+
+	def get_percentile(self, percentile: float) -> int:
+		"""Returns the value that the given percentage of recorded values are at or below."""
+		if self.count == 0:
+			return 0
+
+		target = max(percentile / 100 * self.count, 1)
+		cumulativeCount = 0
+		for index, bucketCount in enumerate(self.counts):
+			cumulativeCount += bucketCount
+			if cumulativeCount >= target:
+				return min(self.get_bucket_value(index), self.max)
+
+		return self.max
+
+	def get_snapshot(self, elapsedTime: float) -> dict[str, float]:
+		"""Returns the number of values recorded, their mean, minimum and maximum, and the reported percentiles."""
+		snapshot = {
+			"count": self.count,
+			"mean": self.total / self.count if self.count else 0,
+			"min": self.min,
+			"max": self.max
+		}
+		for percentile in percentilesReported:
+			snapshot[f"p{percentile}"] = self.get_percentile(percentile)
+
+		return snapshot
+
+
+counters = {}
+gauges = {}
+histograms = {}
+resetTime = time.monotonic()
+
+
+def counter(name: str) -> Counter:
+	"""Returns the counter with the given name, creating it if needed."""
+	if name not in counters:
+		counters[name] = Counter()
+
+	return counters[name]
+
+
+def gauge(name: str) -> Gauge:
+	"""Returns the gauge with the given name, creating it if needed."""
+	if name not in gauges:
+		gauges[name] = Gauge()
+
+	return gauges[name]
+
+
+def histogram(name: str) -> Histogram:
+	"""Returns the histogram with the given name, creating it if needed. Latency histograms record nanoseconds."""
+	if name not in histograms:
+		histograms[name] = Histogram()
+
+	return histograms[name]
+
+
+def scoped_name(scope: str, name: str) -> str:
+	"""Returns the name of a metric belonging to one of several things in the process, such as one intersection of a corridor.
+
+	:param scope: Name of the thing the metric belongs to. Empty for a metric of the whole process.
+	:param name: Name of the metric
+
+	:returns: The name prefixed by the scope, or the name unchanged if there is no scope.
+	"""
+	return f"{scope}.{name}" if scope else name
+
+
+def timed(name: str, get_scope=None):
+	"""Decorator that records how long each call to a function takes, in the latency histogram with the given name.
+
+	:param name: Name of the histogram
+	:param get_scope: [optional] Function returning the scope of a call, given its first argument, see scoped_name.
+	Lets a method of a class with several instances record each instance's latency separately.
+	"""
+	def decorator(func):
+		latency = histogram(name) if get_scope is None else None
+		# Histogram of each scope, so the name is only built the first time a scope is seen
+		scopedLatencies = {}
+
+		@functools.wraps(func)
+		def timed_func(*args, **kwargs):
+			if not enabled:
+				return func(*args, **kwargs)
+
+			callLatency = latency
+			if get_scope is not None:
+				scope = get_scope(args[0])
+				callLatency = scopedLatencies.get(scope)
+				if callLatency is None:
+					callLatency = scopedLatencies[scope] = histogram(scoped_name(scope, name))
+
+			startTime_ns = time.perf_counter_ns()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				callLatency.record(time.perf_counter_ns() - startTime_ns)
+
+		return timed_func
+
+	return decorator
+
+
+def reset() -> None:
+	"""Resets every metric, and starts the period counter rates are measured over."""
+	global resetTime
+
+	for metrics in (counters, gauges, histograms):
+		for metric in metrics.values():
+			metric.reset()
+
+	resetTime = time.monotonic()
+
+
+def get_snapshot() -> dict[str, dict]:
+	"""Returns the current value of every metric.
+
+	:returns: Dictionary with the time since the last reset in seconds, and the snapshot of each counter, gauge and histogram by name.
+	"""
+	elapsedTime = time.monotonic() - resetTime
+	return {
+		"elapsedTime": elapsedTime,
+		"counters": {name: metric.get_snapshot(elapsedTime) for name, metric in sorted(counters.items())},
+		"gauges": {name: metric.get_snapshot(elapsedTime) for name, metric in sorted(gauges.items())},
+		"histograms": {name: metric.get_snapshot(elapsedTime) for name, metric in sorted(histograms.items())}
+	}
+
+
+def format_report() -> str:
+	"""Returns a human readable summary of every metric, with latencies in milliseconds."""
+	snapshot = get_snapshot()
+	lines = [f"Metrics over the last {snapshot['elapsedTime']:.1f} seconds:"]
+
+	for name, stats in snapshot["counters"].items():
+		lines.append(f"{name}: {stats['value']} ({stats['ratePerSecond']:.1f}/s)")
+
+	for name, stats in snapshot["gauges"].items():
+		lines.append(f"{name}: {stats['value']:.2f}")
+
+	for name, stats in snapshot["histograms"].items():
+		if stats["count"] == 0:
+			continue
+
+		percentiles = ", ".join(f"p{percentile} {stats[f'p{percentile}'] / 10**6:.3f}" for percentile in percentilesReported)
+		lines.append(f"{name}: {stats['count']} calls, mean {stats['mean'] / 10**6:.3f}, {percentiles}, max {stats['max'] / 10**6:.3f} ms")
+
+	return "\n".join(lines)
+
+
+def dump(path: str) -> None:
+	"""Writes the current value of every metric to a JSON file.
+
+	:param path: File to write to
+	"""
+	with open(path, "w") as file:
+		json.dump(get_snapshot(), file, indent=4)
@@ -0,0 +1,86 @@
+"""Module for a live graph of the ultrasonic readings, which updates while the intersection keeps running.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import numpy as np
+
+
+class LiveView:
+	"""Non-blocking plot of vehicle distance over time.
+	The figure is drawn once, and each update only redraws the line on top of a saved copy of the background (blitting).
+	matplotlib is only imported when a view is created, so the controller doesn't pay for it at start up.
+	"""
+
+	def __init__(self, window: float):
+		"""Opens the graph window.
+
+		:param window: How many seconds of readings to show
+		"""
+		import matplotlib.pyplot as ppl
+
+		self.ppl = ppl
+		self.window = window
+		self.yMax = 1
+		self.isClosed = False
+
+		ppl.ion()
+		self.figure, self.ax = ppl.subplots()
+
+		# The line is left out of normal draws, so the saved background doesn't include it
+		(self.line,) = self.ax.plot([], [], animated=True)
+		self.ax.set(xlim=(-window, 0), ylim=(0, self.yMax))
+
+		self.ax.set_xlabel("Time (sec)")
+		self.ax.set_ylabel("Distance (cm)")
+		self.ax.set_title("Vehicle distance over time")
+
+		self.background = None
+		self.figure.canvas.mpl_connect("draw_event", self.on_draw)
+		self.figure.canvas.mpl_connect("close_event", self.on_close)
+
+		ppl.show(block=False)
+		self.figure.canvas.draw()
+		self.figure.canvas.flush_events()
+
+	def on_draw(self, event) -> None:
+		"""Saves the background after every full redraw, such as after the window is resized."""
+		canvas = self.figure.canvas
+		self.background = canvas.copy_from_bbox(self.figure.bbox)
+		self.ax.draw_artist(self.line)
+
+	def on_close(self, event) -> None:
+		"""Stops updates once the window has been closed."""
+		self.isClosed = True
+
+	def update(self, timestamps: np.ndarray, values: np.ndarray, currentTime: float) -> None:
+		"""Moves the line to show the given readings, and handles any window events.
+
+		:param timestamps: Time of each reading, in seconds, oldest first
+		:param values: Distance of each reading, in cm
+		:param currentTime: Time at the right edge of the graph, in seconds
+		"""
+		if self.isClosed:
+			return
+
+		canvas = self.figure.canvas
+		self.line.set_data(timestamps - currentTime, values)
+
+		# Changing the axes needs a full redraw, so only grow the y axis when a reading goes off the top
+		if len(values) and values.max() > self.yMax:
+			self.yMax = values.max() * 1.1
+			self.ax.set_ylim(0, self.yMax)
+			canvas.draw()
+		elif self.background is not None:
+			canvas.restore_region(self.background)
+			self.ax.draw_artist(self.line)
+			canvas.blit(self.figure.bbox)
+
+		canvas.flush_events()
+
+	def close(self) -> None:
+		"""Closes the graph window."""
+		if not self.isClosed:
+			self.ppl.close(self.figure)
+			self.isClosed = True
@@ -0,0 +1,169 @@
+"""Module to replay recorded intersection data through the control logic, faster than real time.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+import numpy as np
+
+import Clock
+import EventLog
+import FakeBoard
+import inputsSubsystem as inputs
+import Main
+import outputsSubsystem as outputs
+import ShiftReg
+
+class ReplayClock(Clock.VirtualClock):
+	"""Virtual clock that never sleeps past wakeTime, so a replay can stop at the next recorded input."""
+
+	def __init__(self, startTime: float):
+		super().__init__(startTime)
+		self.wakeTime = float("inf")
+
+	def sleep(self, seconds: float) -> None:
+		"""Moves the clock forward by the given time, stopping early at wakeTime."""
+		self.advance(min(seconds, self.wakeTime - self.now()))
+
+
+class RecordingLog:
+	"""Stand-in for the active event log that keeps records in memory, so the replay can report on them."""
+
+	def __init__(self):
+		self.records = []
+
+	def log(self, event: int, source: int, value: float, timestamp: float | None = None, intersection: int = 0) -> None:
+		"""Keeps a record, see EventLog.EventLog.log. Only one intersection is replayed, so its number isn't kept."""
+		self.records.append((Clock.now() if timestamp is None else timestamp, event, source, value))
+
+	def close(self) -> None:
+		"""Nothing to write, the records are kept for the replay report."""
+
+
+def apply_record(board: FakeBoard.FakeBoard, record) -> None:
+	"""Feeds one recorded input into the fake board, which calls the same callbacks pymata4 would."""
+	event = record["event"]
+	source = int(record["source"])
+	value = record["value"]
+
+	if event == EventLog.sonarEvent:
+		board.set_sonar_distance(inputs.ultrasonicTriggers[source], value)
+	elif event == EventLog.digitalInputEvent and source != inputs.modeSwitchPin:
+		# The mode switch would take the replay out of normal operation, so it is left out
+		board.set_digital_input(source, int(value))
+	elif event == EventLog.ldrEvent:
+		board.set_analog_input(source, int(value))
+
+
+def replay(records: np.ndarray, extraTime: float = 0, quiet: bool = True, intersection: int = 0) -> dict:
+	"""Runs recorded sensor and button inputs through normal operation, using a fake board and a virtual clock.
+	The display isn't refreshed and shift register pulses aren't waited for, so the replay runs as fast as the CPU allows.
+	This takes over the state of every subsystem, so it can't be run alongside live control.
+
+	:param records: Event log records, as returned by EventLog.read_log. Only inputs are replayed, everything else is ignored.
+	:param extraTime: [optional] Seconds to keep running after the last input
+	:param quiet: [optional] Whether to hide what normal operation prints
+	:param intersection: [optional] Number of the intersection to replay, for logs holding several. A lone intersection is 0.
+
+	:returns: Dictionary with the stage timeline as (time, stage), the alerts as (time, alert, value),
+	the aux shift register frames as (time, frame), the time of the first input, and the replayed and wall clock durations in seconds.
+	"""
+	isInput = np.isin(records["event"], (EventLog.sonarEvent, EventLog.digitalInputEvent, EventLog.ldrEvent)) & (records["intersection"] == intersection)
+	inputRecords = np.sort(records[isInput], order="time", kind="stable")
+	if len(inputRecords) == 0:
+		raise ValueError("No inputs to replay.")
+
+	startTime = float(inputRecords["time"][0])
+	endTime = float(inputRecords["time"][-1]) + extraTime
+	clock = ReplayClock(startTime)
+	recordingLog = RecordingLog()
+
+	# Settings and modules swapped out for the replay, and put back afterwards
+	overrides = [
+		(Clock, "activeClock", clock),
+		(Main, "simulateBoard", True),
+		(Main, "eventLogDirectory", None),
+		(EventLog, "activeLog", recordingLog),
+		(outputs, "sevenSegBackgroundRefresh", False),
+		(ShiftReg, "pulseWaitMode", ShiftReg.noWaitConstant)
+	]
+	originalValues = [(module, name, getattr(module, name)) for module, name, _ in overrides]
+
+	frames = []
+	wallStartTime = time.perf_counter()
+	try:
+		for module, name, value in overrides:
+			setattr(module, name, value)
+
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+			Main.init()
+			Main.scheduler.remove("display")
+			Main.scheduler.remove("liveView")
+
+			board = Main.intersection.board.board
+			board.attach_shift_register(outputs.auxSerPin, outputs.auxSrClkPin, outputs.auxRClkPin)
+
+			Main.init_normal_operation()
+			Main.operationMode = Main.normalModeConstant
+
+			nextRecord = 0
+			while clock.now() < endTime:
+				while nextRecord < len(inputRecords) and inputRecords["time"][nextRecord] <= clock.now():
+					apply_record(board, inputRecords[nextRecord])
+					nextRecord += 1
+
+				clock.wakeTime = inputRecords["time"][nextRecord] if nextRecord < len(inputRecords) else endTime
+				Main.normal_operation()
+
+				frame = board.get_shift_register_output(outputs.auxRClkPin)
+				if not frames or frames[-1][1] != frame:
+					frames.append((clock.now(), frame))
+
+			Main.shutdown()
+	finally:
+		for module, name, value in originalValues:
+			setattr(module, name, value)
+
+	stageTimeline = [(t, source) for t, event, source, _ in recordingLog.records if event == EventLog.stageEvent]
+	alerts = [(t, source, value) for t, event, source, value in recordingLog.records if event == EventLog.alertEvent]
+
+	return {
+		"stageTimeline": stageTimeline,
+		"alerts": alerts,
+		"outputFrames": frames,
+		"startTime": startTime,
+		"replayedTime": endTime - startTime,
+		"wallTime": time.perf_counter() - wallStartTime
+	}
+
+
+def format_summary(result: dict) -> str:
+	"""Returns a human readable summary of a replay."""
+	alertNames = {EventLog.redLightAlert: "red light", EventLog.stallAlert: "stall", EventLog.overHeightAlert: "over height"}
+	startTime = result["startTime"]
+
+	lines = [f"Replayed {result['replayedTime']:.1f} seconds in {result['wallTime']:.2f} seconds "
+		f"({result['replayedTime'] / max(result['wallTime'], 1e-9):.0f}x real time)."]
+
+	lines.append(f"{len(result['stageTimeline'])} stage changes:")
+	for t, stage in result["stageTimeline"]:
+		lines.append(f"  {t - startTime:9.2f} s: stage {stage + 1}")
+
+	lines.append(f"{len(result['alerts'])} alerts:")
+	for t, alert, value in result["alerts"]:
+		lines.append(f"  {t - startTime:9.2f} s: {alertNames.get(alert, alert)} ({value:.2f})")
+
+	lines.append(f"{len(result['outputFrames'])} distinct output frames.")
+	return "\n".join(lines)
+
+
+if __name__ == "__main__":
+	# Usage: python Replay.py [LOG DIRECTORY] [INTERSECTION NUMBER]
+	result = replay(EventLog.read_log(sys.argv[1] if len(sys.argv) > 1 else Main.eventLogDirectory),
+		intersection=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+	print(format_summary(result))
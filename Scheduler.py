@@ -0,0 +1,225 @@
+"""Module to run periodic jobs on time, with accounting for late and missed runs.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import asyncio
+import heapq
+import itertools
+
+import Clock
+
+# What to do with deadlines that passed while a job was waiting to run
+catchUpPolicy = "catchUp" # run the job once for every deadline, back to back
+coalescePolicy = "coalesce" # run the job once for all of them, keeping to the original deadlines after that
+skipPolicy = "skip" # run the job once for all of them, then restart the schedule a full period after the late run
+
+
+class PeriodicTask:
+	"""A job that should run every period, along with its next deadline and how well it has kept to its deadlines."""
+
+	def __init__(self, name: str, func, period: float, policy: str):
+		"""Creates a periodic task. It doesn't run until it is started.
+
+		:param name: Name used in reports
+		:param func: Job to run
+		:param period: Time between runs, in seconds
+		:param policy: What to do with missed deadlines, one of the policy constants
+		"""
+		self.name = name
+		self.func = func
+		self.period = period
+		self.policy = policy
+		self.deadline = float("inf")
+
+		self.reset_stats()
+
+	def reset_stats(self) -> None:
+		"""Resets the run and lateness counters."""
+		self.numRuns = 0
+		self.numMissed = 0
+		self.totalLateness = 0
+		self.maxLateness = 0
+
+	def take_due_runs(self, currentTime: float) -> int:
+		"""Works out how many times the job should run now, and moves the deadline on according to the policy.
+
+		:param currentTime: Scheduler clock time, in seconds
+
+		:returns: Number of times to run the job.
+		"""
+		if currentTime < self.deadline:
+			return 0
+
+		# Deadlines that have passed, including the one being served
+		numPassed = int((currentTime - self.deadline) // self.period) + 1
+
+		if self.policy == catchUpPolicy:
+			numRuns = numPassed
+			lateness = currentTime - self.deadline
+			self.deadline += numPassed * self.period
+		else:
+			numRuns = 1
+			self.numMissed += numPassed - 1
+			lastDeadline = self.deadline + (numPassed - 1) * self.period
+			lateness = currentTime - lastDeadline
+			self.deadline = lastDeadline + self.period if self.policy == coalescePolicy else currentTime + self.period
+
+		self.numRuns += numRuns
+		self.totalLateness += lateness
+		self.maxLateness = max(self.maxLateness, lateness)
+
+		return numRuns
+
+	def get_stats(self) -> dict[str, float]:
+		"""Returns how well the task has kept to its deadlines.
+
+		:returns: Dictionary with the number of runs and missed deadlines, and the mean and maximum lateness in seconds.
+		"""
+		return {
+			"runs": self.numRuns,
+			"missed": self.numMissed,
+			"meanLateness": self.totalLateness / self.numRuns if self.numRuns else 0,
+			"maxLateness": self.maxLateness
+		}
+
+
+class Scheduler:
+	"""Runs periodic tasks in deadline order, using a heap of next deadlines.
+	Tasks can either all be run from one loop with run_pending and wait, or each from its own asyncio task with run_async.
+	"""
+
+	def __init__(self):
+		self.tasks = {}
+		self.heap = []
+		# Breaks ties between equal deadlines, in the order tasks were pushed
+		self.counter = itertools.count()
+
+	def clock(self) -> float:
+		"""Returns the scheduler time, in seconds."""
+		return Clock.now()
+
+	def add(self, name: str, func, period: float, policy: str = coalescePolicy) -> PeriodicTask:
+		"""Adds a periodic task. It first runs once the scheduler is started.
+
+		:param name: Unique name of the task
+		:param func: Job to run
+		:param period: Time between runs, in seconds
+		:param policy: What to do with missed deadlines, one of the policy constants
+
+		:returns: The new task.
+		"""
+		task = PeriodicTask(name, func, period, policy)
+		self.tasks[name] = task
+		return task
+
+	def remove(self, name: str) -> None:
+		"""Removes a task, if there is one with the given name."""
+		if self.tasks.pop(name, None) is not None:
+			self.rebuild_heap()
+
+	def set_period(self, name: str, period: float) -> None:
+		"""Changes how often a task runs, starting after its next run."""
+		self.tasks[name].period = period
+
+	def start(self) -> None:
+		"""Makes every task due straight away, then resets their stats."""
+		currentTime = self.clock()
+		for task in self.tasks.values():
+			task.deadline = currentTime
+
+		self.reset_stats()
+		self.rebuild_heap()
+
+	def rebuild_heap(self) -> None:
+		"""Rebuilds the deadline heap after tasks have been added, removed or rescheduled."""
+		self.heap = [(task.deadline, next(self.counter), task) for task in self.tasks.values()]
+		heapq.heapify(self.heap)
+
+	def run_pending(self) -> int:
+		"""Runs every task that is due, earliest deadline first.
+		Only deadlines that had passed when the call started are run, so a slow catch up task can't keep the call going forever.
+
+		:returns: Number of jobs run.
+		"""
+		currentTime = self.clock()
+		numRuns = 0
+
+		while self.heap and self.heap[0][0] <= currentTime:
+			_, _, task = heapq.heappop(self.heap)
+
+			# The task may have been removed or rescheduled since it was pushed
+			if self.tasks.get(task.name) is not task:
+				continue
+
+			for _ in range(task.take_due_runs(currentTime)):
+				task.func()
+				numRuns += 1
+
+			heapq.heappush(self.heap, (task.deadline, next(self.counter), task))
+
+		return numRuns
+
+	def get_time_until_next(self) -> float:
+		"""Returns how long until the next task is due, in seconds. Zero if one is already due."""
+		if not self.heap:
+			return float("inf")
+
+		return max(self.heap[0][0] - self.clock(), 0)
+
+	def wait(self, maxWait: float | None = None) -> None:
+		"""Sleeps until the next task is due.
+
+		:param maxWait: [optional] Longest time to sleep for, in seconds
+		"""
+		waitTime = self.get_time_until_next()
+		if maxWait is not None:
+			waitTime = min(waitTime, maxWait)
+
+		if waitTime > 0:
+			Clock.sleep(waitTime)
+
+	async def run_async(self, name: str, runJob, isActive, idleCheckInterval: float) -> None:
+		"""Runs one task from its own asyncio task, instead of from run_pending, until cancelled.
+
+		:param name: Name of the task
+		:param runJob: Coroutine function that runs the task's job once
+		:param isActive: Function returning whether the task should run at the moment
+		:param idleCheckInterval: Longest time to sleep for, in seconds, so starting, stopping and rescheduling are noticed
+		"""
+		task = self.tasks[name]
+
+		while True:
+			if not isActive():
+				await asyncio.sleep(idleCheckInterval)
+				continue
+
+			waitTime = task.deadline - self.clock()
+			if waitTime > 0:
+				await asyncio.sleep(min(waitTime, idleCheckInterval))
+				continue
+
+			for _ in range(task.take_due_runs(self.clock())):
+				await runJob()
+
+	def reset_stats(self) -> None:
+		"""Resets the stats of every task."""
+		for task in self.tasks.values():
+			task.reset_stats()
+
+	def get_stats(self) -> dict[str, dict[str, float]]:
+		"""Returns the stats of every task, see PeriodicTask.get_stats.
+
+		:returns: Dictionary of task stats, keyed by task name.
+		"""
+		return {name: task.get_stats() for name, task in self.tasks.items()}
+
+	def format_report(self) -> str:
+		"""Returns a summary of how well each task has kept to its deadlines, one line per task."""
+		lines = []
+		for name, stats in self.get_stats().items():
+			lines.append(f"{name}: {stats['runs']} runs, {stats['missed']} missed deadlines, "
+				f"{stats['meanLateness'] * 1000:.2f} ms mean and {stats['maxLateness'] * 1000:.2f} ms max lateness")
+
+		return "\n".join(lines)
@@ -4,8 +4,13 @@ Created Date: 13/05/2024
 Version: 1.2
 """
 
+import threading
 import time
+from functools import lru_cache
 from pymata4 import pymata4
+import BoardProxy
+import Clock
+import Metrics
 import ShiftReg
 
 lookupTable: dict[str, tuple[int]] = {
@@ -59,116 +64,283 @@ lookupTable: dict[str, tuple[int]] = {
 	"u": (0, 0, 1, 1, 1, 0, 0)
 }
 
-lastCharDisplayed = 0
-currentMessage = ' ' * 4
-messageStartTime = 0
+def build_glyph(char: str) -> int:
+	"""Finds the segments to light up for a character, falling back to the other case if it isn't in the lookup table.
+	
+	:param char: Character to look up
+
+	:returns: Segment bitmask, where bit 0 is the first segment in the lookup table. Unknown characters are blank.
+	"""
+	segments = lookupTable.get(char, lookupTable.get(char.swapcase(), (0,) * 7))
+	return sum(segment << i for i, segment in enumerate(segments))
+
+# Segment bitmask of every ASCII character, indexed by character code
+glyphTable = bytes(build_glyph(chr(code)) for code in range(128))
+compiledMessageCacheSize = 16
 messageScrollSpeed = 0.7
 
+# Background refresher settings
+# Full display refreshes per second. Each digit costs about 40 bytes, so 30 Hz uses around 4.8 kB/s, 40% of a 115200 baud link
+refresherRate = 30
+# Most serial bytes per second the display may use, whoever refreshes it. Half of a 115200 baud link, at 10 bits per byte,
+# so the sonar, polling and stage traffic always have the rest. Digits are skipped, and held for longer, to stay under it.
+maxBytesPerSecond = 115200 // 10 // 2
+# Full display refreshes per second, from whichever of the refresher or the control loop last refreshed the display.
+# Scoped by the display's board, see BoardProxy.get_metric_scope.
+refreshRateMetricName = "sevenSeg.refreshRate"
+# Serial bytes sent by the display. Its rate per second can be checked against maxBytesPerSecond.
+bytesMetricName = "sevenSeg.bytes"
+
 serPin = 7
 srClkPin = 8
 rClkPin = 9
 
 digitPins = [10, 11, 12, 13]
 
-def init(board: pymata4.Pymata4):
-	"""Sets up the connected board.
-	
-	:param board: Pymata board
-	"""
-	ShiftReg.init(board, serPin, srClkPin, rClkPin)
-	for pin in digitPins:
-		board.set_pin_mode_digital_output(pin)
+# Segment shift register output channels. Bit i of a glyph bitmask is channel i
+segmentChannels = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6}
 
 
-def set_message(message: str, resetScroll: bool = True):
-	"""Sets the message displayed on the seven segment display.
+def pad_message(message: str) -> str:
+	"""Pads a message so that it can be scrolled across the display by sliding a 4 character window over it.
 	
-	:param message: New message to show
-	:param resetScroll: Whether to reset the message scrolling or to continue where it was before.
-	Message scrolling will reset regardless of this parameter if the new message is a different length.
-	"""
-	global currentMessage, messageStartTime
-
-	prevMessageLen = len(currentMessage)
+	:param message: Message to pad
 
+	:returns: Padded message.
+	"""
 	# If the message is less than 4 characters in length, the scrolling will need to act slightly differently
 	if len(message) < 4:
-		currentMessage = message.rjust(4) + ' ' * (4 - len(message))
+		paddedMessage = message.rjust(4) + ' ' * (4 - len(message))
 		if len(message) > 1:
-			currentMessage += message[0:-2]
-	else:
-		# If the message is at least 4 characters, make the stored message string the message, 4 spaces and the first 3 characters of the new message
-		currentMessage = message + "    " + message[0:3]
-	
-	if resetScroll or len(currentMessage) != prevMessageLen:
-		messageStartTime = time.time()
+			paddedMessage += message[0:-2]
+		return paddedMessage
 
+	# If the message is at least 4 characters, make the stored message string the message, 4 spaces and the first 3 characters of the new message
+	return message + "    " + message[0:3]
 
-def update(board: pymata4.Pymata4) -> None:
-	"""Refreshes the seven segment display to show the next character in the message and scrolls the message.
 
-	:param board: Connected pymata board.
-	"""
-	global lastCharDisplayed
-
-	# Calculate the current scroll position by dividing the time since the message was set by the time per scroll
-	# Then, take that mod (stored message length - 3), which will tell us the beginning of the "window" for the current 4 characters to show on the screen
-	messageScroll = int(((time.time() - messageStartTime) // messageScrollSpeed) % (len(currentMessage) - 3))
-	# Create a submessage which discards all the characters before the "window"
-	subMessage = currentMessage[messageScroll:]
-
-	currentChar = subMessage[lastCharDisplayed]
-	charSequence = [0] * 7
-	if currentChar in lookupTable:
-		charSequence = lookupTable[currentChar]
-	elif currentChar.swapcase() in lookupTable:
-		charSequence = lookupTable[currentChar.swapcase()]
+@lru_cache(maxsize=compiledMessageCacheSize)
+def compile_message(message: str) -> tuple[str, bytes]:
+	"""Compiles a message into the segment bitmasks shown on each digit at every scroll position.
+	Results are cached, since the same messages tend to be set over and over.
 	
-	ShiftReg.write_shift_reg(board, serPin, srClkPin, charSequence, True)
+	:param message: Message to compile
 
-	for pin in digitPins:
-		board.digital_write(pin, 1)
-	ShiftReg.display_output(board, rClkPin)
-	board.digital_write(digitPins[lastCharDisplayed], 0)
+	:returns: The padded message, and the bitmask of digit d at scroll position s, stored at index s * 4 + d.
+	"""
+	paddedMessage = pad_message(message)
+	glyphs = bytes(glyphTable[ord(char)] if ord(char) < 128 else 0 for char in paddedMessage)
 
-	lastCharDisplayed += 1
-	lastCharDisplayed %= 4
+	frames = bytearray()
+	for messageScroll in range(len(paddedMessage) - 3):
+		frames += glyphs[messageScroll:messageScroll + 4]
 
+	return paddedMessage, bytes(frames)
 
-def reset(board: pymata4.Pymata4) -> None:
-	"""Clears the output of the seven segment display.
-	
-	:param board: Pymata board
-	"""
 
-	global messageStartTime
+class Display:
+	"""A four digit seven segment display on one board, multiplexed through a shift register for the segments."""
+
+	__slots__ = (
+		"board", "segmentFrame", "lastCharDisplayed", "currentMessage", "currentFrames", "numScrollPositions",
+		"messageStartTime", "messageLock", "refresherThread", "refresherStopEvent", "measuredRefreshRate", "nextUpdateTime"
+	)
+
+	def __init__(self, board: pymata4.Pymata4):
+		"""Creates a display. Nothing is sent to the board until init is called.
+		
+		:param board: Pymata board the display is connected to
+		"""
+		self.board = board
+		self.segmentFrame = ShiftReg.Framebuffer(serPin, srClkPin, rClkPin, len(segmentChannels), segmentChannels)
+
+		self.lastCharDisplayed = 0
+		self.currentMessage = ' ' * 4
+		# Segment bitmasks for every scroll position of the current message, 4 digits per position
+		self.currentFrames = bytes(4)
+		self.numScrollPositions = 1
+		self.messageStartTime = 0
+		# Held while the message is changed or read, so the refresher thread never sees half of a new message
+		self.messageLock = threading.Lock()
+
+		self.refresherThread = None
+		self.refresherStopEvent = threading.Event()
+		self.measuredRefreshRate = 0
+		# Earliest time the next digit can be shown without going over maxBytesPerSecond
+		self.nextUpdateTime = 0
+
+	def init(self) -> None:
+		"""Sets up the display pins on the board."""
+		ShiftReg.init(self.board, serPin, srClkPin, rClkPin)
+		for pin in digitPins:
+			self.board.set_pin_mode_digital_output(pin)
+
+	def set_message(self, message: str, resetScroll: bool = True) -> None:
+		"""Sets the message displayed on the seven segment display.
+		
+		:param message: New message to show
+		:param resetScroll: Whether to reset the message scrolling or to continue where it was before.
+		Message scrolling will reset regardless of this parameter if the new message is a different length.
+		"""
+		newMessage, newFrames = compile_message(message)
+
+		with self.messageLock:
+			prevMessageLen = len(self.currentMessage)
+
+			self.currentMessage, self.currentFrames = newMessage, newFrames
+			self.numScrollPositions = len(self.currentMessage) - 3
+			
+			if resetScroll or len(self.currentMessage) != prevMessageLen:
+				self.messageStartTime = Clock.now()
+
+	@Metrics.timed("sevenSeg.update", BoardProxy.get_owner_metric_scope)
+	def update(self) -> int:
+		"""Refreshes the seven segment display to show the next character in the message and scrolls the message.
+		Does nothing if the last digit hasn't yet been shown for long enough to keep the display under maxBytesPerSecond.
+
+		:returns: Number of serial bytes sent.
+		"""
+		currentTime = Clock.now()
+		if currentTime < self.nextUpdateTime:
+			return 0
+
+		board = self.board
+		segmentFrame = self.segmentFrame
+
+		# Calculate the current scroll position by dividing the time since the message was set by the time per scroll
+		# Then, take that mod the number of scroll positions, which will tell us the beginning of the "window" for the current 4 characters to show on the screen
+		with self.messageLock:
+			messageScroll = int(((Clock.now() - self.messageStartTime) // messageScrollSpeed) % self.numScrollPositions)
+			segmentFrame.frame = self.currentFrames[messageScroll * 4 + self.lastCharDisplayed]
+
+		# If the next digit shows the same segments as the last one, only the digit pins need to change
+		charSequence = segmentFrame.shift_sequence()
+		
+		if ShiftReg.batchedWrites:
+			# Shift, blank the digits, latch and enable the next digit in one burst of port messages
+			if charSequence:
+				steps = ShiftReg.shift_steps(serPin, srClkPin, charSequence, True)
+				steps[-1].update({pin: 1 for pin in digitPins})
+				steps += ShiftReg.latch_steps(rClkPin)
+			else:
+				steps = [{pin: 1 for pin in digitPins}]
+			steps[-1][digitPins[self.lastCharDisplayed]] = 0
+			bytesSent = ShiftReg.write_steps(board, steps)
+			ShiftReg.end_frame()
+		else:
+			with BoardProxy.get_lock(board):
+				bytesSent = 0
+				if charSequence:
+					bytesSent += ShiftReg.write_shift_reg(board, serPin, srClkPin, charSequence, True)
+
+				for pin in digitPins:
+					bytesSent += ShiftReg.write_pin(board, pin, 1)
+				if charSequence:
+					bytesSent += ShiftReg.display_output(board, rClkPin)
+				bytesSent += ShiftReg.write_pin(board, digitPins[self.lastCharDisplayed], 0)
+				bytesSent += BoardProxy.flush(board)
+
+		segmentFrame.latch()
+
+		self.lastCharDisplayed += 1
+		self.lastCharDisplayed %= 4
+
+		self.nextUpdateTime = currentTime + bytesSent / maxBytesPerSecond
+		Metrics.counter(Metrics.scoped_name(BoardProxy.get_metric_scope(board), bytesMetricName)).inc(bytesSent)
+
+		return bytesSent
+
+	def refresher_loop(self) -> None:
+		"""Multiplexes the display at refresherRate until the refresher is stopped. Runs on the refresher thread."""
+		refreshes = 0
+		# Paced in real time rather than on the clock, since the refresher is a thread driving the actual display
+		rateWindowStart = time.perf_counter()
+		nextDigitTime = rateWindowStart
+
+		while not self.refresherStopEvent.is_set():
+			prevCharDisplayed = self.lastCharDisplayed
+			self.update()
+			# Digits skipped to stay under the byte budget don't move on to the next character
+			if self.lastCharDisplayed == 0 and prevCharDisplayed != 0:
+				refreshes += 1
+
+			currentTime = time.perf_counter()
+			if currentTime - rateWindowStart >= 1:
+				self.measuredRefreshRate = refreshes / (currentTime - rateWindowStart)
+				Metrics.gauge(Metrics.scoped_name(BoardProxy.get_metric_scope(self.board), refreshRateMetricName)).set(self.measuredRefreshRate)
+				refreshes = 0
+				rateWindowStart = currentTime
+
+			# Each refresh shows 4 digits. If the refresher has fallen behind, carry on from now instead of catching up
+			nextDigitTime = max(nextDigitTime + 1 / (refresherRate * 4), currentTime)
+			self.refresherStopEvent.wait(nextDigitTime - currentTime)
+
+	def start_refresher(self) -> None:
+		"""Starts refreshing the display from a background thread, so that the refresh rate doesn't depend on the control loop.
+		While it is running, the refresher owns the digit pins and the shift register, and update should not be called.
+		"""
+		if self.is_refresher_running():
+			return
+
+		self.measuredRefreshRate = 0
+		self.refresherStopEvent.clear()
+		self.refresherThread = threading.Thread(target=self.refresher_loop, name="SevenSegRefresher", daemon=True)
+		self.refresherThread.start()
+
+	def stop_refresher(self) -> None:
+		"""Stops the background refresher, and waits for it to finish its current digit."""
+		if self.refresherThread is None:
+			return
+
+		self.refresherStopEvent.set()
+		self.refresherThread.join()
+		self.refresherThread = None
+
+	def is_refresher_running(self) -> bool:
+		"""Returns whether the display is being refreshed by the background refresher.
+		
+		:returns: Whether the refresher is running.
+		"""
+		return self.refresherThread is not None and self.refresherThread.is_alive()
+
+	def get_measured_refresh_rate(self) -> float:
+		"""Returns the refresh rate the background refresher actually achieved over the last second.
+		
+		:returns: Full display refreshes per second, or 0 if it hasn't been measured yet.
+		"""
+		return self.measuredRefreshRate
+
+	def reset(self) -> None:
+		"""Clears the output of the seven segment display. Stops the background refresher if it is running."""
+		self.stop_refresher()
 
-	for pin in digitPins:
-		board.digital_write(pin, 1)
-	ShiftReg.write_shift_reg(board, serPin, srClkPin, [0] * 7)
-	ShiftReg.display_output(board, rClkPin)
+		for pin in digitPins:
+			self.board.digital_write(pin, 1)
+		self.segmentFrame.frame = 0
+		self.segmentFrame.flush(self.board, True)
 
-	messageStartTime = time.time()
+		self.messageStartTime = Clock.now()
 
 if __name__ == "__main__":
-	board = pymata4.Pymata4()
+	board = BoardProxy.BoardProxy(pymata4.Pymata4())
 
-	time.sleep(1)
+	BoardProxy.barrier(board)
 
-	init(board)
+	display = Display(board)
+	display.init()
 
-	set_message("HELLO I LIVE")
-	# set_message("1234567890")
+	display.set_message("HELLO I LIVE")
+	# display.set_message("1234567890")
 
 	# board.set_pin_mode_analog_input(0)
 
 	try:
 		while True:
-			update(board)
+			display.update()
 	except KeyboardInterrupt:
 		pass
 
 	print("Shutting down...")
-	reset(board)
-	time.sleep(1)
+	display.reset()
+	BoardProxy.barrier(board)
 	board.shutdown()
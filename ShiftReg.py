@@ -1,14 +1,45 @@
 """Module to control a shift register.
 Written by: Evgeny Solomin
 Created Date: 13/05/2024
-Version: 1.2
+Version: 1.3
 """
 
 from pymata4 import pymata4
+from pymata4.private_constants import PrivateConstants
+import threading
 import time
 
+import BoardProxy
+import Clock
+import Metrics
+
 clockTime_ns = 10*10**5
 
+# Pulse timing strategies
+noWaitConstant = "none" # Don't wait at all, rely on serial latency to space out the clock edges
+spinWaitConstant = "spin" # Busy-wait for every clock pulse
+hybridWaitConstant = "hybrid" # Sleep for most of every clock pulse, then busy-wait the remainder
+deadlineWaitConstant = "deadline" # Wait once at the end of each frame instead of once per pulse
+
+pulseWaitMode = deadlineWaitConstant
+# How long before a deadline the hybrid wait stops sleeping and starts spinning, since sleep can overshoot
+hybridSpinTime_ns = 2*10**5
+
+# Each thread writing to a shift register keeps its own frame deadline
+frameTiming = threading.local()
+
+# Timing statistics
+numWaits = 0
+waitWallTime_ns = 0
+waitCPUTime_ns = 0
+
+# When enabled, shift register frames are encoded into Firmata port messages and sent as a single burst,
+# instead of three separate digital_write calls per bit
+batchedWrites = True
+
+# Firmata sends a whole port (8 pins) in one 3 byte digital message
+digitalMessageSize = 3
+
 def init(board: pymata4.Pymata4, serPin: int, srClkPin: int, rClkPin: int) -> None:
 	"""Sets up a shift register connected to the given pins.
 	
@@ -27,12 +58,195 @@ def better_sleep(time_ns: float) -> None:
 	
 	:param time_ns: Time to sleep for, in nanoseconds
 	"""
-	target = time.perf_counter_ns() + time_ns
-	while time.perf_counter_ns() < target:
-		pass
+	Clock.spin_until_ns(Clock.now_ns() + time_ns)
+
+
+def hybrid_sleep_until(target_ns: int) -> None:
+	"""Sleeps until shortly before the target time, then busy-waits the rest.
+	Uses far less CPU time than better_sleep for long waits, while keeping most of its accuracy.
+	
+	:param target_ns: Clock time to wait until, in nanoseconds
+	"""
+	sleepTime_ns = target_ns - Clock.now_ns() - hybridSpinTime_ns
+	if sleepTime_ns > 0:
+		Clock.sleep(sleepTime_ns / 10**9)
+
+	Clock.spin_until_ns(target_ns)
+
+
+def record_wait(wallStart_ns: int, cpuStart_ns: int) -> None:
+	"""Adds a finished wait to the timing statistics.
+	
+	:param wallStart_ns: perf_counter_ns time the wait started at
+	:param cpuStart_ns: thread_time_ns time the wait started at
+	"""
+	global numWaits, waitWallTime_ns, waitCPUTime_ns
+
+	numWaits += 1
+	waitWallTime_ns += time.perf_counter_ns() - wallStart_ns
+	waitCPUTime_ns += time.thread_time_ns() - cpuStart_ns
+
+
+def pulse_wait(time_ns: int) -> None:
+	"""Holds a clock pulse for the given time, using the strategy set by pulseWaitMode.
+	In deadline mode, this only moves the frame deadline back and end_frame does the waiting.
+	
+	:param time_ns: Minimum pulse length, in nanoseconds
+	"""
+	if pulseWaitMode == noWaitConstant:
+		return
+
+	if pulseWaitMode == deadlineWaitConstant:
+		frameTiming.deadline_ns = max(getattr(frameTiming, "deadline_ns", 0), Clock.now_ns() + time_ns)
+		return
+
+	wallStart_ns = time.perf_counter_ns()
+	cpuStart_ns = time.thread_time_ns()
+
+	if pulseWaitMode == hybridWaitConstant:
+		hybrid_sleep_until(Clock.now_ns() + time_ns)
+	else:
+		better_sleep(time_ns)
+
+	record_wait(wallStart_ns, cpuStart_ns)
+
+
+def end_frame() -> None:
+	"""Finishes a shift register frame. In deadline mode, waits once until every pulse in the frame has been held long enough."""
+	frameDeadline_ns = getattr(frameTiming, "deadline_ns", 0)
+	if pulseWaitMode != deadlineWaitConstant or frameDeadline_ns == 0:
+		return
+
+	wallStart_ns = time.perf_counter_ns()
+	cpuStart_ns = time.thread_time_ns()
+
+	hybrid_sleep_until(frameDeadline_ns)
+	frameTiming.deadline_ns = 0
+
+	record_wait(wallStart_ns, cpuStart_ns)
+
+
+def get_wait_stats() -> dict[str, int]:
+	"""Returns the time spent waiting on clock pulses since the last reset.
+	
+	:returns: Dictionary with the number of waits, and the wall time and CPU time spent waiting in nanoseconds.
+	"""
+	return {
+		"waits": numWaits,
+		"wallTime_ns": waitWallTime_ns,
+		"CPUTime_ns": waitCPUTime_ns
+	}
+
+
+def reset_wait_stats() -> None:
+	"""Resets the clock pulse timing statistics."""
+	global numWaits, waitWallTime_ns, waitCPUTime_ns
+
+	numWaits = 0
+	waitWallTime_ns = 0
+	waitCPUTime_ns = 0
+
+
+def shift_steps(serPin: int, srClkPin: int, sequence: list[int]|tuple[int], reverse: bool = False) -> list[dict[int, int]]:
+	"""Builds the pin steps needed to clock a sequence into a shift register.
+	Each step is a dictionary of pin numbers to levels which must all be applied before the next step.
+	The last step always lowers SRCLK, so callers may add other pin changes to it.
+	
+	:param serPin: Arduino pin connected to SER on the shift register
+	:param srClkPin: Arduino pin connected to SRCLK on the shift register
+	:param sequence: A list or tuple of 1s and 0s to write to the shift register.
+	:param reverse: Whether to reverse the sequence.
+	
+	:returns: List of pin steps.
+	"""
+	steps = []
+	for value in (reversed(sequence) if reverse else sequence):
+		steps.append({serPin: int(value), srClkPin: 0})
+		steps.append({srClkPin: 1})
+	steps.append({srClkPin: 0})
+
+	return steps
+
+
+def latch_steps(rClkPin: int) -> list[dict[int, int]]:
+	"""Builds the pin steps needed to pulse RCLK and display the stored shift register contents.
+	
+	:param rClkPin: Arduino pin connected to RCLK on the shift register
+	
+	:returns: List of pin steps.
+	"""
+	return [{rClkPin: 1}, {rClkPin: 0}]
+
+
+def encode_steps(steps: list[dict[int, int]], portStates: list[int]) -> bytearray:
+	"""Encodes pin steps into Firmata digital port messages.
+	Pins on the same port within a step are combined into one message, and ports whose value does not change are skipped.
+	
+	:param steps: Pin steps, as returned by shift_steps or latch_steps.
+	:param portStates: Shadow of the board's output ports, see BoardProxy.get_port_states. Updated with the encoded steps.
+	
+	:returns: Encoded messages, ready to be sent to the board in one write.
+	"""
+	burst = bytearray()
+	for step in steps:
+		changedPorts = {}
+		for pin, value in step.items():
+			port = pin // 8
+			portValue = changedPorts.get(port, portStates[port])
+			if value:
+				portValue |= 1 << (pin % 8)
+			else:
+				portValue &= ~(1 << (pin % 8))
+			changedPorts[port] = portValue
+
+		for port, portValue in changedPorts.items():
+			if portValue == portStates[port]:
+				continue
+
+			portStates[port] = portValue
+			burst += bytes((PrivateConstants.DIGITAL_MESSAGE + port, portValue & 0x7f, (portValue >> 7) & 0x7f))
 
+	return burst
 
-def write_shift_reg(board: pymata4.Pymata4, serPin: int, srClkPin: int, sequence: list[int]|tuple[int], reverse: bool = False) -> None:
+
+def write_pin(board: pymata4.Pymata4, pin: int, value: int) -> int:
+	"""Sets a digital pin, for the unbatched write path.
+	
+	:param board: Pymata4 board or board proxy
+	:param pin: Arduino pin number
+	:param value: Pin value (1 or 0)
+	
+	:returns: Number of serial bytes sent straight away. A board proxy holds the write, so it is counted by BoardProxy.flush instead.
+	"""
+	board.digital_write(pin, value)
+	return 0 if isinstance(board, BoardProxy.BoardProxy) else digitalMessageSize
+
+
+def write_steps(board: pymata4.Pymata4, steps: list[dict[int, int]]) -> int:
+	"""Encodes pin steps and sends them to the board in a single serial write.
+	
+	:param board: Pymata4 board
+	:param steps: Pin steps, as returned by shift_steps or latch_steps.
+	
+	:returns: Number of serial bytes sent.
+	"""
+	# The board's lock is held while sending, so that bursts from the seven segment refresher thread and the control loop don't interleave
+	with BoardProxy.get_lock(board):
+		# Any writes held by a board proxy have to be sent first, so the steps are encoded from the real port states
+		BoardProxy.flush(board)
+		burst = encode_steps(steps, BoardProxy.get_port_states(board))
+		if burst:
+			board._send_command(burst)
+
+	if burst:
+		# Edges inside a burst are spaced out by serial latency, only the frame as a whole is held
+		pulse_wait(clockTime_ns)
+
+	return len(burst)
+
+
+@Metrics.timed("shiftReg.writeShiftReg", BoardProxy.get_metric_scope)
+def write_shift_reg(board: pymata4.Pymata4, serPin: int, srClkPin: int, sequence: list[int]|tuple[int], reverse: bool = False) -> int:
 	"""Writes a sequence into the internal state storage of a shift register, but does not display it.
 	
 	:param board: Pymata4 board
@@ -40,22 +254,174 @@ def write_shift_reg(board: pymata4.Pymata4, serPin: int, srClkPin: int, sequence
 	:param srClkPin: Arduino pin connected to SRCLK on the shift register
 	:param sequence: A list or tuple of 1s and 0s to write to the shift register.
 	:param reverse: Whether to reverse the sequence. By default, the last element of the sequence ends up in the QA output channel.
+	
+	:returns: Number of serial bytes sent.
 	"""
+	if batchedWrites:
+		bytesSent = write_steps(board, shift_steps(serPin, srClkPin, sequence, reverse))
+		end_frame()
+		return bytesSent
+
+	bytesSent = 0
 	for value in (reversed(sequence) if reverse else sequence):
-		board.digital_write(serPin, value)
+		bytesSent += write_pin(board, serPin, value)
+		# SER has to settle before the rising clock edge, so it can't share a port message with it
+		bytesSent += BoardProxy.flush(board)
 		
-		board.digital_write(srClkPin, 1)
-		better_sleep(clockTime_ns)
-		# writeBegin = time.perf_counter_ns()
-		board.digital_write(srClkPin, 0)
-		# writeEnd = time.perf_counter_ns()
-		# print(f"Shift reg write took {writeEnd - writeBegin} ns.")
-
-def display_output(board: pymata4.Pymata4, rClkPin: int) -> None:
+		bytesSent += write_pin(board, srClkPin, 1)
+		bytesSent += BoardProxy.flush(board)
+		pulse_wait(clockTime_ns)
+		bytesSent += write_pin(board, srClkPin, 0)
+
+	bytesSent += BoardProxy.flush(board)
+	end_frame()
+	return bytesSent
+
+def display_output(board: pymata4.Pymata4, rClkPin: int) -> int:
 	"""Displays the output stored in the shift register connected to the RCLK pin.
 	
 	:param rClkPin: Pin number of pin connected to shift register RCLK terminal
+	
+	:returns: Number of serial bytes sent.
 	"""
-	board.digital_write(rClkPin, 1)
-	better_sleep(clockTime_ns)
-	board.digital_write(rClkPin, 0)
+	if batchedWrites:
+		bytesSent = write_steps(board, latch_steps(rClkPin))
+		end_frame()
+		return bytesSent
+
+	bytesSent = write_pin(board, rClkPin, 1)
+	bytesSent += BoardProxy.flush(board)
+	pulse_wait(clockTime_ns)
+	bytesSent += write_pin(board, rClkPin, 0)
+	bytesSent += BoardProxy.flush(board)
+
+	end_frame()
+	return bytesSent
+
+
+def write_frame(board: pymata4.Pymata4, serPin: int, srClkPin: int, rClkPin: int, sequence: list[int]|tuple[int], reverse: bool = False) -> int:
+	"""Writes a sequence into a shift register and displays it.
+	In batched mode, the whole frame is sent as one burst of port messages.
+	
+	:param board: Pymata4 board
+	:param serPin: Arduino pin connected to SER on the shift register
+	:param srClkPin: Arduino pin connected to SRCLK on the shift register
+	:param rClkPin: Arduino pin connected to RCLK on the shift register
+	:param sequence: A list or tuple of 1s and 0s to write to the shift register.
+	:param reverse: Whether to reverse the sequence.
+	
+	:returns: Number of serial bytes sent.
+	"""
+	if batchedWrites:
+		bytesSent = write_steps(board, shift_steps(serPin, srClkPin, sequence, reverse) + latch_steps(rClkPin))
+		end_frame()
+		return bytesSent
+
+	return write_shift_reg(board, serPin, srClkPin, sequence, reverse) + display_output(board, rClkPin)
+
+
+class Framebuffer:
+	"""Holds the outputs of a shift register chain as an integer bitfield, where bit i is output channel i (bit 0 is QA).
+	Only writes to the hardware when the frame differs from the last latched one, and only shifts in as many bits as needed.
+	"""
+
+	def __init__(self, serPin: int, srClkPin: int, rClkPin: int, length: int, fields: dict[str, int]):
+		"""Creates a framebuffer for a shift register chain.
+		
+		:param serPin: Arduino pin connected to SER on the shift register
+		:param srClkPin: Arduino pin connected to SRCLK on the shift register
+		:param rClkPin: Arduino pin connected to RCLK on the shift register
+		:param length: Number of output channels in use
+		:param fields: Names of the output channels, mapped to their channel number
+		"""
+		self.serPin = serPin
+		self.srClkPin = srClkPin
+		self.rClkPin = rClkPin
+		self.length = length
+		self.fields = fields
+
+		self.frame = 0
+		# None when the hardware state is unknown, which forces the next flush to shift in the whole frame
+		self.latchedFrame = None
+
+	def set(self, field: str, value: int) -> None:
+		"""Sets a named output channel.
+		
+		:param field: Channel name
+		:param value: New state of the channel
+		"""
+		if value:
+			self.frame |= 1 << self.fields[field]
+		else:
+			self.frame &= ~(1 << self.fields[field])
+
+	def get(self, field: str) -> int:
+		"""Gets the state of a named output channel.
+		
+		:param field: Channel name
+
+		:returns: 1 if the channel is on, otherwise 0.
+		"""
+		return (self.frame >> self.fields[field]) & 1
+
+	def set_masked(self, mask: int, bits: int) -> None:
+		"""Sets several output channels at once.
+
+		:param mask: Bitfield of the channels to set
+		:param bits: New states of those channels, as a bitfield. Bits outside the mask are ignored.
+		"""
+		self.frame = (self.frame & ~mask) | (bits & mask)
+
+	def invalidate(self) -> None:
+		"""Marks the hardware state as unknown, so the next flush writes the whole frame."""
+		self.latchedFrame = None
+
+	def diff(self) -> int:
+		"""Returns which channels differ from the latched frame.
+		
+		:returns: XOR of the frame and the latched frame, or every channel if the hardware state is unknown.
+		"""
+		if self.latchedFrame is None:
+			return (1 << self.length) - 1
+
+		return self.frame ^ self.latchedFrame
+
+	def shift_sequence(self, forceWrite: bool = False) -> list[int]:
+		"""Works out the shortest sequence that turns the latched frame into the current one.
+		Shifting k bits moves every channel up by k, so if the top of the new frame is the bottom of the latched one, only k bits are needed.
+		
+		:param forceWrite: Whether to return the whole frame, even if it is already latched.
+
+		:returns: Sequence to write with reverse set, where element 0 ends up in QA. Empty if the frame is already latched.
+		"""
+		if forceWrite or self.latchedFrame is None:
+			numBits = self.length
+		elif self.frame == self.latchedFrame:
+			return []
+		else:
+			numBits = 1
+			while self.frame >> numBits != self.latchedFrame & ((1 << (self.length - numBits)) - 1):
+				numBits += 1
+
+		return [(self.frame >> i) & 1 for i in range(numBits)]
+
+	def latch(self) -> None:
+		"""Records that the current frame has been written to the hardware."""
+		self.latchedFrame = self.frame
+
+	def flush(self, board: pymata4.Pymata4, forceWrite: bool = False) -> int:
+		"""Writes the frame to the shift register and displays it, skipping the hardware entirely if nothing changed.
+		
+		:param board: Pymata4 board
+		:param forceWrite: Whether to write the frame even if it is already latched.
+
+		:returns: Number of serial bytes sent.
+		"""
+		sequence = self.shift_sequence(forceWrite)
+		if not sequence:
+			return 0
+
+		bytesSent = write_frame(board, self.serPin, self.srClkPin, self.rClkPin, sequence, True)
+		self.latch()
+
+		return bytesSent
@@ -0,0 +1,103 @@
+"""Module to compile traffic stage plans into lookup tables for the output subsystem.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+
+A stage plan is a dictionary, or a JSON file, with a list of stages. Each stage has:
+	lights: state of each light, in the order the light channels are given. A state indexes that light's channels,
+		and a state one past its last channel flashes the last channel (such as 2 for a flashing pedestrian green).
+	duration: seconds the stage lasts
+	outputs: [optional] names of other channels that are on during the stage, such as buzzers
+	pedestrianTime: [optional] seconds left in the stage once a pedestrian button is pressed, if that is shorter
+	extensionTime: [optional] seconds added, once per stage, when a vehicle is too close to stop
+	next: [optional] index of the stage that follows. Defaults to the next one in the list, wrapping around.
+"""
+
+import json
+
+
+class StagePlan:
+	"""A stage plan compiled into per-stage tables, so a stage change is one lookup and one frame write.
+	Every table is indexed by stage number.
+	"""
+
+	def __init__(self, definition: dict, fields: dict[str, int], lightChannels: tuple[tuple[str, ...], ...]):
+		"""Compiles a stage plan.
+
+		:param definition: Stage plan, see the module description
+		:param fields: Names of the output channels, mapped to their channel number
+		:param lightChannels: Names of the channels of each light, indexed by light state
+
+		:raises ValueError: If the plan is empty or refers to a light state, channel or stage that doesn't exist.
+		"""
+		stages = definition["stages"]
+		if not stages:
+			raise ValueError("A stage plan needs at least one stage.")
+
+		self.name = definition.get("name", "custom")
+		self.numStages = len(stages)
+
+		self.lightStates = []
+		self.durations = []
+		self.nextStages = []
+		self.pedestrianTimes = []
+		self.extensionTimes = []
+		# Channels that are on during each stage, and channels that flash during each stage
+		self.frames = []
+		self.blinkMasks = []
+
+		# Every channel the plan drives, so a stage frame can be written without touching the rest
+		self.mask = 0
+		for channels in lightChannels:
+			for channel in channels:
+				self.mask |= 1 << fields[channel]
+
+		for index, stage in enumerate(stages):
+			lights = tuple(stage["lights"])
+			if len(lights) != len(lightChannels):
+				raise ValueError(f"Stage {index + 1} needs a state for each of the {len(lightChannels)} lights.")
+
+			frame = 0
+			blinkMask = 0
+			for state, channels in zip(lights, lightChannels):
+				if 0 <= state < len(channels):
+					frame |= 1 << fields[channels[state]]
+				elif state == len(channels):
+					blinkMask |= 1 << fields[channels[-1]]
+				else:
+					raise ValueError(f"Stage {index + 1} has a light state of {state}, which doesn't exist.")
+
+			for channel in stage.get("outputs", ()):
+				if channel not in fields:
+					raise ValueError(f"Stage {index + 1} turns on {channel}, which isn't an output channel.")
+
+				frame |= 1 << fields[channel]
+				self.mask |= 1 << fields[channel]
+
+			nextStage = stage.get("next", (index + 1) % self.numStages)
+			if not 0 <= nextStage < self.numStages:
+				raise ValueError(f"Stage {index + 1} is followed by stage {nextStage + 1}, which doesn't exist.")
+
+			self.lightStates.append(lights)
+			self.durations.append(stage["duration"])
+			self.nextStages.append(nextStage)
+			self.pedestrianTimes.append(stage.get("pedestrianTime"))
+			self.extensionTimes.append(stage.get("extensionTime", 0))
+			self.frames.append(frame)
+			self.blinkMasks.append(blinkMask)
+
+
+def load(path: str, fields: dict[str, int], lightChannels: tuple[tuple[str, ...], ...]) -> StagePlan:
+	"""Loads and compiles a stage plan from a JSON file. The plan is named after the file unless it has a name.
+
+	:param path: Path of the JSON file
+	:param fields: Names of the output channels, mapped to their channel number
+	:param lightChannels: Names of the channels of each light, indexed by light state
+
+	:returns: The compiled stage plan.
+	"""
+	with open(path) as file:
+		definition = json.load(file)
+
+	definition.setdefault("name", path)
+	return StagePlan(definition, fields, lightChannels)
@@ -0,0 +1,99 @@
+"""Module for storing a sliding window of timestamped sensor readings.
+Written by: Evgeny Solomin
+Created Date: 18/10/2026
+Version: 1.0
+"""
+
+import numpy as np
+
+
+class TimeSeries:
+	"""Fixed-capacity ring buffer of (timestamp, value) samples, backed by preallocated NumPy arrays.
+	Every sample is written twice, capacity apart, so the stored samples are always one contiguous slice.
+	This lets views of the data be returned without copying, and appending and evicting are O(1).
+	"""
+
+	def __init__(self, capacity: int, window: float | None = None):
+		"""Creates an empty time series.
+		
+		:param capacity: Maximum number of samples to keep. The oldest sample is dropped when it is full.
+		:param window: [optional] How many seconds of data to keep. Older samples are evicted as new ones are added.
+		"""
+		self.capacity = capacity
+		self.window = window
+
+		self.timestamps = np.zeros(2 * capacity)
+		self.values = np.zeros(2 * capacity)
+		self.start = 0
+		self.length = 0
+
+	def __len__(self) -> int:
+		return self.length
+
+	def clear(self) -> None:
+		"""Removes every sample."""
+		self.start = 0
+		self.length = 0
+
+	def append(self, timestamp: float, value: float) -> None:
+		"""Adds a sample, then evicts samples that have fallen out of the window.
+		
+		:param timestamp: Time of the sample, in seconds
+		:param value: Sample value
+		"""
+		if self.length == self.capacity:
+			self.start = (self.start + 1) % self.capacity
+			self.length -= 1
+
+		index = (self.start + self.length) % self.capacity
+		self.timestamps[index] = self.timestamps[index + self.capacity] = timestamp
+		self.values[index] = self.values[index + self.capacity] = value
+		self.length += 1
+
+		if self.window is not None:
+			self.evict(self.window)
+
+	def evict(self, window: float) -> None:
+		"""Removes old samples, while making sure that at least the given amount of time is still covered if possible.
+		
+		:param window: Time the remaining samples should cover, in seconds
+		"""
+		newestTime = self.timestamps[self.start + self.length - 1]
+
+		# Only remove the oldest sample if there will still be more than the window of data left without it
+		while self.length > 1 and newestTime - self.timestamps[self.start + 1] > window:
+			self.start = (self.start + 1) % self.capacity
+			self.length -= 1
+
+	def get_timestamps(self) -> np.ndarray:
+		"""Returns a read-only view of the sample timestamps, oldest first. The view is only valid until the next append."""
+		view = self.timestamps[self.start:self.start + self.length]
+		view.flags.writeable = False
+		return view
+
+	def get_values(self) -> np.ndarray:
+		"""Returns a read-only view of the sample values, oldest first. The view is only valid until the next append."""
+		view = self.values[self.start:self.start + self.length]
+		view.flags.writeable = False
+		return view
+
+	def get_last(self, seconds: float) -> tuple[np.ndarray, np.ndarray]:
+		"""Returns views of the samples from the last few seconds, measured back from the newest sample.
+		
+		:param seconds: How far back to go, in seconds
+		
+		:returns: Timestamps and values of the samples, oldest first.
+		"""
+		timestamps = self.get_timestamps()
+		if self.length == 0:
+			return timestamps, self.get_values()
+
+		firstIndex = np.searchsorted(timestamps, timestamps[-1] - seconds)
+		return timestamps[firstIndex:], self.get_values()[firstIndex:]
+
+	def get_duration(self) -> float:
+		"""Returns the time between the oldest and newest samples, in seconds."""
+		if self.length == 0:
+			return 0
+
+		return self.timestamps[self.start + self.length - 1] - self.timestamps[self.start]
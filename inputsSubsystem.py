@@ -5,9 +5,15 @@ version: 1.2
 """
 
 # imports
-import time
+import threading
+from collections import deque
 from pymata4 import pymata4
 
+import BoardProxy
+import Clock
+import EventLog
+import Metrics
+
 # Hardware constants
 pedestianButtonPins = [14, 15] # A0 and A1
 ldrPin = 2 # A2
@@ -21,139 +27,366 @@ numUltrasonicReadings = 5
 debounceTime = 0.1
 sensorHeight = 28
 nightThreshold = 800
-
-# Subsystem variables
-previousButtonStates = [0, 0]
-buttonStates = [0, 0]
-lastButtonChangeTimes = [0, 0]
+nightHysteresis = 40 # The smoothed reading has to pass the threshold by this much to change between day and night
+ldrSmoothing = 0.2 # Weight of each new reading in the smoothed LDR value
+ldrDifferential = 5 # Minimum change in the LDR reading for pymata4 to report it
 
 
-def init(board: pymata4.Pymata4) -> None:
-	"""Initializes input variables and board pins.
-	
-	:param board: The arduino board to use for set up.
+class Inputs:
+	"""Buttons, mode switch, LDR and ultrasonic sensors of one board.
+	Readings arrive through pymata4 callbacks, which may run on pymata4's reader thread.
 	"""
 
-	global lastButtonChangeTimes
-	
-	for i in range(2):
-		board.set_pin_mode_sonar(ultrasonicTriggers[i], ultrasonicEchos[i], timeout=10000)
+	__slots__ = (
+		"board", "intersectionNumber", "buttonStates", "rawButtonStates", "rawButtonChangeTimes", "lastButtonChangeTimes",
+		"buttonPresses", "pendingButtonPresses", "modeSwitchState", "inputEdges",
+		"smoothedLDRReading", "isNightState", "dayNightSubscribers",
+		"ultrasonicLock", "ultrasonicValues", "ultrasonicTimes", "ultrasonicValid",
+		"ultrasonicNextIndex", "ultrasonicNumSamples", "ultrasonicTotals", "ultrasonicNumValid"
+	)
+
+	def __init__(self, board: pymata4.Pymata4):
+		"""Creates the input subsystem for a board. Nothing is read until init is called.
+		
+		:param board: The arduino board the inputs are connected to.
+		"""
+		self.board = board
+		# Recorded with every event, so the events of several intersections in one log can be told apart
+		self.intersectionNumber = 0
+
+		self.buttonStates = [0, 0]
+		self.rawButtonStates = [0, 0]
+		self.rawButtonChangeTimes = [0, 0]
+		self.lastButtonChangeTimes = [0, 0]
+		# Whether each button was pressed before the last update, and since the last update
+		self.buttonPresses = [False, False]
+		self.pendingButtonPresses = [False, False]
+		self.modeSwitchState = 0
+
+		# Timestamped edges from the digital input callbacks, as (pin, value, time stamp).
+		# deque appends and pops are atomic, so the callback thread never has to wait for the control loop
+		self.inputEdges = deque()
+
+		# Day/night detection, updated by the LDR callback
+		self.smoothedLDRReading = None
+		self.isNightState = False
+		self.dayNightSubscribers = []
+
+		# Ultrasonic ring buffers, filled by the sonar callbacks. Each sensor keeps its last numUltrasonicReadings distinct readings
+		self.ultrasonicLock = threading.RLock()
+		self.ultrasonicValues = [[0] * numUltrasonicReadings for _ in range(2)]
+		self.ultrasonicTimes = [[0] * numUltrasonicReadings for _ in range(2)]
+		self.ultrasonicValid = [[False] * numUltrasonicReadings for _ in range(2)]
+		self.ultrasonicNextIndex = [0, 0]
+		self.ultrasonicNumSamples = [0, 0]
+		# Running totals of the valid readings in each buffer, so filtering doesn't need to loop over them
+		self.ultrasonicTotals = [0, 0]
+		self.ultrasonicNumValid = [0, 0]
+
+	def init(self) -> None:
+		"""Initializes input variables and board pins."""
+		board = self.board
+
+		self.reset_ultrasonic_buffers()
+		for i in range(2):
+			board.set_pin_mode_sonar(ultrasonicTriggers[i], ultrasonicEchos[i], callback=self.ultrasonic_callback, timeout=10000)
+
+		self.inputEdges.clear()
+		board.set_pin_mode_digital_input(pedestianButtonPins[0], callback=self.digital_input_callback)
+		board.set_pin_mode_digital_input(pedestianButtonPins[1], callback=self.digital_input_callback)
+		board.set_pin_mode_digital_input(modeSwitchPin, callback=self.digital_input_callback)
+		board.set_pin_mode_analog_input(ldrPin, callback=self.ldr_callback, differential=ldrDifferential)
+
+		self.lastButtonChangeTimes = [Clock.now() - debounceTime] * 2
+
+	def update(self) -> None:
+		"""Updates input parameters.
+		Button presses that happened since the last update are reported by pedestrian_button_pressed until the next update.
+		"""
+
+		self.drain_input_edges()
+
+		for i in range(2):
+			self.buttonPresses[i] = self.pendingButtonPresses[i]
+			self.pendingButtonPresses[i] = False
+
+	def digital_input_callback(self, data: list) -> None:
+		"""Queues a change of a digital input. Called by pymata4 whenever a button or the mode switch changes.
+		
+		:param data: Pymata4 digital report, [pin type, pin, value, time stamp]
+		"""
 
-	board.set_pin_mode_digital_input(pedestianButtonPins[0])
-	board.set_pin_mode_digital_input(pedestianButtonPins[1])
-	board.set_pin_mode_digital_input(modeSwitchPin)
-	board.set_pin_mode_analog_input(ldrPin, differential=1000)
+		# Stamped on arrival, since pymata4's time stamps come from the system time rather than the clock
+		timeStamp = Clock.now()
+		self.inputEdges.append((data[1], data[2], timeStamp))
+		EventLog.log_event(EventLog.digitalInputEvent, data[1], data[2], timeStamp, self.intersectionNumber)
 
-	lastButtonChangeTimes = [time.time() - debounceTime] * 2
+	def drain_input_edges(self) -> None:
+		"""Processes every queued input change, debouncing the pedestrian buttons using the time stamp of each change."""
 
+		while self.inputEdges:
+			pin, value, timeStamp = self.inputEdges.popleft()
 
-def update(board: pymata4.Pymata4) -> None:
-	"""Updates input parameters.
-	
-	:param board: Pymata4 board.
-	"""
+			if pin == modeSwitchPin:
+				self.modeSwitchState = value
+				continue
 
-	global previousButtonStates, buttonStates, lastButtonChangeTimes
+			button = pedestianButtonPins.index(pin)
+			self.settle_button(button, timeStamp)
 
-	for i in range(2):
-		previousButtonStates[i] = buttonStates[i]
+			self.rawButtonStates[button] = value
+			self.rawButtonChangeTimes[button] = timeStamp
+			# Ignore bounces straight after a change
+			if timeStamp < self.lastButtonChangeTimes[button] + debounceTime:
+				continue
 
-		if time.time() < lastButtonChangeTimes[i] + debounceTime:
-			continue
+			self.set_button_state(button, value, timeStamp)
+
+		currentTime = Clock.now()
+		for i in range(2):
+			self.settle_button(i, currentTime)
+
+	def settle_button(self, button: int, currentTime: float) -> None:
+		"""Applies the level a button settled on during its debounce time, since there won't be another edge to report it.
+		
+		:param button: Which button to check
+		:param currentTime: Time to check the button at
+		"""
+
+		if self.rawButtonStates[button] != self.buttonStates[button] and currentTime >= self.lastButtonChangeTimes[button] + debounceTime:
+			self.set_button_state(button, self.rawButtonStates[button], self.rawButtonChangeTimes[button])
+
+	def set_button_state(self, button: int, value: int, changeTime: float) -> None:
+		"""Changes the debounced state of a pedestrian button.
 		
-		buttonStates[i] = board.digital_read(pedestianButtonPins[i])[0]
-		if buttonStates[i] != previousButtonStates[i]:
-			previousButtonStates[i] = buttonStates[i]
-			lastButtonChangeTimes[i] = time.time()
+		:param button: Which button changed
+		:param value: New button state
+		:param changeTime: Time of the change
+		"""
 
+		if value == self.buttonStates[button]:
+			return
 
-def get_filtered_ultrasonic(board: pymata4.Pymata4, ultrasonicIndex: int) -> float | None:
-	"""Polls the ultrasonic sensor several times and averages the result, discarding any outliers.
-	
-	:param board: The arduino board to read from.
+		self.buttonStates[button] = value
+		self.lastButtonChangeTimes[button] = changeTime
 
-	:returns: The filtered, averaged distance read from the ultrasonic sensor. Returns None if all readings were considered outliers.
-	"""
-	
-	numReadings = 0
-	total = 0
+		if value:
+			self.pendingButtonPresses[button] = True
 
-	for i in range(numUltrasonicReadings):
-		reading = board.sonar_read(ultrasonicTriggers[ultrasonicIndex])[0]
+	def reset_ultrasonic_buffers(self) -> None:
+		"""Empties the ultrasonic ring buffers."""
 
-		# Ultrasonic sensor range is between 2 and 400 cm
-		if 2 <= reading <= 400:
-			total += reading
-			numReadings += 1
-	
-	if numReadings == 0:
-		return None
+		for i in range(2):
+			self.clear_ultrasonic_buffer(i)
 
-	average = total / numReadings
-	return average
+	def clear_ultrasonic_buffer(self, ultrasonicIndex: int) -> None:
+		"""Empties the ring buffer of one ultrasonic sensor.
+		
+		:param ultrasonicIndex: Which ultrasonic sensor to clear
+		"""
+
+		with self.ultrasonicLock:
+			for j in range(numUltrasonicReadings):
+				self.ultrasonicValues[ultrasonicIndex][j] = 0
+				self.ultrasonicTimes[ultrasonicIndex][j] = 0
+				self.ultrasonicValid[ultrasonicIndex][j] = False
+
+			self.ultrasonicNextIndex[ultrasonicIndex] = 0
+			self.ultrasonicNumSamples[ultrasonicIndex] = 0
+			self.ultrasonicTotals[ultrasonicIndex] = 0
+			self.ultrasonicNumValid[ultrasonicIndex] = 0
+
+	def check_ultrasonic_echo(self, ultrasonicIndex: int) -> None:
+		"""Empties a sensor's ring buffer once it stops getting an echo, such as when a vehicle leaves.
+		pymata4 stores a reading of 0 (no echo) without calling the callback, so the buffer would otherwise keep the last vehicle's readings.
+		A stationary vehicle also stops calling the callback, so the age of the readings can't be used instead.
+		
+		:param ultrasonicIndex: Which ultrasonic sensor to check
+		"""
 
+		reading = self.board.sonar_read(ultrasonicTriggers[ultrasonicIndex])
+		if reading is None or reading[0] != 0:
+			return
 
-def pedestrian_button_pressed(button: int) -> bool:
-	"""Returns whether the pedestrian button was pressed since the last call of this function.
-	Debounces the button input in the process.
-	
-	:param board: The arduino board to read from.
-	:param button: Which button to check
+		with self.ultrasonicLock:
+			if self.ultrasonicNumSamples[ultrasonicIndex] == 0:
+				return
 
-	:returns: Whether or not the button was pressed.
-	"""
+			self.clear_ultrasonic_buffer(ultrasonicIndex)
 
-	return buttonStates[button] and not previousButtonStates[button]
+		EventLog.log_event(EventLog.sonarEvent, ultrasonicIndex, 0, intersection=self.intersectionNumber)
 
+	def ultrasonic_callback(self, data: list) -> None:
+		"""Stores a new ultrasonic reading in its sensor's ring buffer. Called by pymata4 whenever a sensor's reading changes.
+		
+		:param data: Pymata4 sonar report, [pin type, trigger pin, distance in cm, time stamp]
+		"""
+
+		ultrasonicIndex = ultrasonicTriggers.index(data[1])
+		reading = data[2]
+		timeStamp = Clock.now()
+		EventLog.log_event(EventLog.sonarEvent, ultrasonicIndex, reading, timeStamp, self.intersectionNumber)
+
+		with self.ultrasonicLock:
+			bufferIndex = self.ultrasonicNextIndex[ultrasonicIndex]
+			values = self.ultrasonicValues[ultrasonicIndex]
+			valid = self.ultrasonicValid[ultrasonicIndex]
+
+			# Remove the reading being overwritten from the running total
+			if valid[bufferIndex]:
+				self.ultrasonicTotals[ultrasonicIndex] -= values[bufferIndex]
+				self.ultrasonicNumValid[ultrasonicIndex] -= 1
+
+			# Ultrasonic sensor range is between 2 and 400 cm
+			isValid = 2 <= reading <= 400
+			values[bufferIndex] = reading
+			self.ultrasonicTimes[ultrasonicIndex][bufferIndex] = timeStamp
+			valid[bufferIndex] = isValid
+
+			if isValid:
+				self.ultrasonicTotals[ultrasonicIndex] += reading
+				self.ultrasonicNumValid[ultrasonicIndex] += 1
+
+			self.ultrasonicNextIndex[ultrasonicIndex] = (bufferIndex + 1) % numUltrasonicReadings
+			self.ultrasonicNumSamples[ultrasonicIndex] = min(self.ultrasonicNumSamples[ultrasonicIndex] + 1, numUltrasonicReadings)
+
+	@Metrics.timed("inputs.getFilteredUltrasonic", BoardProxy.get_owner_metric_scope)
+	def get_filtered_ultrasonic(self, ultrasonicIndex: int) -> float | None:
+		"""Averages the last few distinct readings from an ultrasonic sensor, discarding any outliers.
+		
+		:param ultrasonicIndex: Which ultrasonic sensor to read
 
-def get_vehicle_distance(board: pymata4.Pymata4) -> float:
-	"""Returns the distance to the next vehicle, in cm.
-	
-	:param board: Pymata4 board.
+		:returns: The filtered, averaged distance read from the ultrasonic sensor. Returns None if all readings were considered outliers.
+		"""
+		
+		with self.ultrasonicLock:
+			if self.ultrasonicNumValid[ultrasonicIndex] == 0:
+				return None
 
-	:returns: Distance to vehicle, in cm, or 0 if the readings were faulty
-	"""
+			return self.ultrasonicTotals[ultrasonicIndex] / self.ultrasonicNumValid[ultrasonicIndex]
 
-	reading = get_filtered_ultrasonic(board, 0)
+	def get_ultrasonic_age(self, ultrasonicIndex: int) -> float | None:
+		"""Returns how long ago an ultrasonic sensor's newest reading arrived.
+		Readings only arrive when they change, so a stationary vehicle will have an old reading.
+		
+		:param ultrasonicIndex: Which ultrasonic sensor to check
 
-	if reading is None:
-		return 0
+		:returns: Age of the newest reading in seconds, or None if there haven't been any readings.
+		"""
 
-	return reading
+		with self.ultrasonicLock:
+			if self.ultrasonicNumSamples[ultrasonicIndex] == 0:
+				return None
 
+			newestIndex = (self.ultrasonicNextIndex[ultrasonicIndex] - 1) % numUltrasonicReadings
+			return Clock.now() - self.ultrasonicTimes[ultrasonicIndex][newestIndex]
 
-def get_vehicle_height(board: pymata4.Pymata4) -> float:
-	"""Returns the heihgt of the next vehicle, in cm.
-	
-	:param board: Pymata4 board.
+	def pedestrian_button_pressed(self, button: int) -> bool:
+		"""Returns whether the pedestrian button was pressed before the last update.
+		Presses shorter than one control loop pass are still counted, since they are queued by the input callbacks.
+		
+		:param button: Which button to check
 
-	:returns: Height of vehicle, in cm. Will return a height of zero if the reading were faulty.
-	"""
-	reading = get_filtered_ultrasonic(board, 1)
+		:returns: Whether or not the button was pressed.
+		"""
 
-	if reading is None:
-		return 0
-	
-	return sensorHeight - reading
+		return self.buttonPresses[button]
 
+	def get_vehicle_distance(self) -> float:
+		"""Returns the distance to the next vehicle, in cm.
 
-def get_mode_switch_state(board: pymata4.Pymata4) -> bool:
-	"""Returns whether the mode override switch has been turned on.
-	
-	:param board: Pymata4 board.
+		:returns: Distance to vehicle, in cm, or 0 if the readings were faulty
+		"""
 
-	:returns: Mode override switch state.
-	"""
-	return board.digital_read(modeSwitchPin)[0]
+		self.check_ultrasonic_echo(0)
+		reading = self.get_filtered_ultrasonic(0)
 
+		if reading is None:
+			return 0
 
-def is_night(board: pymata4.Pymata4) -> bool:
-	"""Checks whether it is currently night.
-	
-	:param board: Pymata4 board.
+		return reading
 
-	:returns: Whether it is currently night or not.
-	"""
+	def get_vehicle_height(self) -> float:
+		"""Returns the heihgt of the next vehicle, in cm.
+
+		:returns: Height of vehicle, in cm. Will return a height of zero if the reading were faulty.
+		"""
+		self.check_ultrasonic_echo(1)
+		reading = self.get_filtered_ultrasonic(1)
+
+		if reading is None:
+			return 0
+		
+		return sensorHeight - reading
+
+	def get_mode_switch_state(self) -> bool:
+		"""Returns whether the mode override switch has been turned on.
+
+		:returns: Mode override switch state.
+		"""
+		self.drain_input_edges()
+		return self.modeSwitchState
+
+	def ldr_callback(self, data: list) -> None:
+		"""Smooths a new LDR reading and updates the day/night state. Called by pymata4 whenever the reading changes.
+		Subscribers are notified from this callback when it changes between day and night.
+		
+		:param data: Pymata4 analog report, [pin type, pin, value, time stamp]
+		"""
+
+		timeStamp = Clock.now()
+		EventLog.log_event(EventLog.ldrEvent, data[1], data[2], timeStamp, self.intersectionNumber)
+
+		if self.smoothedLDRReading is None:
+			self.smoothedLDRReading = data[2]
+			newIsNight = self.smoothedLDRReading > nightThreshold
+		else:
+			self.smoothedLDRReading += (data[2] - self.smoothedLDRReading) * ldrSmoothing
+
+			# Only change state once the reading is clearly past the threshold, so it doesn't flap at dusk
+			if self.isNightState:
+				newIsNight = self.smoothedLDRReading > nightThreshold - nightHysteresis
+			else:
+				newIsNight = self.smoothedLDRReading > nightThreshold + nightHysteresis
+
+		if newIsNight == self.isNightState:
+			return
+
+		self.isNightState = newIsNight
+		EventLog.log_event(EventLog.dayNightEvent, data[1], self.isNightState, timeStamp, self.intersectionNumber)
+
+		for subscriber in self.dayNightSubscribers:
+			subscriber(self.isNightState)
+
+	def subscribe_day_night(self, callback) -> None:
+		"""Registers a function to be called with the new state whenever it changes between day and night.
+		If the LDR has already been read, the function is also called straight away with the current state.
+		
+		:param callback: Function taking whether it is now night
+		"""
+
+		if callback in self.dayNightSubscribers:
+			return
+
+		self.dayNightSubscribers.append(callback)
+
+		# Otherwise a subscriber added after the first reading would assume day until the next change
+		if self.smoothedLDRReading is not None:
+			callback(self.isNightState)
+
+	def unsubscribe_day_night(self, callback) -> None:
+		"""Stops calling a function registered with subscribe_day_night.
+		
+		:param callback: Function to remove
+		"""
+
+		if callback in self.dayNightSubscribers:
+			self.dayNightSubscribers.remove(callback)
+
+	def is_night(self) -> bool:
+		"""Checks whether it is currently night. Doesn't read the board, the state is kept up to date by the LDR callback.
+
+		:returns: Whether it is currently night or not.
+		"""
 
-	ldrReading = board.analog_read(ldrPin)[0]
-	return ldrReading > nightThreshold
\ No newline at end of file
+		return self.isNightState
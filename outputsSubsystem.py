@@ -4,13 +4,18 @@ Created Date: 04/04/2024
 Version: 2.0
 """
 
-import time
 from pymata4 import pymata4
 
-import InputsSubsystem
+import BoardProxy
+import Clock
+import EventLog
+import inputsSubsystem
+import Logger
+import Metrics
 
 import SevenSeg
 import ShiftReg
+import StagePlan
 
 # the state of each light during each traffic stage
 # first column is main lights
@@ -30,260 +35,321 @@ blinkFrequency = 3 # in hertz
 heightLimit = 20
 yellowLightExtensionDistance = 30
 
-trafficStage = 0
+# Rules of the default stage plan
+pedestrianStageTime = 5 # seconds left in stage 1 once a pedestrian button is pressed
+yellowLightExtensionTime = 3 # seconds added to a yellow light when a vehicle is too close to stop
+stageOutputs = {3: ("stage4Buzzer",), 4: ("stage5Buzzer",)}
 
-trafficStageTimer = 0
-currentStageTime = 0
-lastUpdateTime = 0
-
-sevenSegRefreshes = 0
-yellowLightExtensionUsed = False
+# Whether to refresh the seven segment display from its own thread instead of from every update
+sevenSegBackgroundRefresh = True
 
 stageTimes = [30, 3, 3, 30, 3, 3]
 
-overHeightBuzzerTimer = -1
-overHeightLEDTimer = -1
-
-mainLightStates = [0, 0, 0]
-sideLightStates = [0, 0, 0]
-pedLightStates = [0, 0]
-
-overHeightBuzzerState = 0
-overHeightLEDState = 0
-
-maintenanceLEDsState = 0
-
-stage4BuzzerState = 0
-stage5BuzzerState = 0
-
-outputsModified = False
-
 auxSerPin = 17 # A3
 auxSrClkPin = 18 # A4
 auxRClkPin = 19 # A5
 
-
-def init(board: pymata4.Pymata4) -> None:
-	"""Initializes output variables and board pins.
-	
-	:param board: The arduino board to set up.
-	"""
-
-	board.set_pin_mode_digital_output(auxSerPin)
-	board.set_pin_mode_digital_output(auxSrClkPin)
-	board.set_pin_mode_digital_output(auxRClkPin)
-
-	SevenSeg.init(board)
-	ShiftReg.init(board, auxSerPin, auxSrClkPin, auxRClkPin)
-
-	SevenSeg.set_message("HELLO")
-
-	reset(board)
-	write_outputs(board)
+# Auxillary shift register output channels, see the pin layout
+auxChannels = {
+	"mainRed": 0, # QA1
+	"mainYellow": 1, # QB1
+	"mainGreen": 2, # QC1
+	"sideRed": 3, # QD1
+	"sideYellow": 4, # QE1
+	"sideGreen": 5, # QF1
+	"pedRed": 6, # QG1
+	"pedGreen": 7, # QH1
+	"overHeightBuzzer": 8, # QA2
+	"overHeightLED": 9, # QB2
+	"maintenanceLEDs": 10, # QC2
+	"stage4Buzzer": 11, # QD2
+	"stage5Buzzer": 12 # QE2
+}
+# Channels of each light, indexed by light state (0 is red, 1 is yellow, 2 is green)
+mainLightChannels = ("mainRed", "mainYellow", "mainGreen")
+sideLightChannels = ("sideRed", "sideYellow", "sideGreen")
+pedLightChannels = ("pedRed", "pedGreen")
 
 
-def set_maintenance_LEDs(board: pymata4.Pymata4, state: bool) -> None:
-	"""Turns the maintenance mode flashing LEDs on or off.
+def get_default_plan_definition() -> dict:
+	"""Builds the default stage plan from the light state and stage time tables.
 	
-	:param board: Pymata4 board.
-	:param state: Whether to turn the LEDs on or off.
+	:returns: Stage plan definition, see StagePlan.
 	"""
-	global maintenanceLEDsState, outputsModified
-
-	maintenanceLEDsState = state
-	outputsModified = True
-	write_outputs(board)
+	stages = []
+	for stage, duration in enumerate(stageTimes):
+		stages.append({
+			"lights": lightStates[stage],
+			"duration": duration,
+			"outputs": stageOutputs.get(stage, ()),
+			"pedestrianTime": pedestrianStageTime if stage == 0 else None,
+			"extensionTime": yellowLightExtensionTime if lightStates[stage][0] == 1 else 0
+		})
 
+	return {"name": "default", "stages": stages}
 
-def reset(board: pymata4.Pymata4) -> None:
-	"""Shuts off all outputs.
-	
-	:param board: The Pymata4 board.
-	"""
 
-	global trafficStage, trafficStageTimer, lastUpdateTime, currentStageTime
-	global mainLightStates, sideLightStates, pedLightStates, overHeightBuzzerState, overHeightLEDState, maintenanceLEDsState, stage4BuzzerState, stage5BuzzerState, outputsModified
-	global overHeightBuzzerTimer, overHeightLEDTimer
-	global sevenSegRefreshes, yellowLightExtensionUsed
-	
-	trafficStage = 0
-	trafficStageTimer = stageTimes[0]
-	currentStageTime = 0
-	lastUpdateTime = time.time()
-	sevenSegRefreshes = 0
-	yellowLightExtensionUsed = False
-
-	for i in range(3):
-		mainLightStates[i] = 0
-		sideLightStates[i] = 0
-
-		if i != 2:
-			pedLightStates[i] = 0
+def compile_stage_plan(definition: dict) -> StagePlan.StagePlan:
+	"""Compiles a stage plan for the lights on the aux shift register.
 	
-	overHeightBuzzerState = 0
-	overHeightLEDState = 0
-	maintenanceLEDsState = 0
-	stage4BuzzerState = 0
-	stage5BuzzerState = 0
+	:param definition: Stage plan definition, see StagePlan
 
-	overHeightBuzzerTimer = -1
-	overHeightLEDTimer = -1
-	outputsModified = True
-
-	SevenSeg.reset(board)
-
-
-def write_outputs(board: pymata4.Pymata4, forceWrite: bool = False):
-	"""Updates the physical output components by pushing new data into the auxillary shift register.
-	
-	:param board: Pymata4 board.
-	:param forceWrite: [optional] Whether to forcefully write the current values, regardless of whether they were modified.
+	:returns: The compiled stage plan.
 	"""
+	return StagePlan.StagePlan(definition, auxChannels, (mainLightChannels, sideLightChannels, pedLightChannels))
 
-	global outputsModified 
-
-	if not outputsModified and not forceWrite:
-		return
-
-	sequence = []
 
-	sequence += mainLightStates
-	sequence += sideLightStates
-	sequence += pedLightStates
+def load_stage_plan(path: str) -> StagePlan.StagePlan:
+	"""Loads and compiles a stage plan for the lights on the aux shift register.
+	
+	:param path: Path of the JSON stage plan, see StagePlan
 
-	sequence.append(overHeightBuzzerState)
-	sequence.append(overHeightLEDState)
-	sequence.append(maintenanceLEDsState)
-	sequence.append(stage4BuzzerState)
-	sequence.append(stage5BuzzerState)
+	:returns: The compiled stage plan.
+	"""
+	return StagePlan.load(path, auxChannels, (mainLightChannels, sideLightChannels, pedLightChannels))
 
-	ShiftReg.write_shift_reg(board, auxSerPin, auxSrClkPin, sequence, True)
-	ShiftReg.display_output(board, auxRClkPin)
 
-	outputsModified = False
+defaultStagePlan = compile_stage_plan(get_default_plan_definition())
 
 
-def get_main_light_state() -> int:
-	"""Gets the current state of the main road traffic lights.
-	
-	:returns: Main traffic light state. 0 is red, 1 is yellow, 2 is green.
-	"""
-	return lightStates[trafficStage][0]
+class Outputs:
+	"""Traffic lights, buzzers, indicator LEDs and seven segment display of one board, and the traffic stage they show."""
 
+	__slots__ = (
+		"board", "intersectionNumber", "inputs", "display", "auxFrame", "stagePlan", "heightLimit", "yellowLightExtensionDistance",
+		"trafficStage", "appliedStage", "trafficStageTimer", "currentStageTime", "lastUpdateTime",
+		"sevenSegRefreshes", "sevenSegBackgroundRefresh", "sevenSegExternalRefresh", "yellowLightExtensionUsed", "isNight",
+		"overHeightBuzzerTimer", "overHeightLEDTimer"
+	)
 
-def update_traffic_stage(deltaTime: float) -> None:
-	"""Updates the current traffic stage.
-	
-	:param deltaTime: Time since the last call to this function.
-	"""
+	def __init__(self, board: pymata4.Pymata4, inputs: inputsSubsystem.Inputs, stagePlan: StagePlan.StagePlan | None = None):
+		"""Creates the output subsystem for a board. Nothing is sent to the board until init is called.
+		
+		:param board: The arduino board the outputs are connected to.
+		:param inputs: Input subsystem of the same board, for the pedestrian buttons and the day/night state
+		:param stagePlan: [optional] Stage plan to run. Defaults to the default plan.
+		"""
+		self.board = board
+		# Recorded with every event, so the events of several intersections in one log can be told apart
+		self.intersectionNumber = 0
+		self.inputs = inputs
+		self.display = SevenSeg.Display(board)
+		self.auxFrame = ShiftReg.Framebuffer(auxSerPin, auxSrClkPin, auxRClkPin, len(auxChannels), auxChannels)
+
+		self.stagePlan = defaultStagePlan if stagePlan is None else stagePlan
+		self.heightLimit = heightLimit
+		self.yellowLightExtensionDistance = yellowLightExtensionDistance
+
+		self.trafficStage = 0
+		# Stage whose lights are on the aux frame, None if they need writing
+		self.appliedStage = None
+		self.trafficStageTimer = 0
+		self.currentStageTime = 0
+		self.lastUpdateTime = 0
+
+		self.sevenSegRefreshes = 0
+		self.sevenSegBackgroundRefresh = sevenSegBackgroundRefresh
+		# Whether something else, such as the async display task, refreshes the seven segment display. Overrides the setting above.
+		self.sevenSegExternalRefresh = False
+		self.yellowLightExtensionUsed = False
+		self.isNight = False
+
+		self.overHeightBuzzerTimer = -1
+		self.overHeightLEDTimer = -1
+
+	def init(self) -> None:
+		"""Initializes output variables and board pins."""
+		board = self.board
+
+		board.set_pin_mode_digital_output(auxSerPin)
+		board.set_pin_mode_digital_output(auxSrClkPin)
+		board.set_pin_mode_digital_output(auxRClkPin)
+
+		self.display.init()
+		ShiftReg.init(board, auxSerPin, auxSrClkPin, auxRClkPin)
+
+		self.display.set_message("HELLO")
+
+		self.inputs.subscribe_day_night(self.set_night)
+
+		self.reset()
+		self.write_outputs()
+
+	def set_stage_plan(self, plan: StagePlan.StagePlan) -> None:
+		"""Runs the given stage plan instead of the current one, starting from its first stage.
+		
+		:param plan: Compiled stage plan
+		"""
+		self.stagePlan = plan
+		self.trafficStage = 0
+		self.trafficStageTimer = plan.durations[0]
+		self.appliedStage = None
+
+	def set_night(self, night: bool) -> None:
+		"""Records whether it is day or night, for the seven segment display. Called by the input subsystem when it changes.
+		
+		:param night: Whether it is now night.
+		"""
+		self.isNight = night
 
-	global trafficStageTimer, trafficStage, currentStageTime
-	global sevenSegRefreshes, yellowLightExtensionUsed
+	def set_maintenance_LEDs(self, state: bool) -> None:
+		"""Turns the maintenance mode flashing LEDs on or off.
+		
+		:param state: Whether to turn the LEDs on or off.
+		"""
+		self.auxFrame.set("maintenanceLEDs", state)
+		self.write_outputs()
 
-	trafficStageTimer -= deltaTime
+	def reset(self) -> None:
+		"""Shuts off all outputs."""
+		
+		self.trafficStage = 0
+		self.trafficStageTimer = self.stagePlan.durations[0]
+		self.appliedStage = None
+		self.currentStageTime = 0
+		self.lastUpdateTime = Clock.now()
+		self.sevenSegRefreshes = 0
+		self.yellowLightExtensionUsed = False
+
+		# Turn off every output, and make sure the next write covers the whole chain
+		self.auxFrame.frame = 0
+		self.auxFrame.invalidate()
+
+		self.overHeightBuzzerTimer = -1
+		self.overHeightLEDTimer = -1
+
+		self.display.reset()
+
+	def write_outputs(self, forceWrite: bool = False) -> int:
+		"""Updates the physical output components by pushing new data into the auxillary shift register.
+		Nothing is written if the outputs haven't changed since the last write.
+		
+		:param forceWrite: [optional] Whether to forcefully write the current values, regardless of whether they were modified.
 
-	if trafficStageTimer < 0:
-		if sevenSegRefreshes:
-			print(f"Nominal 7-segment refresh rate: {sevenSegRefreshes / currentStageTime:.2f} Hz.")
+		:returns: Number of serial bytes sent.
+		"""
 
-		trafficStage += 1
-		trafficStage %= len(stageTimes)
-		trafficStageTimer = stageTimes[trafficStage]
-		currentStageTime = 0
-		sevenSegRefreshes = 0
-		yellowLightExtensionUsed = False
+		return self.auxFrame.flush(self.board, forceWrite)
 
+	def get_main_light_state(self) -> int:
+		"""Gets the current state of the main road traffic lights.
+		
+		:returns: Main traffic light state. 0 is red, 1 is yellow, 2 is green.
+		"""
+		return self.stagePlan.lightStates[self.trafficStage][0]
 
-def update(board: pymata4.Pymata4, vehicleDistace: float, vehicleHeight: float) -> None:
-	"""Operates outputs of the system.
-	
-	:param board: arduino board
-	"""
+	def update_traffic_stage(self, deltaTime: float) -> None:
+		"""Updates the current traffic stage.
+		
+		:param deltaTime: Time since the last call to this function.
+		"""
+
+		self.trafficStageTimer -= deltaTime
+
+		if self.trafficStageTimer < 0:
+			if self.display.is_refresher_running():
+				Logger.info("Measured 7-segment refresh rate: {rate:.2f} Hz.", rate=self.display.get_measured_refresh_rate())
+			elif self.sevenSegRefreshes:
+				Logger.info("Nominal 7-segment refresh rate: {rate:.2f} Hz.", rate=self.sevenSegRefreshes / self.currentStageTime)
+				Metrics.gauge(Metrics.scoped_name(BoardProxy.get_metric_scope(self.board), SevenSeg.refreshRateMetricName)).set(
+					self.sevenSegRefreshes / self.currentStageTime)
+
+			self.trafficStage = self.stagePlan.nextStages[self.trafficStage]
+			self.trafficStageTimer = self.stagePlan.durations[self.trafficStage]
+			self.currentStageTime = 0
+			self.sevenSegRefreshes = 0
+			self.yellowLightExtensionUsed = False
+
+	@Metrics.timed("outputs.update", BoardProxy.get_owner_metric_scope)
+	def update(self, vehicleDistace: float, vehicleHeight: float) -> None:
+		"""Operates outputs of the system.
+		
+		:param vehicleDistace: Distance to the next vehicle, in cm
+		:param vehicleHeight: Height of the next vehicle, in cm
+		"""
 
-	global mainLightStates, sideLightStates, pedLightStates, outputsModified, lastUpdateTime
-	global trafficStageTimer, currentStageTime
-	global overHeightBuzzerState, overHeightBuzzerTimer
-	global overHeightLEDState, overHeightLEDTimer
-	global stage4BuzzerState, stage5BuzzerState
-	global sevenSegRefreshes, yellowLightExtensionUsed
-	
-	deltaTime = time.time() - lastUpdateTime
-	lastUpdateTime = time.time()
-	currentStageTime += deltaTime
+		stagePlan = self.stagePlan
+		auxFrame = self.auxFrame
 
-	# In stage 1, set remaining time to 5 seconds if one of the ped buttons is pressed
-	pedButtonPressed = InputsSubsystem.pedestrian_button_pressed(0) or \
-		InputsSubsystem.pedestrian_button_pressed(1)
+		currentTime = Clock.now()
+		deltaTime = currentTime - self.lastUpdateTime
+		self.lastUpdateTime = currentTime
+		self.currentStageTime += deltaTime
 
-	if trafficStage == 0 and pedButtonPressed:
-		trafficStageTimer = min(trafficStageTimer, 5)
+		# Shorten stages that have a pedestrian time, such as stage 1, if one of the ped buttons is pressed
+		pedButtonPressed = self.inputs.pedestrian_button_pressed(0) or \
+			self.inputs.pedestrian_button_pressed(1)
 
-	prevTrafficStage = trafficStage
-	update_traffic_stage(deltaTime)
-	stageStates = lightStates[trafficStage]
-	
-	if trafficStage != prevTrafficStage:
-		for i in range(3):
-			mainLightStates[i] = stageStates[0] == i
-			sideLightStates[i] = stageStates[1] == i
+		pedestrianTime = stagePlan.pedestrianTimes[self.trafficStage]
+		if pedestrianTime is not None and pedButtonPressed:
+			self.trafficStageTimer = min(self.trafficStageTimer, pedestrianTime)
 
-			if i != 2:
-				pedLightStates[i] = stageStates[2] == i
+		self.update_traffic_stage(deltaTime)
 		
-		stage4BuzzerState = int(trafficStage == 3)
-		stage5BuzzerState = int(trafficStage == 4)
-
-		outputsModified = True
+		if self.trafficStage != self.appliedStage:
+			auxFrame.set_masked(stagePlan.mask, stagePlan.frames[self.trafficStage])
+			self.appliedStage = self.trafficStage
+			
+		sevenSegMessage = f"SG {self.trafficStage + 1} {str(int(self.trafficStageTimer)).rjust(2)}s "
+		if self.isNight:
+			sevenSegMessage += "night"
+		else:
+			sevenSegMessage += "day"
+		self.display.set_message(sevenSegMessage, False)
+
+		blinkState = (self.currentStageTime % (1 / blinkFrequency)) * blinkFrequency < 0.5
+		blinkMask = stagePlan.blinkMasks[self.trafficStage]
+		if blinkMask:
+			auxFrame.set_masked(blinkMask, blinkMask if blinkState else 0)
 		
-	sevenSegMessage = f"SG {trafficStage + 1} {str(int(trafficStageTimer)).rjust(2)}s "
-	if InputsSubsystem.is_night(board):
-		sevenSegMessage += "night"
-	else:
-		sevenSegMessage += "day"
-	SevenSeg.set_message(sevenSegMessage, False)
-
-	blinkState = (currentStageTime % (1 / blinkFrequency)) * blinkFrequency < 0.5
-	if stageStates[2] == 2 and blinkState != pedLightStates[1]:
-		pedLightStates[1] = blinkState
-		outputsModified = True
-	
-	if vehicleHeight > heightLimit:
-		overHeightBuzzerTimer = 2
-		overHeightLEDTimer = 6
+		if vehicleHeight > self.heightLimit:
+			self.overHeightBuzzerTimer = 2
+			self.overHeightLEDTimer = 6
 
-		if overHeightBuzzerState == 0 and overHeightLEDState == 0:
-			print("WARNING: Vehicle exceeding maximum height detected.")
+			if auxFrame.get("overHeightBuzzer") == 0 and auxFrame.get("overHeightLED") == 0:
+				Logger.warning("Vehicle exceeding maximum height detected.", height=vehicleHeight)
+				EventLog.log_event(EventLog.alertEvent, EventLog.overHeightAlert, vehicleHeight, intersection=self.intersectionNumber)
 
-		if overHeightBuzzerState == 0:
-			overHeightBuzzerState = 1
-			outputsModified = True
+			auxFrame.set("overHeightBuzzer", 1)
+			auxFrame.set("overHeightLED", 1)
 
-		if overHeightLEDState == 0:
-			overHeightLEDState = 1
-			outputsModified = True
+		extensionTime = stagePlan.extensionTimes[self.trafficStage]
+		# A distance of 0 means there are no valid readings, so there is no vehicle to extend the light for
+		if extensionTime and 0 < vehicleDistace < self.yellowLightExtensionDistance and not self.yellowLightExtensionUsed:
+			self.trafficStageTimer += extensionTime
+			self.yellowLightExtensionUsed = True
 
-	if get_main_light_state() == 1 and vehicleDistace < yellowLightExtensionDistance and not yellowLightExtensionUsed:
-		trafficStageTimer += 3
-		yellowLightExtensionUsed = True
+		if self.overHeightBuzzerTimer > 0:
+			self.overHeightBuzzerTimer -= deltaTime
 
-	if overHeightBuzzerTimer > 0:
-		overHeightBuzzerTimer -= deltaTime
+			if self.overHeightBuzzerTimer <= 0:
+				auxFrame.set("overHeightBuzzer", 0)
 
-		if overHeightBuzzerTimer <= 0:
-			overHeightBuzzerState = 0
-			outputsModified = True
+		if self.overHeightLEDTimer > 0:
+			self.overHeightLEDTimer -= deltaTime
 
-	if overHeightLEDTimer > 0:
-		overHeightLEDTimer -= deltaTime
+			if self.overHeightLEDTimer <= 0:
+				auxFrame.set("overHeightLED", 0)
+				
+		self.write_outputs()
 
-		if overHeightLEDTimer <= 0:
-			overHeightLEDState = 0
-			outputsModified = True
-			
-	write_outputs(board)
+		if self.sevenSegExternalRefresh:
+			return
+
+		if self.sevenSegBackgroundRefresh:
+			# Only publish the message, the refresher takes care of the display
+			if not self.display.is_refresher_running():
+				self.display.start_refresher()
+			return
+
+		self.refresh_display()
 
-	prevSevenSegChar = SevenSeg.lastCharDisplayed
-	SevenSeg.update(board)
+	def refresh_display(self) -> None:
+		"""Shows the next digit of the seven segment display, and counts each full refresh for the refresh rate.
+		Called by update, or by whatever drives the display when sevenSegExternalRefresh is set.
+		"""
+		prevSevenSegChar = self.display.lastCharDisplayed
+		self.display.update()
 
-	if SevenSeg.lastCharDisplayed == 0 and prevSevenSegChar != 0:
-		sevenSegRefreshes += 1
+		if self.display.lastCharDisplayed == 0 and prevSevenSegChar != 0:
+			self.sevenSegRefreshes += 1